@@ -0,0 +1,19 @@
+import pytest
+
+from tn_cache import is_lookup_response
+
+
+@pytest.mark.parametrize('response_text', [
+    '{"landrecords": {"response": []}}',
+    '<?xml version="1.0" encoding="UTF-8"?><root><subdiv><subdivcode>1</subdivcode></subdiv></root>',
+])
+def test_lookup_response(response_text):
+    assert is_lookup_response(response_text)
+
+
+@pytest.mark.parametrize('response_text', [
+    '', '   ', '{"landrecords": ', 'Internal error',
+    '<html><body>Service temporarily unavailable<br></body></html>',
+])
+def test_not_lookup_response(response_text):
+    assert not is_lookup_response(response_text)
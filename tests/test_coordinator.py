@@ -0,0 +1,63 @@
+import time
+import pytest
+from tn_coordinator import WorkQueue, LeaseHeartbeat
+
+ITEMS = [ (f"13/1/{n}/0", { 'survey_no': str(n) }) for n in range(1, 6) ]
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'work.db'), max_attempts=2)
+    queue.enqueue('tslr', ITEMS)
+    yield queue
+    queue.close()
+
+def statuses(queue):
+    return dict(queue.counts('tslr')['tslr'])
+
+def test_claim_is_exclusive(queue):
+    assert queue.enqueue('tslr', ITEMS[:2]) == 0 ## Already queued
+    first = queue.claim('tslr', 'a', batch_size=3)
+    second = queue.claim('tslr', 'b', batch_size=3)
+    assert [ key for key, _ in first ] == [ key for key, _ in ITEMS[:3] ]
+    assert [ key for key, _ in second ] == [ key for key, _ in ITEMS[3:] ]
+    assert first[0][1] == { 'survey_no': '1' }
+    assert queue.claim('tslr', 'c') == []
+
+def test_complete_and_fail(queue):
+    (key1, _), (key2, _) = queue.claim('tslr', 'a', batch_size=2)
+    assert queue.complete('tslr', key1, 'a') == 1
+    queue.fail('tslr', key2, 'a', 'ValueError: boom')
+    assert statuses(queue) == { 'done': 1, 'pending': 4 }
+    ## Failed once: claimed again, failed for good at max_attempts
+    assert [ key for key, _ in queue.claim('tslr', 'a', batch_size=5) if key == key2 ] == [key2]
+    queue.fail('tslr', key2, 'a', 'ValueError: boom')
+    assert statuses(queue)['failed'] == 1
+
+def test_expired_lease_requeued_then_failed(queue):
+    key, _ = queue.claim('tslr', 'a', batch_size=1, lease_seconds=-1)[0]
+    assert queue.heartbeat('tslr', 'b') == 0
+    assert queue.requeue_expired('tslr') == 1
+    assert statuses(queue) == { 'pending': 5 }
+    assert queue.claim('tslr', 'b', batch_size=1, lease_seconds=-1)[0][0] == key
+    assert queue.requeue_expired('tslr') == 0 ## Second attempt of 2
+    assert statuses(queue) == { 'failed': 1, 'pending': 4 }
+
+def test_lost_lease_cannot_complete(queue):
+    key, _ = queue.claim('tslr', 'a', batch_size=1, lease_seconds=-1)[0]
+    queue.requeue_expired('tslr')
+    assert queue.claim('tslr', 'b', batch_size=1)[0][0] == key
+    assert queue.complete('tslr', key, 'a') == 0
+    queue.fail('tslr', key, 'a', 'late failure')
+    assert statuses(queue) == { 'leased': 1, 'pending': 4 }
+    assert queue.complete('tslr', key, 'b') == 1
+
+def test_heartbeat_extends_and_releases(queue):
+    queue.claim('tslr', 'a', batch_size=2, lease_seconds=0.3)
+    connections = len(queue.connections)
+    ## Three batches outlive the claimed lease, each heartbeat thread closes its connection
+    for _ in range(3):
+        with LeaseHeartbeat(queue, 'tslr', 'a', lease_seconds=0.3):
+            time.sleep(0.25)
+    assert queue.requeue_expired('tslr') == 0
+    assert statuses(queue) == { 'leased': 2, 'pending': 3 }
+    assert len(queue.connections) == connections
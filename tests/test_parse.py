@@ -0,0 +1,94 @@
+from pathlib import Path
+import pytest
+import tn_parse
+import tn_parse_legacy
+
+#---------------------------------------------------------------------------------
+# Parity of the lxml parsers (tn_parse) with the BeautifulSoup ones
+# (tn_parse_legacy) on the saved, anonymised responses in tests/responses.
+#---------------------------------------------------------------------------------
+RESPONSE_DIR = Path(__file__).resolve().parent / 'responses'
+RESPONSES = sorted(RESPONSE_DIR.glob('*.html'))
+
+PARSERS = {
+    'patta': (lambda h: tn_parse.extract_patta_details('test', h), lambda h: tn_parse_legacy.extract_patta_details('test', h)),
+    'tslr': (tn_parse.extract_tslr_details, tn_parse_legacy.extract_tslr_details),
+}
+
+def parse(parser, html_text):
+    ## Result, or the exception type when the parser fails on the page
+    try:
+        return parser(html_text)
+    except (IndexError, AttributeError, ValueError) as e:
+        return type(e).__name__
+
+@pytest.mark.parametrize('name', list(PARSERS))
+@pytest.mark.parametrize('path', RESPONSES, ids=lambda p: p.stem)
+def test_parity(path, name, capsys):
+    html_text = path.read_text(encoding='utf-8')
+    parser, reference = PARSERS[name]
+    assert parse(parser, html_text) == parse(reference, html_text)
+
+def read_response(name):
+    return (RESPONSE_DIR / name).read_text(encoding='utf-8')
+
+def test_patta_found():
+    patta_details = tn_parse.extract_patta_details('test', read_response('patta_found.html'))
+    assert patta_details['patta_number'] == '1234'
+    assert list(patta_details['survey']) == ['12/3A', '12']
+    assert patta_details['people'] == { 1: 'ராமன் & co மகன்', 2: 'சீதா மனைவி' }
+
+def test_patta_found_rowspan():
+    patta_details = tn_parse.extract_patta_details('test', read_response('patta_found_rowspan.html'))
+    assert patta_details['patta_number'] == '1234'
+    assert len(patta_details['survey']) == 5
+    assert patta_details['survey']['100']['details'] == 'note 0'
+    assert patta_details['survey']['101/2A']['details'] == 'note 0' ## Remarks cell spanning two rows
+
+def test_tslr_found():
+    details = tn_parse.extract_tslr_details(read_response('tslr_found.html'))
+    assert details['block_code'] == 'B233'
+    assert details['remarks'] == 'rem x'
+
+@pytest.mark.parametrize('name', ['patta_captcha_error.html', 'patta_not_found.html', 'tslr_captcha_error.html', 'tslr_not_found.html', 'session_expired.html'])
+def test_no_record(name, capsys):
+    html_text = read_response(name)
+    assert not tn_parse.extract_patta_details('test', html_text)
+    assert tn_parse.extract_tslr_details(html_text) is None
+
+#---------------------------------------------------------------------------------
+# Response classes: NOT_FOUND is recorded for good, so only a positive match is one
+#---------------------------------------------------------------------------------
+@pytest.mark.parametrize('name, response_class', [
+    ('patta_captcha_error.html', tn_parse.CAPTCHA_REJECTED),
+    ('tslr_captcha_error.html', tn_parse.CAPTCHA_REJECTED),
+    ('patta_not_found.html', tn_parse.NOT_FOUND),
+    ('tslr_not_found.html', tn_parse.NOT_FOUND),
+    ('session_expired.html', tn_parse.SESSION_EXPIRED),
+])
+def test_classify_response(name, response_class):
+    assert tn_parse.classify_response(200, read_response(name), None) == response_class
+
+@pytest.mark.parametrize('html_text', [
+    '',
+    '<html><body>Oops</body></html>',
+    ## Unknown pages with a layout table are not an empty result
+    '<html><body><table><tr><td>Site under maintenance, try again later</td></tr></table></body></html>',
+    '<html><body><table><tr><td><b>Error 1042</b></td></tr></table></body></html>',
+    ## Maintenance pages: 'not available' is about the service, not the record
+    '<html><body><p>Service temporarily not available. Please try later.</p></body></html>',
+    '<html><body><table><tr><td>Server busy: service not available</td></tr></table></body></html>',
+    '<html><body><p>No records found</p></body></html>',
+    '<html><body><form name="landForm"><font class="normal_text_red">Service not available</font></form></body></html>',
+    ## Search form without a reason
+    '<html><body><form name="landForm"><table><tr><td><font class="normal_text_red"></font></td></tr></table></form></body></html>',
+])
+def test_classify_unknown_pages_are_retried(html_text):
+    assert tn_parse.classify_response(200, html_text, None) == tn_parse.SERVER_ERROR
+
+def test_classify_status_and_found():
+    assert tn_parse.classify_response(503, read_response('tslr_found.html'), None) == tn_parse.SERVER_ERROR
+    ## A proxy's 404 is not the record missing
+    assert tn_parse.classify_response(404, '<html><body><h1>Not Found</h1></body></html>', None) == tn_parse.SERVER_ERROR
+    assert tn_parse.classify_response(404, read_response('patta_not_found.html'), None) == tn_parse.SERVER_ERROR
+    assert tn_parse.classify_response(200, read_response('tslr_found.html'), { 'block_code': 'B233' }) == tn_parse.SUCCESS
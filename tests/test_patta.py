@@ -0,0 +1,50 @@
+import io
+import pytest
+import tn_patta
+
+def survey(patta_number):
+    return { f"{patta_number}": { 'land_type': 'நன்செய்', 'hectares': 0, 'ares': 45, 'cents': 50, 'amount': 1.2, 'details': '' } }
+
+@pytest.fixture
+def patta_store(tmp_path):
+    tn_patta.initialize_sqlite_db(str(tmp_path / 'patta.db'))
+    ## A patta migrated from before village_code, and one of a known village
+    tn_patta.insert_patta_details({ 'patta_number': 1, 'people': { 1: 'ராமன்' }, 'survey': survey(1) }, '')
+    tn_patta.insert_patta_details({ 'patta_number': 2, 'people': { 1: 'சீதா' }, 'survey': survey(2) }, '29/02/003')
+    yield tn_patta.patta_store
+    tn_patta.patta_store.close()
+
+@pytest.mark.parametrize('village_key, valid', [('29/02/003', True), ('', False), ('29/02', False), ('29//003', False)])
+def test_is_village_key(village_key, valid):
+    assert tn_patta.is_village_key(village_key) == valid
+
+def test_refresh_skips_pattas_without_village(patta_store, monkeypatch):
+    fetched = []
+    def fetch_patta_details(session, identifier, sdiv, captcha_stage=None, **kwargs):
+        fetched.append((tn_patta.get_village_key(**kwargs), identifier))
+        return { 'patta_number': 2, 'people': { 1: 'சீதா' }, 'survey': survey(2) }, '<html></html>', 'success'
+    monkeypatch.setattr(tn_patta, 'fetch_patta_details', fetch_patta_details)
+    counts = tn_patta.refresh_pattas(None, io.StringIO())
+    assert fetched == [('29/02/003', '2')]
+    assert counts['no_village'] == 1
+    assert counts['requests'] == 1
+
+def test_pdf_of_stored_pattas(patta_store, tmp_path, monkeypatch, capsys):
+    ## Answered from SQLite: rendered from the response archived for any survey line of the patta
+    import tn_archive
+    archive = tn_archive.ResponseArchive(str(tmp_path / 'archive'))
+    monkeypatch.setattr(tn_archive, 'response_archive', archive)
+    archive.put('patta', '29/02/003|2', { 'village_code': '29/02/003', 'identifier': '2' }, '<html>patta 2</html>')
+    pdf = tn_patta.PdfRenderer(str(tmp_path / 'pdf'), workers=1)
+    submitted = []
+    monkeypatch.setattr(pdf, 'submit', lambda identifier, village_key, patta_number, html_text: submitted.append((identifier, patta_number, html_text)))
+    try:
+        tn_patta.get_patta_details(None, '2', '0', pdf=pdf, **tn_patta.get_survey_kwargs(('29', '02', '003'), '2'))
+        pdf.submit_stored('2/1', '29/02/003', tn_patta.select_patta_details('2', '29/02/003'))
+        pdf.submit_stored('1', '', tn_patta.select_patta_details('1', ''))
+        assert submitted == [('2', 2, '<html>patta 2</html>'), ('2/1', 2, '<html>patta 2</html>')]
+        assert pdf.missing == 1
+        assert 'Survey 1: No archived response for Patta 1, PDF skipped' in capsys.readouterr().out
+    finally:
+        pdf.close()
+        archive.close()
@@ -0,0 +1,117 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pytest
+import tn_parse
+import tn_patta
+import tn_service
+from tn_service import LruCache, SingleFlight, PattaLookup
+
+RESPONSE_DIR = Path(__file__).resolve().parent / 'responses'
+VILLAGE_CODES = ('29', '02', '003')
+VILLAGE_KEY = '29/02/003'
+
+def test_single_flight_distinct_keys():
+    ## Loads that are done before do() returns must not wedge the next keys
+    with ThreadPoolExecutor(2) as executor:
+        single_flight = SingleFlight(executor)
+        worker = threading.Thread(target=lambda: [ single_flight.do(key, lambda: key) for key in range(1000) ], daemon=True)
+        worker.start()
+        worker.join(timeout=10)
+        assert not worker.is_alive()
+        assert not single_flight.in_flight
+
+def test_single_flight_shares_load():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'answer'
+    with ThreadPoolExecutor(2) as executor:
+        single_flight = SingleFlight(executor)
+        results = []
+        first = threading.Thread(target=lambda: results.append(single_flight.do('key', load)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(single_flight.do('key', load)))
+        second.start()
+        release.set()
+        first.join(5); second.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [('answer', False), ('answer', True)]
+
+def test_single_flight_failure_is_not_kept():
+    def load():
+        raise ValueError('boom')
+    with ThreadPoolExecutor(1) as executor:
+        single_flight = SingleFlight(executor)
+        with pytest.raises(ValueError):
+            single_flight.do('key', load)
+        assert single_flight.do('key', lambda: 'answer') == ('answer', False)
+
+def test_lru_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(tn_service.time, 'monotonic', lambda: now[0])
+    cache = LruCache(maxsize=2, ttl=10)
+    cache.put('a', 1)
+    now[0] += 9
+    assert cache.get('a') == 1
+    now[0] += 1
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+def test_lru_cache_evicts_least_recent():
+    cache = LruCache(maxsize=2)
+    cache.put('a', 1); cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+
+@pytest.fixture
+def patta_store(tmp_path):
+    tn_patta.initialize_sqlite_db(str(tmp_path / 'patta.db'))
+    patta_details = tn_parse.extract_patta_details('12/3A', (RESPONSE_DIR / 'patta_found.html').read_text(encoding='utf-8'))
+    tn_patta.insert_patta_details(patta_details, VILLAGE_KEY)
+    tn_patta.patta_store.mark_not_found('99', VILLAGE_KEY)
+    yield tn_patta.patta_store
+    tn_patta.patta_store.close()
+
+def test_lookup_from_store(patta_store):
+    lookup = PattaLookup(fetch=False)
+    try:
+        status, body = lookup.lookup(VILLAGE_CODES, '12', '3A')
+        assert status == 200
+        assert json.loads(body)['patta_number'] == 1234
+        assert lookup.lookup(VILLAGE_CODES, '99')[0] == 404
+        assert lookup.lookup(VILLAGE_CODES, '12', '3A')[0] == 200
+        assert lookup.summary()['hits'] == 1
+        assert lookup.summary()['stored'] == 2
+    finally:
+        lookup.close()
+
+def test_load_fetches_on_loader(patta_store, monkeypatch):
+    fetched = []
+    def get_patta_details(session, identifier, subdiv_code, **kwargs):
+        fetched.append((identifier, threading.current_thread().name))
+        if identifier == '40':
+            patta_store.mark_not_found(identifier, tn_patta.get_village_key(**kwargs))
+            return None
+        return { 'patta_number': 77, 'people': {}, 'survey': {} } if identifier == '41' else None
+    monkeypatch.setattr(tn_patta, 'get_patta_details', get_patta_details)
+    monkeypatch.setattr(tn_patta, 'new_session', lambda: None)
+    lookup = PattaLookup(fetch=True)
+    lookup.get_session = lambda: None
+    try:
+        assert lookup.lookup(VILLAGE_CODES, '12', '3A')[0] == 200 ## patta.db, never fetched
+        assert lookup.lookup(VILLAGE_CODES, '41')[0] == 200
+        assert lookup.lookup(VILLAGE_CODES, '40')[0] == 404
+        assert lookup.lookup(VILLAGE_CODES, '42')[0] == 503
+        assert lookup.lookup(VILLAGE_CODES, '42')[0] == 503 ## Failures are not cached
+        assert [ identifier for identifier, _ in fetched ] == ['41', '40', '42', '42']
+        assert all(name.startswith('loader') for _, name in fetched)
+        assert lookup.summary()['failed'] == 2
+    finally:
+        lookup.close()
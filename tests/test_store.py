@@ -0,0 +1,71 @@
+import sqlite3
+import pytest
+from tn_store import PattaStore
+
+VILLAGE_KEY = '29/02/003'
+
+def patta(patta_number, *names):
+    return {
+        'patta_number': patta_number,
+        'people': { idx: name for idx, name in enumerate(names, 1) },
+        'survey': { f"{patta_number}": { 'land_type': 'நன்செய்', 'hectares': 0, 'ares': 45, 'cents': 50, 'amount': 1.2, 'details': '' } },
+    }
+
+PATTAS = [
+    patta(1, 'ராமன் மகன் முருகன்'),
+    patta(2, 'கிருஷ்ணன் மகள் மீனாட்சி'),
+    patta(3, 'ராமசாமி மனைவி சீதா', 'கௌசல்யா'),
+]
+
+@pytest.fixture
+def store(tmp_path):
+    store = PattaStore(str(tmp_path / 'patta.db'))
+    store.upsert_patta_details(PATTAS, VILLAGE_KEY)
+    yield store
+    store.close()
+
+def owner_search(store, name):
+    return sorted(p['patta_number'] for p in store.query_pattas(name=name))
+
+@pytest.mark.parametrize('name, pattas', [
+    ('ராமன்', [1]),
+    ('ரா', [1, 3]),           # Prefix of ராமன் and ராமசாமி, not of கிருஷ்ணன்
+    ('ராம', [1, 3]),
+    ('கிருஷ்ணன்', [2]),
+    ('கிரு', [2]),
+    ('மீனாட்சி', [2]),
+    ('கௌசல்யா', [3]),         # Two part vowel sign U+0BCC
+    ('ராமன் முருகன்', [1]),
+    ('ராமன் சீதா', []),
+    ('ர', [1, 3]),
+    ('கிருஷ்ணன் ராமன்', []),
+    ('மணி', []),
+])
+def test_owner_search_tamil(store, name, pattas):
+    assert owner_search(store, name) == pattas
+
+def test_owner_tokens_are_whole_words(store):
+    conn = store.connection()
+    conn.execute("CREATE VIRTUAL TABLE temp.owner_terms USING fts5vocab(main, patta_owners_fts, 'row')")
+    terms = { row[0] for row in conn.execute('SELECT term FROM temp.owner_terms') }
+    assert { 'ராமன்', 'கிருஷ்ணன்', 'ராமசாமி' } <= terms
+    assert 'ர' not in terms
+
+def test_old_owner_index_is_rebuilt(tmp_path):
+    db_path = str(tmp_path / 'patta.db')
+    store = PattaStore(db_path)
+    store.upsert_patta_details(PATTAS, VILLAGE_KEY)
+    store.close()
+    ## The index as created before the Tamil token characters
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('DROP TABLE patta_owners_fts')
+        conn.execute('''CREATE VIRTUAL TABLE patta_owners_fts USING fts5
+            (name, content='patta_owners', content_rowid='rowid', tokenize='unicode61 remove_diacritics 0')''')
+        conn.execute("INSERT INTO patta_owners_fts(patta_owners_fts) VALUES ('rebuild')")
+    store = PattaStore(db_path)
+    try:
+        assert owner_search(store, 'ரா') == [1, 3]
+        store.upsert_patta_details([patta(4, 'ராஜா')], VILLAGE_KEY)
+        assert owner_search(store, 'ரா') == [1, 3, 4]
+    finally:
+        store.close()
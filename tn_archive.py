@@ -0,0 +1,204 @@
+import os
+import io
+import sys
+import json
+import time
+import zlib
+import hashlib
+import tempfile
+import argparse
+import contextlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from tn_store import SqliteStore, PattaStore, TslrStore, PATTA_DB, TSLR_DB
+
+#---------------------------------------------------------------------------------
+# Archive of the raw extract responses, so a parser fix or a new field never needs
+# a re-crawl (and its captchas).
+#
+# Every accepted response is zlib compressed into blobs/<sha256[:2]>/<sha256>.z
+# (identical responses are stored once) and index.db maps the record (patta:
+# village + survey identifier, tslr: the payload key) to its blob.
+#
+#   python tn_archive.py reparse --patta-db patta.db --tslr-db tslr.db
+#
+# rebuilds the SQLite tables from the archive with the parsing spread over all
+# cores, without any network access.
+#---------------------------------------------------------------------------------
+ARCHIVE_DIR = 'archive'
+COMPRESS_LEVEL = 6
+
+def compress(html_text):
+    return zlib.compress(html_text.encode('utf-8'), COMPRESS_LEVEL)
+
+def decompress(blob):
+    return zlib.decompress(blob).decode('utf-8')
+
+class ResponseArchive(SqliteStore):
+    def __init__(self, archive_dir=ARCHIVE_DIR):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(self.archive_dir / 'index.db'))
+
+    def initialize(self):
+        conn = self.connection()
+        with conn:
+            ## kind = patta / tslr, params = what the parser / store needs besides the HTML
+            conn.execute('''
+              CREATE TABLE IF NOT EXISTS responses
+              (
+                kind               VARCHAR(10)       NOT NULL,
+                key                TEXT              NOT NULL,
+                params             TEXT              NOT NULL,
+                blob               CHAR(64)          NOT NULL,
+                fetched_at         REAL              NOT NULL,
+                PRIMARY KEY (kind, key)
+              );
+            ''')
+
+    def get_blob_path(self, blob_hash):
+        return self.archive_dir / 'blobs' / blob_hash[:2] / f"{blob_hash}.z"
+
+    def put(self, kind, key, params, html_text):
+        blob_hash = hashlib.sha256(html_text.encode('utf-8')).hexdigest()
+        path = self.get_blob_path(blob_hash)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            ## Temp file unique per writer (threads of one process included), the same blob may be written concurrently
+            with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f"{blob_hash}.", suffix='.tmp', delete=False) as f:
+                f.write(compress(html_text))
+            os.replace(f.name, path)
+        conn = self.connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO responses VALUES(?, ?, ?, ?, ?)',
+                (kind, key, json.dumps(params), blob_hash, time.time()))
+        return blob_hash
+
+    def get(self, blob_hash):
+        return decompress(self.get_blob_path(blob_hash).read_bytes())
+
+    def lookup(self, kind, key):
+        ## Archived response of one record, None when it was never archived
+        row = self.connection().execute('SELECT blob FROM responses WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        if row is None or not self.get_blob_path(row['blob']).exists():
+            return None
+        return self.get(row['blob'])
+
+    def entries(self, kind):
+        rows = self.connection().execute('SELECT key, params, blob FROM responses WHERE kind = ? ORDER BY key', (kind,))
+        for row in rows:
+            yield row['key'], json.loads(row['params']), row['blob']
+
+response_archive = None
+
+def set_response_archive(archive):
+    global response_archive
+    response_archive = archive
+
+def archive_response(kind, key, params, html_text):
+    if response_archive:
+        response_archive.put(kind, key, params, html_text)
+
+def archived_response(kind, key):
+    return response_archive.lookup(kind, key) if response_archive else None
+
+def add_archive_arguments(parser):
+    parser.add_argument("--archive", dest='archive_dir', default=ARCHIVE_DIR, help="Archive the raw extract responses in this directory ('' = off)")
+
+def configure_from_args(args):
+    if args.archive_dir:
+        set_response_archive(ResponseArchive(args.archive_dir))
+
+#---------------------------------------------------------------------------------
+# Re-parse: workers read + decompress + parse a chunk of blobs, the main process
+# is the only SQLite writer
+#---------------------------------------------------------------------------------
+def parse_chunk(archive_dir, kind, chunk):
+    from tn_parse import extract_patta_details, extract_tslr_details
+    blobs_dir = Path(archive_dir) / 'blobs'
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()): ## Parser error prints
+        for key, params, blob_hash in chunk:
+            html_text = decompress((blobs_dir / blob_hash[:2] / f"{blob_hash}.z").read_bytes())
+            if kind == 'patta':
+                details = extract_patta_details(params['identifier'], html_text)
+            else:
+                details = extract_tslr_details(html_text)
+            results.append((key, params, details))
+    return results
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+def save_parsed(kind, store, results):
+    if kind == 'patta':
+        ## Grouped per village, one upsert transaction each
+        villages = {}
+        for _, params, details in results:
+            if details and details.get('patta_number'):
+                villages.setdefault(params['village_code'], []).append(details)
+        for village_code, patta_details_list in villages.items():
+            store.upsert_patta_details(patta_details_list, village_code)
+        return sum(len(v) for v in villages.values())
+    saved = 0
+    for _, payload, details in results:
+        if details:
+            store.save_details(payload, details)
+            saved += 1
+    return saved
+
+def reparse(archive, kind, store, workers=None, chunk_size=200):
+    start = time.monotonic()
+    parsed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = ( executor.submit(parse_chunk, str(archive.archive_dir), kind, chunk) for chunk in chunked(archive.entries(kind), chunk_size) )
+        ## Bounded look-ahead, so a huge archive is not all queued at once
+        pending = []
+        for future in futures:
+            pending.append(future)
+            if len(pending) > 2 * (workers or os.cpu_count()):
+                results = pending.pop(0).result()
+                saved = save_parsed(kind, store, results)
+                parsed += saved
+                failed += len(results) - saved
+        for future in pending:
+            results = future.result()
+            saved = save_parsed(kind, store, results)
+            parsed += saved
+            failed += len(results) - saved
+    elapsed = time.monotonic() - start
+    print(f"Re-parsed {kind}: {parsed} saved, {failed} not parsed in {elapsed:.1f}s // {(parsed + failed) / elapsed if elapsed else 0:.1f} responses/sec")
+    return parsed, failed
+
+def parse_commandline_params():
+    parser = argparse.ArgumentParser(
+        prog='Response Archive',
+        description='Rebuild the patta / TSLR SQLite tables from the archived responses (no network access)'
+    )
+    parser.add_argument("command", choices=['reparse'], help="Re-parse the archive")
+    parser.add_argument("--archive", dest='archive_dir', default=ARCHIVE_DIR, help="Archive directory")
+    parser.add_argument("--kind", dest='kinds', nargs='+', choices=['patta', 'tslr'], default=['patta', 'tslr'], help="Responses to re-parse")
+    parser.add_argument("--patta-db", dest='patta_db', default=PATTA_DB, help="SQLite database for the patta details")
+    parser.add_argument("--tslr-db", dest='tslr_db', default=TSLR_DB, help="SQLite database for the TSLR details")
+    parser.add_argument("--workers", dest='workers', type=int, help="Parser processes (default: all cores)")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    archive = ResponseArchive(args.archive_dir)
+    failures = 0
+    for kind in args.kinds:
+        store = PattaStore(args.patta_db) if kind == 'patta' else TslrStore(args.tslr_db)
+        failures += reparse(archive, kind, store, workers=args.workers)[1]
+        store.close()
+    archive.close()
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,266 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import subprocess
+import platform
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+from decimal import Decimal
+from statistics import median
+from tn_parse import parse_html, table_to_2d, get_survey_details, extract_patta_details
+from tn_store import PattaStore
+
+#---------------------------------------------------------------------------------
+# Micro-benchmarks for the parsing, OCR and storage hot paths and the CLI startup.
+#
+#   python tn_bench.py --save bench_baseline.json      # record a baseline
+#   python tn_bench.py --compare bench_baseline.json   # compare against it
+#
+# Every benchmark reports the median time per operation over --repeat runs; the
+# comparison flags anything slower than the baseline by more than --threshold and
+# exits with 1 if there are regressions.
+#---------------------------------------------------------------------------------
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+SURVEYS_PER_PATTA = 4
+
+def measure(func, number, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number): func()
+        timings.append((time.perf_counter() - start) / number)
+    return { 'per_op': median(timings), 'best': min(timings), 'number': number, 'repeat': repeat }
+
+#---------------------------------------------------------------------------------
+# Synthetic chittaExtract page: same layout as the real one (rowspan/colspan
+# headers, a rowspan'd remarks column and the total row), with `num_surveys` rows
+#---------------------------------------------------------------------------------
+def survey_rows(num_surveys):
+    for idx in range(num_surveys):
+        spread = f" {idx % 3} - {idx % 97 + 1}.{idx % 10}0"
+        cells = [ str(100 + idx), f"{idx % 3 + 1}A" if idx % 2 else '-' ]
+        for land_type in range(3):
+            cells += [ spread, f"{idx % 7}.20" ] if idx % 3 == land_type else [ '-', '' ]
+        if idx % 2: remarks = ''
+        elif idx + 1 < num_surveys: remarks = f'<td rowspan="2">note {idx}</td>'
+        else: remarks = f'<td>note {idx}</td>' ## Not spanning into the total row
+        yield '<tr>' + ''.join(f'<td>{c}</td>' for c in cells) + remarks + '</tr>'
+
+def synthetic_patta_page(num_surveys=50, num_people=6):
+    people = ''.join(f'<tr><td>{idx}.</td><td>உரிமையாளர் {idx}</td><td>மகன்</td></tr>' for idx in range(1, num_people + 1))
+    surveys = ''.join(survey_rows(num_surveys))
+    return f'''<html><head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8"></head><body>
+<table width="100%">
+<tr><td colspan="2" align="center"><b>வட்டம் : பாளையங்கோட்டை</b></td></tr>
+<tr><td>மாவட்டம் : திருநெல்வேலி</td><td><font>பட்டா எண் : 1234</font><br/></td></tr>
+<tr><td colspan="2"><table border="1">{people}</table></td></tr>
+<tr><td colspan="2"><table border="1">
+  <tr><th rowspan="2">புல எண்</th><th rowspan="2">உட்பிரிவு</th><th colspan="2">நன்செய்</th><th colspan="2">புன்செய்</th><th colspan="2">மற்றவை</th><th rowspan="2">குறிப்பு</th></tr>
+  <tr><th>பரப்பு</th><th>தீர்வை</th><th>பரப்பு</th><th>தீர்வை</th><th>பரப்பு</th><th>தீர்வை</th></tr>
+  {surveys}
+  <tr><td colspan="2">மொத்தம்</td><td>1-47.5</td><td>4.6</td><td></td><td></td><td></td><td></td><td></td></tr>
+</table></td></tr></table></body></html>'''
+
+def survey_table(html_text):
+    return parse_html(html_text).findall('.//table')[2]
+
+#---------------------------------------------------------------------------------
+# Benchmarks
+#---------------------------------------------------------------------------------
+def bench_parsing(results, args):
+    for num_surveys in (10, 50):
+        table = survey_table(synthetic_patta_page(num_surveys))
+        results[f'table_to_2d[{num_surveys} rows]'] = measure(lambda: table_to_2d(table), 200, args.repeat)
+        results[f'get_survey_details[{num_surveys} rows]'] = measure(lambda: get_survey_details(table), 200, args.repeat)
+
+    page_sets = { 'synthetic': [ synthetic_patta_page(50) ] }
+    if args.response_dir:
+        page_sets['responses'] = [ p.read_text(encoding='utf-8') for p in sorted(Path(args.response_dir).glob('*.htm*')) ]
+    for name, pages in page_sets.items():
+        if not pages: continue
+        def parse_all():
+            with contextlib.redirect_stdout(io.StringIO()): ## Error pages print
+                for html_text in pages: extract_patta_details('bench', html_text)
+        ## Per page, so that the numbers stay comparable when responses are added
+        timing = measure(parse_all, 20, args.repeat)
+        timing['per_op'] /= len(pages)
+        timing['best'] /= len(pages)
+        results[f'extract_patta_details[{name}]'] = timing
+
+def bench_ocr(results, args):
+    if not args.captcha_corpus:
+        print("Skipping OCR: no --captcha-corpus")
+        return
+    import tn_captcha
+    from tn_classifier import load_corpus
+    samples = load_corpus(args.captcha_corpus)[:args.ocr_samples]
+    if not samples:
+        print(f"Skipping OCR: no captchas in {args.captcha_corpus}")
+        return
+    tn_captcha.set_captcha_model(args.captcha_model)
+    def solve_all():
+        for content, _ in samples: tn_captcha.solve_captcha(content)
+    name = 'classifier' if args.captcha_model else 'tesseract'
+    try:
+        timing = measure(solve_all, 1, args.repeat)
+    except Exception as e:
+        print(f"Skipping OCR: {e}")
+        return
+    ## Per captcha, as get_captcha_value_internal solves one image per call
+    timing['per_op'] /= len(samples)
+    timing['best'] /= len(samples)
+    correct = sum(1 for content, value in samples if tn_captcha.solve_captcha(content)[0] == value)
+    timing['accuracy'] = correct / len(samples)
+    results[f'solve_captcha[{name}]'] = timing
+
+def patta_details(patta_number, num_surveys=SURVEYS_PER_PATTA):
+    survey = {}
+    for idx in range(num_surveys):
+        survey[f"{patta_number}/{idx + 1}A"] = {
+            'land_type': 'dryland', 'hectares': 0.0, 'ares': 45.5, 'cents': Decimal('112.385'),
+            'amount': '1.20', 'details': 'note',
+        }
+    return { 'patta_number': patta_number, 'people': { 1: 'உரிமையாளர் மகன்' }, 'survey': survey }
+
+def populate_store(store, num_rows, batch_size=5000):
+    num_pattas = num_rows // SURVEYS_PER_PATTA
+    for start in range(0, num_pattas, batch_size):
+        store.upsert_patta_details([ patta_details(p) for p in range(start, min(num_pattas, start + batch_size)) ], 'bench')
+    return num_pattas
+
+def bench_store(results, args):
+    for num_rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = PattaStore(str(Path(tmp_dir) / 'bench.db'))
+            start = time.perf_counter()
+            num_pattas = populate_store(store, num_rows)
+            print(f"  Populated {num_rows} rows in {time.perf_counter() - start:.1f}s")
+            rng = random.Random(0)
+            select = lambda: store.select_patta_details(f"{rng.randrange(num_pattas)}/1A", 'bench')
+            results[f'select_patta_details[{num_rows} rows]'] = measure(select, 1000, args.repeat)
+            new_patta = iter(range(num_pattas, num_pattas * 2))
+            insert = lambda: store.upsert_patta_details([ patta_details(next(new_patta)) ], 'bench')
+            results[f'insert_patta_details[{num_rows} rows]'] = measure(insert, 200, args.repeat)
+            store.close()
+
+STARTUP_MODULES = ['tn_patta', 'tn_tslr', 'tn_service', 'tn_coordinator']
+
+REPO_DIR = Path(__file__).resolve().parent
+
+def run_python(argv, cwd=REPO_DIR):
+    ## Fresh interpreter each time: the cost a CLI invocation pays before any work.
+    ## The tn_* modules are found from any cwd (the cache hit runs in its own directory)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ str(REPO_DIR), os.environ.get('PYTHONPATH') ])))
+    subprocess.run([sys.executable] + argv, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def seed_cache_hit(tmp_dir, village_codes=('29', '02', '003'), survey_no='1'):
+    ## patta.db + lookup_cache.db with everything tn_patta.py needs for survey_no, nothing fetched
+    from tn_cache import LookupCache, normalize_query
+    from tn_http import land_url
+    store = PattaStore(str(Path(tmp_dir) / 'patta.db'))
+    store.upsert_patta_details([ patta_details(int(survey_no)) ], '/'.join(village_codes))
+    store.close()
+    cache = LookupCache(str(Path(tmp_dir) / 'lookup_cache.db'))
+    url = land_url('ajax.html')
+    kwargs = { 'page': 'ruralservice', 'lang': 'en' }
+    names = []
+    for ser, code, code_param in zip(('dist', 'tlk', 'vill'), village_codes, ('distcode', 'talukcode', None)):
+        name = f"bench-{ser}"
+        cache.put(normalize_query(url, dict(kwargs, ser=ser)), json.dumps({ 'landrecords': { 'response': [ { 'value': name, 'name': code } ] } }))
+        if code_param: kwargs[code_param] = code
+        names.append(name)
+    district_code, taluk_code, village_code = village_codes
+    subdivs = ''.join(f"<subdiv><subdivcode>{idx + 1}A</subdivcode></subdiv>" for idx in range(SURVEYS_PER_PATTA))
+    cache.put(normalize_query(url, { 'page': 'getSubdivNo', 'districtCode': district_code, 'talukCode': taluk_code,
+        'villageCode': village_code, 'surveyno': survey_no }), f"<root>{subdivs}</root>")
+    with contextlib.redirect_stdout(io.StringIO()):
+        cache.close()
+    return names, survey_no
+
+def bench_startup(results, args):
+    for module in STARTUP_MODULES:
+        results[f'import[{module}]'] = measure(lambda: run_python(['-c', f"import {module}"]), 1, args.repeat)
+    script = str(REPO_DIR / 'tn_patta.py')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        (district, taluk, village), survey_no = seed_cache_hit(tmp_dir)
+        argv = [script, '-d', district, '-t', taluk, '-v', village, '-s', survey_no, '--no-fetch']
+        results['tn_patta.py[cache hit]'] = measure(lambda: run_python(argv, cwd=tmp_dir), 1, args.repeat)
+
+BENCHMARKS = { 'parse': bench_parsing, 'ocr': bench_ocr, 'store': bench_store, 'startup': bench_startup }
+
+#---------------------------------------------------------------------------------
+# Baselines
+#---------------------------------------------------------------------------------
+def format_time(seconds):
+    if seconds >= 1: return f"{seconds:.2f}s"
+    if seconds >= 1e-3: return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+def save_baseline(path, results):
+    baseline = { 'python': platform.python_version(), 'machine': platform.platform(), 'created_at': time.time(), 'results': results }
+    Path(path).write_text(json.dumps(baseline, indent=2), encoding='utf-8')
+    print(f"Saved {len(results)} result(s) to {path}")
+
+def compare(path, results, threshold):
+    baseline = json.loads(Path(path).read_text(encoding='utf-8'))
+    print(f"Compared to {path} (python {baseline['python']}, {baseline['machine']})")
+    regressions = 0
+    for name, timing in results.items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            print(f"  {name:<44} {format_time(timing['per_op']):>10}  (new)")
+            continue
+        ratio = timing['per_op'] / reference['per_op']
+        if ratio > 1 + threshold:
+            status = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            status = 'faster'
+        else:
+            status = ''
+        print(f"  {name:<44} {format_time(reference['per_op']):>10} -> {format_time(timing['per_op']):>10}  {ratio:5.2f}x  {status}")
+    return regressions
+
+def print_results(results):
+    for name, timing in results.items():
+        accuracy = f" // accuracy {timing['accuracy']:.1%}" if 'accuracy' in timing else ''
+        print(f"  {name:<44} {format_time(timing['per_op']):>10} per op (best {format_time(timing['best'])}){accuracy}")
+
+def parse_commandline_params():
+    def list_int(values):
+        return [ int(v) for v in values.split(',') ]
+    parser = argparse.ArgumentParser(
+        prog='Benchmarks',
+        description='Micro-benchmarks for the parsing, OCR and storage hot paths and the CLI startup'
+    )
+    parser.add_argument("-b", "--bench", dest='benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--responses", dest='response_dir', help="Directory of saved chittaExtract *.html responses")
+    parser.add_argument("--captcha-corpus", dest='captcha_corpus', help="Directory of captchas named <VALUE>_<n>.png")
+    parser.add_argument("--captcha-model", dest='captcha_model', help="Classifier model to benchmark instead of tesseract")
+    parser.add_argument("--ocr-samples", dest='ocr_samples', type=int, default=100, help="Captchas to solve per run")
+    parser.add_argument("--rows", dest='rows', type=list_int, default=DEFAULT_ROWS, help="Store sizes, comma separated")
+    parser.add_argument("--repeat", dest='repeat', type=int, default=5, help="Runs per benchmark")
+    parser.add_argument("--save", dest='save_path', help="Save the results as a baseline")
+    parser.add_argument("--compare", dest='compare_path', help="Compare the results with a saved baseline")
+    parser.add_argument("--threshold", dest='threshold', type=float, default=0.10, help="Slowdown reported as a regression")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    results = {}
+    for name in args.benchmarks:
+        print(f"Running {name}...")
+        BENCHMARKS[name](results, args)
+    print_results(results)
+    if args.save_path:
+        save_baseline(args.save_path, results)
+    if args.compare_path:
+        sys.exit(1 if compare(args.compare_path, results, args.threshold) else 0)
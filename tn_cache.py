@@ -0,0 +1,111 @@
+import json
+import time
+import sqlite3
+import threading
+import urllib.parse
+from collections import OrderedDict
+from tn_metrics import stage_timings
+
+#---------------------------------------------------------------------------------
+# Persistent cache for the ajax.html hierarchy lookups (district / taluk / village
+# codes, wards, blocks, surveys, subdivisions). These almost never change, so the
+# raw responses are kept in SQLite with a TTL and an in-memory LRU in front.
+#---------------------------------------------------------------------------------
+LOOKUP_CACHE_DB = 'lookup_cache.db'
+DEFAULT_TTL = 30 * 24 * 3600 # 30 days
+
+def normalize_query(url, params):
+    ## Same lookup => same key, irrespective of parameter order
+    return f"{url}?{urllib.parse.urlencode(sorted((k, str(v)) for k, v in params.items()))}"
+
+class LookupCache:
+    def __init__(self, path=LOOKUP_CACHE_DB, ttl=DEFAULT_TTL, lru_size=4096):
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS lookup_cache
+            (
+              query       TEXT PRIMARY KEY  NOT NULL,
+              response    TEXT              NOT NULL,
+              fetched_at  REAL              NOT NULL
+            );
+        ''')
+        self.conn.commit()
+
+    def _remember(self, key, response, fetched_at):
+        self.lru[key] = (response, fetched_at)
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get(self, key):
+        expired_before = time.time() - self.ttl
+        with self.lock:
+            entry = self.lru.get(key)
+            if entry is None:
+                entry = self.conn.execute('SELECT response, fetched_at FROM lookup_cache WHERE query = ?', (key,)).fetchone()
+            if entry and entry[1] > expired_before:
+                self._remember(key, *entry)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        fetched_at = time.time()
+        with self.lock:
+            self._remember(key, response, fetched_at)
+            self.conn.execute('INSERT OR REPLACE INTO lookup_cache VALUES(?, ?, ?)', (key, response, fetched_at))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        print(f"Lookup Cache: {self.hits} hit(s) // {self.misses} miss(es)")
+
+lookup_cache = None
+
+def set_lookup_cache(cache):
+    global lookup_cache
+    lookup_cache = cache
+
+def is_lookup_response(response_text):
+    ## ajax.html answers are JSON (codes) or XML (wards ... subdivisions). An empty body or an
+    ## error page sent with a 200 would otherwise be served from the cache for the whole TTL
+    text = response_text.strip() if response_text else ''
+    if text.startswith(('{', '[')):
+        try:
+            json.loads(text)
+            return True
+        except ValueError:
+            return False
+    if text.startswith('<'):
+        import lxml.etree
+        try:
+            root = lxml.etree.fromstring(text.encode('utf-8'))
+        except (lxml.etree.XMLSyntaxError, ValueError):
+            return False
+        return root.tag.lower() != 'html'
+    return False
+
+class CacheMiss(Exception):
+    ## cached_get without a session (cache-first paths) for a lookup that is not cached
+    pass
+
+def cached_get(session, url, params):
+    key = normalize_query(url, params)
+    response_text = lookup_cache.get(key) if lookup_cache else None
+    if response_text is None:
+        if session is None:
+            raise CacheMiss(key)
+        with stage_timings.time('lookup'):
+            response = session.get(f"{url}?{urllib.parse.urlencode(params)}")
+        response_text = response.text
+        if lookup_cache and response.status_code == 200 and is_lookup_response(response_text):
+            lookup_cache.put(key, response_text)
+    return response_text
@@ -0,0 +1,297 @@
+import re
+import time
+import queue
+import threading
+from io import BytesIO
+from contextlib import contextmanager
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from tn_metrics import RecordCounters, stage_timings
+from tn_http import land_url, report_overload
+from tn_parse import SUCCESS, CAPTCHA_REJECTED, NOT_FOUND, SESSION_EXPIRED, SERVER_ERROR
+
+CAPTCHA_PAGE = 'simpleCaptcha.html'
+## Single word, restricted to the captcha charset, with per character confidences in the hOCR
+TESSERACT_CONFIG = '--psm 8 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 -c hocr_char_boxes=1'
+MIN_OCR_CONFIDENCE = 0.60 ## Reads with any character below this are not worth a POST
+X_CONF_REGEX = re.compile(r'x_w?conf ([\d.]+)')
+
+## ocr_attempts: captchas downloaded + solved, local_rejects: discarded before the POST,
+## server_rejects: POSTs that did not return the record (wasted round trips), by response class:
+## captcha_rejected / not_found / session_expired / server_error (tn_parse.classify_response)
+captcha_metrics = RecordCounters(['ocr_attempts', 'local_rejects', 'server_rejects', 'accepted',
+    CAPTCHA_REJECTED, NOT_FOUND, SESSION_EXPIRED, SERVER_ERROR])
+
+captcha_model = None  ## Optional tn_classifier.GlyphModel, tried before tesseract
+captcha_model_path = None
+captcha_corpus_dir = None  ## Accepted captchas are saved here to train the model
+
+def set_captcha_model(model_path):
+    global captcha_model, captcha_model_path
+    if model_path:
+        from tn_classifier import GlyphModel
+        captcha_model = GlyphModel.load(model_path)
+    else:
+        captcha_model = None
+    captcha_model_path = model_path
+
+def set_captcha_corpus(corpus_dir):
+    global captcha_corpus_dir
+    captcha_corpus_dir = corpus_dir
+
+def get_captcha_value(session, identifier, debug=False):
+    ## captcha = download + OCR of every attempt until one passes check_captcha
+    with stage_timings.time('captcha'):
+        while True:
+            content = get_captcha_image(session)
+            with stage_timings.time('ocr'):
+                captcha_value, confidence = solve_captcha(content)
+            captcha_metrics.incr(identifier, 'ocr_attempts')
+            if check_captcha(captcha_value, confidence, identifier, debug=debug):
+                return captcha_value
+            captcha_metrics.incr(identifier, 'local_rejects')
+
+def check_captcha(captcha_value, confidence, identifier, debug=False):
+    if not validate_captcha(captcha_value, identifier, debug=debug):
+        return False
+    if confidence and min(confidence) < MIN_OCR_CONFIDENCE:
+        if debug: print(f"Invalid Captcha {identifier} - {captcha_value} [Low Confidence {min(confidence):.2f}]")
+        return False
+    return True
+
+def validate_captcha(captcha_value, identifier, debug=False):
+    if len(captcha_value) != 6:
+        if debug: print(f"Invalid Captcha {identifier} - {captcha_value} [Length != 6]")
+        return False
+    # Seems like Only Alphanumeric is allowed!
+    # if bool(re.match(r'^[A-Z]+$', captcha_value)):
+    #     print(f"Invalid Captcha {identifier} - {captcha_value} [Only Alphabetic]")
+    #     return True
+    # Should not be only numeric
+    if bool(re.match(r'^[0-9]+$', captcha_value)):
+        if debug: print(f"Invalid Captcha {identifier} - {captcha_value} [Only Numeric]")
+        return False
+    # Valid charset = [0-9A-Z] (no lower case).
+    if not bool(re.match(r'^[A-Z0-9]+$', captcha_value)):
+        if debug: print(f"Invalid Captcha {identifier} - {captcha_value} [Not Alphanumeric]")
+        return False
+    return True
+
+def get_captcha_image(session):
+    with stage_timings.time('captcha_download'):
+        captcha = session.get(land_url(CAPTCHA_PAGE))
+    session.captcha_image = captcha.content ## The server only honours the latest captcha of a session
+    return captcha.content
+
+def otsu_threshold(histogram):
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    weight_bg = sum_bg = 0
+    best, threshold = 0, 0
+    for i, h in enumerate(histogram):
+        weight_bg += h
+        if not weight_bg or weight_bg == total: continue
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / (total - weight_bg)
+        between = weight_bg * (total - weight_bg) * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+def preprocess_captcha(img):
+    ## Grayscale -> Denoise (median) -> Threshold (Otsu), text ends up black on white
+    from PIL import ImageFilter
+    gray = img.convert('L').filter(ImageFilter.MedianFilter(3))
+    threshold = otsu_threshold(gray.histogram())
+    return gray.point(lambda x: 0 if x <= threshold else 255, '1')
+
+def parse_hocr_confidence(hocr):
+    ## Returns (text, per character confidence in 0..1) from tesseract hOCR output
+    import lxml.html
+    tree = lxml.html.fromstring(hocr)
+    chars = tree.xpath('//*[@class="ocrx_cinfo"]')
+    if chars:
+        text = [ c.text_content() for c in chars ]
+        confidence = [ X_CONF_REGEX.search(c.get('title', '')) for c in chars ]
+    else:
+        ## Older tesseract: only word confidence, applied to every character
+        words = tree.xpath('//*[@class="ocrx_word"]')
+        text = [ w.text_content() for w in words ]
+        confidence = [ X_CONF_REGEX.search(w.get('title', '')) for w in words for _ in w.text_content().strip() ]
+    return ''.join(text).strip(), [ float(m.group(1)) / 100 if m else 0.0 for m in confidence ]
+
+def ocr_captcha_with_confidence(content):
+    ## PIL + pytesseract (which pulls in pandas) are only imported once a captcha is solved
+    from PIL import Image
+    import pytesseract
+    img = preprocess_captcha(Image.open(BytesIO(content)))
+    hocr = pytesseract.image_to_pdf_or_hocr(img, extension='hocr', config=TESSERACT_CONFIG)
+    return parse_hocr_confidence(hocr)
+
+def ocr_captcha(content):
+    return ocr_captcha_with_confidence(content)[0]
+
+def solve_captcha(content):
+    ## Returns (captcha_value, per character confidence)
+    if captcha_model:
+        from tn_classifier import MIN_CONFIDENCE
+        captcha_value, confidence = captcha_model.classify(content)
+        if confidence and min(confidence) >= MIN_CONFIDENCE:
+            return captcha_value, confidence
+    return ocr_captcha_with_confidence(content)
+
+def get_captcha_value_internal(session):
+    return solve_captcha(get_captcha_image(session))[0]
+
+def record_accepted_captcha(session, captcha_value):
+    ## Called once the server accepted captcha_value, to grow the classifier corpus
+    content = getattr(session, 'captcha_image', None)
+    if captcha_corpus_dir and content:
+        from tn_classifier import save_sample
+        save_sample(captcha_corpus_dir, content, captcha_value)
+
+#---------------------------------------------------------------------------------
+# Extract retries per response class: a rejected captcha is solved again right
+# away, an expired session is primed again (by the attempt) and retried, a server
+# error is retried after a backoff and an absent record is never retried.
+#---------------------------------------------------------------------------------
+EXTRACT_RETRIES = { CAPTCHA_REJECTED: 3, SESSION_EXPIRED: 1, SERVER_ERROR: 2, NOT_FOUND: 0 }
+SERVER_ERROR_BACKOFF = 2.0 # Seconds, doubled on every retry
+
+def extract_with_retries(attempt, identifier):
+    ## attempt() -> (session, captcha_value, response, record, response class)
+    ## Returns (record or None, last response, response class)
+    retries = Counter()
+    while True:
+        session, captcha_value, response, record, response_class = attempt()
+        if response_class == SUCCESS:
+            captcha_metrics.incr(identifier, 'accepted')
+            record_accepted_captcha(session, captcha_value)
+            return record, response, response_class
+        captcha_metrics.incr(identifier, 'server_rejects')
+        captcha_metrics.incr(identifier, response_class)
+        if response_class in (SESSION_EXPIRED, SERVER_ERROR):
+            report_overload() ## A wrong captcha or an absent record says nothing about the server load
+        retries[response_class] += 1
+        if retries[response_class] > EXTRACT_RETRIES[response_class]:
+            return None, response, response_class
+        if response_class == SERVER_ERROR:
+            time.sleep(SERVER_ERROR_BACKOFF * 2 ** (retries[response_class] - 1))
+
+def warm_ocr_worker(model_path=None):
+    set_captcha_model(model_path)
+    import pytesseract
+    ## Resolve the tesseract binary once per worker instead of on the first captcha
+    try:
+        pytesseract.get_tesseract_version()
+    except pytesseract.TesseractNotFoundError:
+        pass
+
+#---------------------------------------------------------------------------------
+# Captcha Stage: Prefetch + OCR ahead of the submitter.
+#
+# The server keeps exactly one captcha per session, so a session cannot fetch
+# its next captcha while its own POST is in flight. Instead the stage owns more
+# sessions than there are submitters: while one session is POSTing, the others
+# are downloading captchas and running OCR in the process pool. Validated
+# (session, captcha_value) pairs are handed over through a bounded queue.
+#
+# When the prefetch keeps failing (server down, tesseract missing ...) the
+# submitters get a CaptchaStageError instead of waiting forever.
+#---------------------------------------------------------------------------------
+MAX_PREFETCH_FAILURES = 10 # In a row, over all the sessions
+ACQUIRE_TIMEOUT = 300      # Seconds without a prefetched captcha
+
+class CaptchaStageError(RuntimeError):
+    pass
+
+class CaptchaStage:
+    def __init__(self, sessions, ocr_workers=2, queue_size=None, debug=False, acquire_timeout=ACQUIRE_TIMEOUT):
+        self.debug = debug
+        self.acquire_timeout = acquire_timeout
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.failures = 0      # Prefetch failures in a row
+        self.last_error = None
+        self.executor = ProcessPoolExecutor(max_workers=ocr_workers, initializer=warm_ocr_worker, initargs=(captcha_model_path,))
+        self.ready = queue.Queue(maxsize=queue_size or len(sessions))
+        self.pending = queue.Queue()
+        for s in sessions: self.pending.put(s)
+        self.threads = [ threading.Thread(target=self._prefetch, name=f'captcha-{i}', daemon=True) for i in range(len(sessions)) ]
+        for t in self.threads: t.start()
+
+    def _solve(self, session):
+        ## Returns (captcha_value, ocr attempts, local rejects)
+        attempts = 0
+        while not self.stopped.is_set():
+            content = get_captcha_image(session)
+            with stage_timings.time('ocr'): ## Including the wait for a free OCR process
+                captcha_value, confidence = self.executor.submit(solve_captcha, content).result()
+            attempts += 1
+            if check_captcha(captcha_value, confidence, 'prefetch', debug=self.debug):
+                return captcha_value, attempts, attempts - 1
+        return None, attempts, attempts
+
+    def _prefetch(self):
+        while not self.stopped.is_set():
+            try:
+                session = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                captcha_value, attempts, rejects = self._solve(session)
+            except Exception as e:
+                print(f"  Captcha prefetch failed: {e}")
+                with self.lock:
+                    self.failures += 1
+                    self.last_error = e
+                self.stopped.wait(1) ## Back off before retrying this session
+                self.pending.put(session)
+                continue
+            with self.lock:
+                self.failures = 0
+            while captcha_value and not self.stopped.is_set():
+                try:
+                    self.ready.put((session, captcha_value, attempts, rejects), timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def acquire(self, identifier='prefetch'):
+        ## The OCR work spent on the prefetched captcha is accounted to the record that uses it
+        with stage_timings.time('captcha'): ## Only the wait for a prefetched captcha
+            session, captcha_value, attempts, rejects = self._get_ready()
+        captcha_metrics.incr(identifier, 'ocr_attempts', attempts)
+        captcha_metrics.incr(identifier, 'local_rejects', rejects)
+        return session, captcha_value
+
+    def _get_ready(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            try:
+                return self.ready.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            with self.lock:
+                failures, last_error = self.failures, self.last_error
+            if failures >= MAX_PREFETCH_FAILURES:
+                raise CaptchaStageError(f"Captcha prefetch failed {failures} times in a row: {last_error}") from last_error
+            if time.monotonic() > deadline:
+                raise CaptchaStageError(f"No captcha prefetched in {self.acquire_timeout}s (last error: {last_error})")
+
+    def release(self, session):
+        self.pending.put(session)
+
+    @contextmanager
+    def checkout(self, identifier='prefetch'):
+        session, captcha_value = self.acquire(identifier)
+        try:
+            yield session, captcha_value
+        finally:
+            self.release(session)
+
+    def close(self):
+        self.stopped.set()
+        for t in self.threads: t.join()
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,158 @@
+import os
+import time
+import random
+import string
+import argparse
+from io import BytesIO
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+#---------------------------------------------------------------------------------
+# In-process captcha solver for the fixed 6 char [A-Z0-9] captcha.
+#
+# The image is binarized, split into 6 glyphs on the column ink projection and
+# each glyph is matched against per-character templates (nearest centroid) built
+# from captchas that the server has accepted. Reads below the confidence
+# threshold are handed back to tesseract by tn_captcha.solve_captcha.
+#---------------------------------------------------------------------------------
+CAPTCHA_LENGTH = 6
+CHARSET = string.ascii_uppercase + string.digits
+GLYPH_SIZE = (12, 16) # width, height
+MIN_CONFIDENCE = 0.80
+
+def binarize(img):
+    from tn_captcha import preprocess_captcha
+    return ~np.asarray(preprocess_captcha(img), dtype=bool) ## Text is black after preprocessing
+
+def column_runs(ink):
+    cols = np.concatenate(([False], ink.any(axis=0), [False]))
+    edges = np.flatnonzero(np.diff(cols.astype(np.int8)))
+    return [ (a, b) for a, b in zip(edges[::2], edges[1::2]) if b - a >= 2 ] ## Drop specks
+
+def segment(ink, count=CAPTCHA_LENGTH):
+    runs = column_runs(ink)
+    if not runs: return []
+    while len(runs) > count:
+        ## Merge the narrowest run into the neighbour with the smallest gap
+        idx = min(range(len(runs)), key=lambda i: runs[i][1] - runs[i][0])
+        if idx == 0: other = 1
+        elif idx == len(runs) - 1: other = idx - 1
+        else: other = idx - 1 if runs[idx][0] - runs[idx - 1][1] <= runs[idx + 1][0] - runs[idx][1] else idx + 1
+        lo, hi = sorted((idx, other))
+        runs[lo:hi + 1] = [ (runs[lo][0], runs[hi][1]) ]
+    while len(runs) < count:
+        ## Touching glyphs: split the widest run in half
+        idx = max(range(len(runs)), key=lambda i: runs[i][1] - runs[i][0])
+        a, b = runs[idx]
+        if b - a < 2: break
+        runs[idx:idx + 1] = [ (a, (a + b) // 2), ((a + b) // 2, b) ]
+    return [ normalize_glyph(ink[:, a:b]) for a, b in runs ]
+
+def normalize_glyph(glyph):
+    rows = np.flatnonzero(glyph.any(axis=1))
+    if len(rows): glyph = glyph[rows[0]:rows[-1] + 1]
+    img = Image.fromarray(glyph.astype(np.uint8) * 255).resize(GLYPH_SIZE, Image.BILINEAR)
+    vec = np.asarray(img, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def get_glyphs(content):
+    return segment(binarize(Image.open(BytesIO(content))))
+
+class GlyphModel:
+    def __init__(self, chars, centroids):
+        self.chars = list(chars)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data['chars']), data['centroids'])
+
+    def save(self, path):
+        np.savez(path, chars=np.array(''.join(self.chars)), centroids=self.centroids)
+
+    @classmethod
+    def train(cls, samples):
+        ## samples: iterable of (image bytes, accepted captcha value)
+        sums, counts = {}, {}
+        for content, value in samples:
+            glyphs = get_glyphs(content)
+            if len(glyphs) != len(value): continue
+            for ch, vec in zip(value, glyphs):
+                sums[ch] = sums.get(ch, 0) + vec
+                counts[ch] = counts.get(ch, 0) + 1
+        chars = sorted(sums)
+        centroids = [ sums[ch] / counts[ch] for ch in chars ]
+        centroids = [ c / (np.linalg.norm(c) or 1) for c in centroids ]
+        return cls(chars, np.vstack(centroids) if centroids else np.zeros((0, GLYPH_SIZE[0] * GLYPH_SIZE[1])))
+
+    def classify(self, content):
+        ## Returns (value, per character confidence), confidence = cosine similarity
+        glyphs = get_glyphs(content)
+        if len(glyphs) != CAPTCHA_LENGTH or not len(self.chars):
+            return '', []
+        scores = np.vstack(glyphs) @ self.centroids.T
+        best = scores.argmax(axis=1)
+        value = ''.join(self.chars[i] for i in best)
+        return value, scores[np.arange(len(best)), best].tolist()
+
+#---------------------------------------------------------------------------------
+# Corpus of accepted captchas: <dir>/<VALUE>_<n>.png
+#---------------------------------------------------------------------------------
+def load_corpus(corpus_dir):
+    samples = []
+    for path in sorted(Path(corpus_dir).iterdir()):
+        value = path.stem.split('_')[0]
+        if len(value) == CAPTCHA_LENGTH and all(c in CHARSET for c in value):
+            samples.append((path.read_bytes(), value))
+    return samples
+
+def save_sample(corpus_dir, content, value):
+    os.makedirs(corpus_dir, exist_ok=True)
+    path = Path(corpus_dir) / f"{value}_{time.time_ns()}.png"
+    path.write_bytes(content)
+    return path
+
+def benchmark(samples, name, solve):
+    start = time.perf_counter()
+    correct = sum(1 for content, value in samples if solve(content) == value)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<12} {len(samples) / elapsed if elapsed else 0:10.1f} solves/sec // accept rate {correct / len(samples):.1%}")
+
+def parse_commandline_params():
+    parser = argparse.ArgumentParser(
+        prog='Captcha Classifier',
+        description='Train / benchmark the in-process captcha classifier on a corpus of accepted captchas'
+    )
+    parser.add_argument("command", choices=['train', 'bench'], help="Train a model or benchmark it against tesseract")
+    parser.add_argument("corpus_dir", help="Directory of accepted captchas named <VALUE>_<n>.png")
+    parser.add_argument("-m", "--model", dest='model_path', default='captcha_model.npz', help="Model file")
+    parser.add_argument("--holdout", dest='holdout', type=float, default=0.2, help="Fraction of the corpus used only for benchmarking")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    samples = load_corpus(args.corpus_dir)
+    print(f"Loaded {len(samples)} captchas from {args.corpus_dir}")
+    if not samples:
+        exit(-1)
+    random.Random(0).shuffle(samples) ## Same train / holdout split for both commands
+    split = int(len(samples) * (1 - args.holdout))
+    if args.command == 'train':
+        model = GlyphModel.train(samples[:split])
+        model.save(args.model_path)
+        print(f"Trained {len(model.chars)} characters // Saved to {args.model_path}")
+    else:
+        import tn_captcha
+        model = GlyphModel.load(args.model_path)
+        samples = samples[split:] or samples
+        print(f"Benchmarking on {len(samples)} held out captchas")
+        benchmark(samples, 'tesseract', tn_captcha.ocr_captcha)
+        benchmark(samples, 'classifier', lambda content: model.classify(content)[0])
+        tn_captcha.set_captcha_model(args.model_path)
+        benchmark(samples, 'combined', lambda content: tn_captcha.solve_captcha(content)[0])
@@ -0,0 +1,371 @@
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from collections import Counter
+from tn_store import SqliteStore, PATTA_DB, TSLR_DB, TSLR_PAYLOAD_KEYS
+from tn_parse import SUCCESS, NOT_FOUND
+
+#---------------------------------------------------------------------------------
+# Crawl coordinator: the TSLR (ward/block/survey/subdiv) or patta (survey/subdiv)
+# frontier as work items in a shared SQLite database, so that several worker
+# processes (or hosts, with the database on a filesystem with working locks)
+# split a district without fetching anything twice.
+#
+# A worker claims a batch under a time limited lease, extends the lease while it
+# works (heartbeat) and marks every item done / failed. Leases of a worker that
+# died expire and the items go back to pending (or to failed after --max-attempts).
+#
+#   python tn_coordinator.py enqueue tslr -w 013,015
+#   python tn_coordinator.py work tslr --processes 4 --base-url http://localhost:8080/eservicesnew/land/
+#   python tn_coordinator.py status
+#---------------------------------------------------------------------------------
+WORK_DB = 'work.db'
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+class WorkQueue(SqliteStore):
+    def __init__(self, db_path=WORK_DB, max_attempts=MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        super().__init__(db_path)
+
+    def initialize(self):
+        conn = self.connection()
+        with conn:
+            ## kind = tslr / patta, status = pending / leased / done / failed
+            conn.execute('''
+              CREATE TABLE IF NOT EXISTS work_items
+              (
+                kind               VARCHAR(10)       NOT NULL,
+                key                TEXT              NOT NULL,
+                payload            TEXT              NOT NULL,
+                status             VARCHAR(10)       NOT NULL DEFAULT 'pending',
+                lease_owner        TEXT,
+                lease_expires      REAL,
+                attempts           INT               NOT NULL DEFAULT 0,
+                last_error         TEXT,
+                updated_at         REAL              NOT NULL,
+                PRIMARY KEY (kind, key)
+              );
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items (kind, status, lease_expires)')
+
+    def enqueue(self, kind, items):
+        ## items: (key, payload), already queued keys are left as they are
+        conn = self.connection()
+        with conn:
+            cursor = conn.executemany('INSERT OR IGNORE INTO work_items (kind, key, payload, updated_at) VALUES(?, ?, ?, ?)',
+                ((kind, key, json.dumps(payload), time.time()) for key, payload in items))
+        return cursor.rowcount
+
+    def requeue_expired(self, kind):
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            requeued = conn.execute('''
+                UPDATE work_items SET status = 'pending', lease_owner = NULL, lease_expires = NULL, last_error = 'lease expired', updated_at = ?
+                WHERE kind = ? AND status = 'leased' AND lease_expires < ? AND attempts < ?
+            ''', (now, kind, now, self.max_attempts)).rowcount
+            conn.execute('''
+                UPDATE work_items SET status = 'failed', lease_owner = NULL, lease_expires = NULL, last_error = 'lease expired', updated_at = ?
+                WHERE kind = ? AND status = 'leased' AND lease_expires < ?
+            ''', (now, kind, now))
+        return requeued
+
+    def claim(self, kind, worker_id, batch_size=10, lease_seconds=LEASE_SECONDS):
+        ## One UPDATE ... RETURNING: two workers can never claim the same item
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            rows = conn.execute('''
+                UPDATE work_items SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?
+                WHERE rowid IN (SELECT rowid FROM work_items WHERE kind = ? AND status = 'pending' ORDER BY rowid LIMIT ?)
+                RETURNING key, payload
+            ''', (worker_id, now + lease_seconds, now, kind, batch_size)).fetchall()
+        return [ (row['key'], json.loads(row['payload'])) for row in rows ]
+
+    def heartbeat(self, kind, worker_id, lease_seconds=LEASE_SECONDS):
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            return conn.execute('''
+                UPDATE work_items SET lease_expires = ?, updated_at = ?
+                WHERE kind = ? AND status = 'leased' AND lease_owner = ?
+            ''', (now + lease_seconds, now, kind, worker_id)).rowcount
+
+    def complete(self, kind, key, worker_id):
+        ## Only while the worker still holds the lease; 0 when it expired and the item was claimed again
+        conn = self.connection()
+        with conn:
+            return conn.execute('''
+                UPDATE work_items SET status = 'done', lease_owner = NULL, lease_expires = NULL, last_error = NULL, updated_at = ?
+                WHERE kind = ? AND key = ? AND status = 'leased' AND lease_owner = ?
+            ''', (time.time(), kind, key, worker_id)).rowcount
+
+    def fail(self, kind, key, worker_id, error):
+        ## Back to pending until max_attempts, unless the lease was lost (and the item claimed again)
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                UPDATE work_items SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END,
+                    lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ?
+                WHERE kind = ? AND key = ? AND status = 'leased' AND lease_owner = ?
+            ''', (self.max_attempts, error, time.time(), kind, key, worker_id))
+
+    def counts(self, kind=None):
+        sql = 'SELECT kind, status, COUNT(*) AS n FROM work_items'
+        rows = self.connection().execute(sql + (' WHERE kind = ?' if kind else '') + ' GROUP BY kind, status', (kind,) if kind else ())
+        counts = {}
+        for row in rows:
+            counts.setdefault(row['kind'], Counter())[row['status']] = row['n']
+        return counts
+
+class LeaseHeartbeat:
+    ## Extends the worker's leases every lease_seconds / 3 while it works on a batch
+    def __init__(self, queue, kind, worker_id, lease_seconds=LEASE_SECONDS):
+        self.queue = queue
+        self.kind = kind
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='heartbeat', daemon=True)
+
+    def run(self):
+        ## One thread per batch: its work.db connection is closed with it, not kept until queue.close()
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                self.queue.heartbeat(self.kind, self.worker_id, self.lease_seconds)
+        finally:
+            self.queue.release()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+#---------------------------------------------------------------------------------
+# Frontiers: (key, payload) per work item
+#---------------------------------------------------------------------------------
+def tslr_items(args):
+    import tn_tslr
+    payload = tn_tslr.get_payload({})
+    with tn_tslr.tn_http.new_session() as s:
+        ward_numbers = tn_tslr.get_ward_numbers(s, payload)
+        if args.ward_numbers and args.ward_numbers != ['']:
+            ward_numbers = [ w for w in args.ward_numbers if w in ward_numbers ]
+        for item in tn_tslr.get_frontier(s, payload, ward_numbers, lookups=args.lookups):
+            yield '/'.join(item[k] for k in TSLR_PAYLOAD_KEYS), item
+
+def patta_items(args):
+    import tn_patta
+    rows = tn_patta.read_manifest(args.manifest) if args.manifest else [
+        { 'district': args.district_name, 'taluk': args.taluk_name, 'village': args.village_name, 'survey': survey_no, 'sdiv': None }
+        for survey_no in args.survey_nos ]
+    with tn_patta.tn_http.new_session() as s:
+        all_village_codes = {}
+        for row in rows:
+            village = (row['district'], row['taluk'], row['village'])
+            if village not in all_village_codes:
+                all_village_codes[village] = tn_patta.get_village_codes(s, *village)
+            if not all(all_village_codes[village]):
+                print(f"Unknown Village {village} // {all_village_codes[village]}")
+                continue
+            kwargs = tn_patta.get_survey_kwargs(all_village_codes[village], row['survey'])
+            sdiv_nos = tn_patta.get_subdivision_numbers(s, **kwargs)
+            if row['sdiv']:
+                sdiv_nos = [ sdiv for sdiv in sdiv_nos if sdiv in row['sdiv'] ]
+            for sdiv in tn_patta.CoveragePlanner.order(sdiv_nos):
+                identifier = f"{kwargs['surveyno']}/{sdiv}" if sdiv != '0' else f"{kwargs['surveyno']}"
+                yield f"{tn_patta.get_village_key(**kwargs)}|{identifier}", { 'identifier': identifier, 'sdiv': sdiv, 'kwargs': kwargs }
+
+def enqueue(queue, kind, items, batch_size=500):
+    ## In batches while the frontier is enumerated, workers can start on the first ones
+    batch, queued = [], 0
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            queued += queue.enqueue(kind, batch)
+            batch = []
+    if batch:
+        queued += queue.enqueue(kind, batch)
+    return queued
+
+#---------------------------------------------------------------------------------
+# Workers: one item at a time per process, scale out with --processes / hosts.
+# process(key, payload) returns None when the item is done, else the error.
+#---------------------------------------------------------------------------------
+def tslr_worker(args):
+    import tn_tslr
+    from tn_store import TslrStore
+    store = TslrStore(args.tslr_db)
+    pool = tn_tslr.SessionPool()
+    def process(key, payload):
+        ## An absent record is done as well: it is never retried
+        details, response_class = tn_tslr.fetch_details(pool, payload, store)
+        return response_class if response_class not in (SUCCESS, NOT_FOUND) else None
+    def close():
+        pool.close()
+        store.close()
+    return process, close
+
+def patta_worker(args):
+    import tn_patta
+    store = tn_patta.initialize_sqlite_db(args.patta_db)
+    session = tn_patta.new_session()
+    def process(key, payload):
+        ## Subdivisions already on a patta fetched by any worker are found in SQLite, absent ones are recorded
+        kwargs = payload['kwargs']
+        if tn_patta.get_patta_details(session, payload['identifier'], payload['sdiv'], **kwargs):
+            return None
+        return None if store.is_not_found(payload['identifier'], tn_patta.get_village_key(**kwargs)) else 'not_fetched'
+    def close():
+        session.close()
+        store.close()
+    return process, close
+
+WORKERS = { 'tslr': tslr_worker, 'patta': patta_worker }
+
+def get_worker_id():
+    return f"{socket.gethostname()}:{multiprocessing.current_process().pid}"
+
+def run_worker(args):
+    import tn_http, tn_captcha, tn_archive, tn_cache, tn_metrics
+    from tn_cache import LookupCache
+    ## Everything (SQLite connections, sessions) is opened here, after the fork
+    tn_http.configure_from_args(args)
+    tn_captcha.set_captcha_model(args.captcha_model)
+    tn_archive.configure_from_args(args)
+    if args.cache_ttl > 0:
+        tn_cache.set_lookup_cache(LookupCache(ttl=args.cache_ttl * 24 * 3600))
+    queue = WorkQueue(args.queue_db, args.max_attempts)
+    worker_id = get_worker_id()
+    process, close = WORKERS[args.kind](args)
+    counts = Counter()
+    start = time.monotonic()
+    try:
+        while True:
+            queue.requeue_expired(args.kind)
+            batch = queue.claim(args.kind, worker_id, args.batch_size, args.lease)
+            if not batch:
+                status = queue.counts(args.kind).get(args.kind, Counter())
+                if not status['leased'] or not args.wait:
+                    break
+                time.sleep(args.poll) ## Other workers' leases may still expire
+                continue
+            with LeaseHeartbeat(queue, args.kind, worker_id, args.lease):
+                for key, payload in batch:
+                    try:
+                        error = process(key, payload)
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                    if not error:
+                        if queue.complete(args.kind, key, worker_id):
+                            counts['done'] += 1
+                        else:
+                            print(f"Lease lost on {key}, left to its new owner", file=sys.stderr)
+                            counts['lost'] += 1
+                    else:
+                        queue.fail(args.kind, key, worker_id, error)
+                        counts['failed'] += 1
+    finally:
+        close()
+        queue.close()
+        if tn_cache.lookup_cache: tn_cache.lookup_cache.close()
+        if tn_archive.response_archive: tn_archive.response_archive.close()
+    elapsed = time.monotonic() - start
+    print(f"Worker {worker_id}: {counts['done']} done, {counts['failed']} failed, {counts['lost']} lost in {elapsed:.1f}s", file=sys.stderr)
+    tn_metrics.report_profile(args)
+    return counts
+
+def run_workers(args):
+    if args.processes <= 1:
+        run_worker(args)
+        return
+    processes = [ multiprocessing.Process(target=run_worker, args=(args,), name=f"worker-{idx}") for idx in range(args.processes) ]
+    for p in processes: p.start()
+    for p in processes: p.join()
+
+def print_status(queue):
+    for kind, counts in sorted(queue.counts().items()):
+        total = sum(counts.values())
+        print(f"{kind}: {total} item(s) // " + ', '.join(f"{s} {counts[s]}" for s in ['pending', 'leased', 'done', 'failed']))
+    for row in queue.connection().execute('''
+        SELECT kind, lease_owner, COUNT(*) AS n, MIN(lease_expires) AS expires FROM work_items
+        WHERE status = 'leased' GROUP BY kind, lease_owner
+    '''):
+        print(f"  {row['kind']} leased by {row['lease_owner']}: {row['n']} item(s), lease expires in {row['expires'] - time.time():.0f}s")
+
+def parse_commandline_params():
+    import tn_http, tn_archive, tn_metrics
+    def list_str(values):  ### Type in argparse to convert string to list!
+        return values.split(',')
+
+    parser = argparse.ArgumentParser(
+        prog='Crawl Coordinator',
+        description='Queue the TSLR / patta frontier in a shared SQLite database and work it from several processes or hosts'
+    )
+    parser.add_argument("--queue", dest='queue_db', default=WORK_DB, help="Shared SQLite database of work items")
+    parser.add_argument("--max-attempts", dest='max_attempts', type=int, default=MAX_ATTEMPTS, help="Claims of an item before it is failed")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = commands.add_parser('enqueue', help="Enumerate a frontier into work items")
+    enqueue_parser.add_argument("kind", choices=list(WORKERS), help="TSLR (ward/block/survey/subdiv) or patta (survey/subdiv) items")
+    enqueue_parser.add_argument("-w", "--wards", dest='ward_numbers', type=list_str, default=['013'], help="tslr: Comma Separated Ward Numbers (all wards if empty)")
+    enqueue_parser.add_argument("--lookups", dest='lookups', type=int, default=4, help="tslr: Concurrent ward/block/survey/subdiv lookups (1 = one at a time)")
+    enqueue_parser.add_argument("-d", "--district", dest='district_name', default='Tirunelveli', help="patta: Name of the District")
+    enqueue_parser.add_argument("-t", "--taluk", dest='taluk_name', default='Palayamkottai', help="patta: Name of the Taluk")
+    enqueue_parser.add_argument("-v", "--village", dest='village_name', default='Tharuvai', help="patta: Name of the Village")
+    enqueue_parser.add_argument("-s", "--surveys", dest='survey_nos', type=list_str, default=[], help="patta: Comma Separated Survey Numbers")
+    enqueue_parser.add_argument("-m", "--manifest", dest='manifest', help="patta: CSV / JSONL file with district, taluk, village, survey[, sdiv] rows")
+    enqueue_parser.add_argument("--cache-ttl", dest='cache_ttl', type=float, default=30, help="Days before a cached lookup is fetched again (0 = no cache)")
+    tn_http.add_transport_arguments(enqueue_parser)
+
+    work_parser = commands.add_parser('work', help="Claim and fetch work items until the queue is drained")
+    work_parser.add_argument("kind", choices=list(WORKERS), help="Work items to claim")
+    work_parser.add_argument("--processes", dest='processes', type=int, default=1, help="Worker processes on this host")
+    work_parser.add_argument("--batch", dest='batch_size', type=int, default=10, help="Items claimed per lease")
+    work_parser.add_argument("--lease", dest='lease', type=float, default=LEASE_SECONDS, help="Lease in seconds, extended while the worker is alive")
+    work_parser.add_argument("--poll", dest='poll', type=float, default=10, help="Seconds between claims while only other workers' leases are left")
+    work_parser.add_argument("--no-wait", action='store_false', dest='wait', default=True, help="Exit when nothing is pending, instead of waiting for other leases to finish / expire")
+    work_parser.add_argument("--patta-db", dest='patta_db', default=PATTA_DB, help="SQLite database for the patta details")
+    work_parser.add_argument("--tslr-db", dest='tslr_db', default=TSLR_DB, help="SQLite database for the TSLR details")
+    work_parser.add_argument("--captcha-model", dest='captcha_model', help="Classifier model (see tn_classifier.py) tried before tesseract")
+    work_parser.add_argument("--cache-ttl", dest='cache_ttl', type=float, default=30, help="Days before a cached lookup is fetched again (0 = no cache)")
+    tn_http.add_transport_arguments(work_parser)
+    tn_archive.add_archive_arguments(work_parser)
+    tn_metrics.add_profile_arguments(work_parser)
+
+    commands.add_parser('status', help="Work items per status and the current leases")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    if args.command == 'enqueue':
+        import tn_http, tn_cache
+        from tn_cache import LookupCache
+        tn_http.configure_from_args(args)
+        if args.cache_ttl > 0:
+            tn_cache.set_lookup_cache(LookupCache(ttl=args.cache_ttl * 24 * 3600))
+        queue = WorkQueue(args.queue_db, args.max_attempts)
+        items = tslr_items(args) if args.kind == 'tslr' else patta_items(args)
+        print(f"Queued {enqueue(queue, args.kind, items)} new {args.kind} item(s) in {args.queue_db}")
+        if tn_cache.lookup_cache: tn_cache.lookup_cache.close()
+        queue.close()
+    elif args.command == 'work':
+        run_workers(args)
+        queue = WorkQueue(args.queue_db, args.max_attempts)
+        print_status(queue)
+        queue.close()
+    else:
+        queue = WorkQueue(args.queue_db, args.max_attempts)
+        print_status(queue)
+        queue.close()
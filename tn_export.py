@@ -0,0 +1,162 @@
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from tn_store import PATTA_DB, TSLR_DB, TSLR_KEY_COLUMNS
+
+#---------------------------------------------------------------------------------
+# Columnar export (Parquet / Arrow) of patta.db / tslr.db and area aggregates.
+#
+# The survey lines are read once into numeric columns (the SQLite DECIMAL columns
+# hold text / mixed values) and everything after that is vectorized, so the
+# village / patta / owner totals over millions of rows take seconds.
+#
+#   python tn_export.py export --out export/ --format parquet
+#   python tn_export.py report --by owner --village 29/02 --top 20
+#---------------------------------------------------------------------------------
+LAND_TYPES = ['wetland', 'dryland', 'other']
+
+SURVEYS_SQL = """
+    SELECT village_code, survey_identifier, patta_number, land_type,
+        CAST(hectares AS REAL) AS hectares, CAST(ares AS REAL) AS ares,
+        CAST(cents AS REAL) AS cents, CAST(amount AS REAL) AS amount, details
+    FROM patta_survey_details
+"""
+
+OWNERS_SQL = 'SELECT village_code, patta_number, owner_idx, name FROM patta_owners'
+
+def connect(db_path):
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+def village_filter(frame, village_code):
+    ## Exact village or a '<district>/<taluk>' prefix
+    if not village_code:
+        return frame
+    prefix = village_code.rstrip('/') + '/'
+    codes = frame['village_code']
+    return frame[(codes == village_code) | codes.str.startswith(prefix)]
+
+def read_surveys(db_path, village_code=None):
+    with connect(db_path) as conn:
+        surveys = pd.read_sql_query(SURVEYS_SQL, conn)
+    surveys['patta_number'] = pd.to_numeric(surveys['patta_number'], errors='coerce').astype('Int64')
+    surveys['land_type'] = surveys['land_type'].astype('category')
+    for column in ['hectares', 'ares', 'cents', 'amount']:
+        surveys[column] = surveys[column].fillna(0.0).astype(np.float64)
+    return village_filter(surveys, village_code)
+
+def read_owners(db_path, village_code=None):
+    with connect(db_path) as conn:
+        owners = pd.read_sql_query(OWNERS_SQL, conn)
+    owners['patta_number'] = pd.to_numeric(owners['patta_number'], errors='coerce').astype('Int64')
+    return village_filter(owners, village_code)
+
+def read_tslr(db_path):
+    with connect(db_path) as conn:
+        tslr = pd.read_sql_query(f'SELECT {", ".join(TSLR_KEY_COLUMNS)}, details, fetched_at FROM tslr_details', conn)
+    details = pd.json_normalize([ json.loads(d) for d in tslr.pop('details') ])
+    ## The parsed page repeats the key fields (block_code, land_type...): key columns win
+    details = details.drop(columns=[ c for c in details.columns if c in tslr.columns ])
+    return pd.concat([ tslr.reset_index(drop=True), details ], axis=1)
+
+#---------------------------------------------------------------------------------
+# Export
+#---------------------------------------------------------------------------------
+def write_frame(frame, path, file_format):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, f"{path}.parquet", compression='zstd')
+        return f"{path}.parquet"
+    import pyarrow.feather as feather
+    feather.write_feather(table, f"{path}.arrow", compression='zstd')
+    return f"{path}.arrow"
+
+def export(out_dir, patta_db=PATTA_DB, tslr_db=TSLR_DB, file_format='parquet', village_code=None):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    frames = {}
+    if Path(patta_db).exists():
+        frames['patta_surveys'] = read_surveys(patta_db, village_code)
+        frames['patta_owners'] = read_owners(patta_db, village_code)
+    if Path(tslr_db).exists():
+        frames['tslr_details'] = read_tslr(tslr_db)
+    for name, frame in frames.items():
+        path = write_frame(frame, out_dir / name, file_format)
+        print(f"Exported {len(frame)} row(s) to {path}")
+    return frames
+
+#---------------------------------------------------------------------------------
+# Aggregates: area (cents) per land type and tax amount per village / patta / owner.
+# An owner is credited with the whole area of every patta they are on.
+#---------------------------------------------------------------------------------
+def area_by_land_type(surveys, keys):
+    area = surveys.pivot_table(index=keys, columns='land_type', values='cents', aggfunc='sum', fill_value=0.0, observed=False)
+    area = area.reindex(columns=LAND_TYPES, fill_value=0.0)
+    area.columns = [ f"{c}_cents" for c in area.columns ]
+    totals = surveys.groupby(keys, observed=True).agg(surveys=('survey_identifier', 'size'), amount=('amount', 'sum'))
+    report = area.join(totals, how='inner')
+    report['total_cents'] = report[[ f"{c}_cents" for c in LAND_TYPES ]].sum(axis=1)
+    return report
+
+def patta_report(surveys):
+    return area_by_land_type(surveys, ['village_code', 'patta_number'])
+
+def village_report(surveys):
+    report = area_by_land_type(surveys, ['village_code'])
+    report.insert(0, 'pattas', surveys.groupby('village_code')['patta_number'].nunique())
+    return report
+
+def owner_report(surveys, owners):
+    per_patta = patta_report(surveys).reset_index()
+    holdings = owners.merge(per_patta, on=['village_code', 'patta_number'], how='inner')
+    value_columns = [ c for c in per_patta.columns if c not in ('village_code', 'patta_number') ]
+    report = holdings.groupby(['village_code', 'name'])[value_columns].sum()
+    report.insert(0, 'pattas', holdings.groupby(['village_code', 'name'])['patta_number'].nunique())
+    return report
+
+def build_report(by, patta_db=PATTA_DB, village_code=None):
+    surveys = read_surveys(patta_db, village_code)
+    if by == 'village':
+        return village_report(surveys)
+    if by == 'patta':
+        return patta_report(surveys)
+    return owner_report(surveys, read_owners(patta_db, village_code))
+
+def parse_commandline_params():
+    parser = argparse.ArgumentParser(
+        prog='Export Patta / TSLR',
+        description='Export the patta / TSLR databases as Parquet / Arrow and report the area per village, patta or owner'
+    )
+    parser.add_argument("command", choices=['export', 'report'], help="Columnar export or area report")
+    parser.add_argument("--patta-db", dest='patta_db', default=PATTA_DB, help="SQLite database with the patta details")
+    parser.add_argument("--tslr-db", dest='tslr_db', default=TSLR_DB, help="SQLite database with the TSLR details")
+    parser.add_argument("-v", "--village", dest='village_code', help="Village code <district>/<taluk>/<village> (or a district / taluk prefix)")
+    parser.add_argument("--out", dest='out_path', help="export: output directory (default export), report: *.csv / *.parquet file")
+    parser.add_argument("--format", dest='file_format', choices=['parquet', 'arrow'], default='parquet', help="export: file format")
+    parser.add_argument("--by", dest='by', choices=['village', 'patta', 'owner'], default='village', help="report: aggregation level")
+    parser.add_argument("--top", dest='top', type=int, default=20, help="report: rows to print, largest total area first")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    start = time.perf_counter()
+    if args.command == 'export':
+        export(args.out_path or 'export', args.patta_db, args.tslr_db, args.file_format, args.village_code)
+    else:
+        report = build_report(args.by, args.patta_db, args.village_code)
+        if args.out_path:
+            if args.out_path.endswith('.parquet'): report.reset_index().to_parquet(args.out_path, index=False)
+            else: report.to_csv(args.out_path)
+            print(f"Report of {len(report)} row(s) written to {args.out_path}")
+        with pd.option_context('display.width', 200, 'display.max_columns', 20, 'display.float_format', '{:,.2f}'.format):
+            print(report.sort_values('total_cents', ascending=False).head(args.top))
+    print(f"Done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
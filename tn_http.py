@@ -0,0 +1,196 @@
+import os
+import time
+import threading
+import urllib.parse
+from collections import deque, defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from tn_metrics import percentile
+
+#---------------------------------------------------------------------------------
+# Shared HTTP transport for tn_patta / tn_tslr.
+#
+# Every session gets pooled keep-alive connections, a default (connect, read)
+# timeout and bounded exponential backoff retries on connect errors and 5xx.
+# Status / read retries are limited to idempotent methods, so an extract POST
+# (which uses up the captcha) is never replayed.
+#---------------------------------------------------------------------------------
+ESERVICES_HOST = 'https://eservices.tn.gov.in/'
+ESERVICES_BASE_URL = 'https://eservices.tn.gov.in/eservicesnew/land/'
+RETRY_STATUS = (500, 502, 503, 504)
+
+transport_options = {
+    'pool_size': 10,
+    'timeout': (10, 60), # connect, read seconds
+    'retries': 3,
+    'backoff': 0.5,      # 0.5s, 1s, 2s ...
+    'verify': True,      # True (system CAs), a CA bundle path or False
+    'base_url': os.environ.get('ESERVICES_BASE_URL', ESERVICES_BASE_URL), # e.g. the tn_standin server
+    'record_dir': None,  # Record responses as tn_standin fixtures
+}
+
+def land_url(page):
+    return urllib.parse.urljoin(transport_options['base_url'], page)
+
+def configure_transport(**options):
+    transport_options.update({ k: v for k, v in options.items() if v is not None })
+    if transport_options['verify'] is False:
+        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+def add_transport_arguments(parser):
+    parser.add_argument("--pool-size", dest='pool_size', type=int, help="Keep-alive connections per session")
+    parser.add_argument("--timeout", dest='timeout', type=float, help="Read timeout in seconds")
+    parser.add_argument("--retries", dest='retries', type=int, help="Retries on connect errors / 5xx")
+    parser.add_argument("--ca-bundle", dest='ca_bundle', help="CA bundle to verify eservices.tn.gov.in against")
+    parser.add_argument("--insecure", action='store_true', dest='insecure', default=False, help="Do not verify the TLS certificate")
+    parser.add_argument("--base-url", dest='base_url', help=f"Base URL of the land records pages (default {ESERVICES_BASE_URL})")
+    parser.add_argument("--record", dest='record_dir', help="Record the responses as tn_standin fixtures in this directory")
+    parser.add_argument("--max-inflight", dest='max_inflight', type=int, default=0, help="Adapt concurrent requests (AIMD) up to this limit (0 = no limit)")
+
+def configure_from_args(args):
+    verify = False if args.insecure else args.ca_bundle
+    timeout = (transport_options['timeout'][0], args.timeout) if args.timeout else None
+    configure_transport(pool_size=args.pool_size, timeout=timeout, retries=args.retries, verify=verify,
+        base_url=args.base_url, record_dir=args.record_dir)
+    if args.max_inflight > 0:
+        set_rate_controller(AimdController(args.max_inflight))
+
+#---------------------------------------------------------------------------------
+# AIMD concurrency controller shared by all sessions (captcha, extract and ajax).
+#
+# The in-flight limit grows by ~1 per round trip while requests succeed at a
+# healthy latency, and is halved (at most once per round trip) on timeouts,
+# connection errors, 5xx, error pages (report_overload) or latency above
+# latency_factor x the baseline (p10) of that kind of request.
+#---------------------------------------------------------------------------------
+class AimdController:
+    def __init__(self, max_limit, min_limit=1, initial_limit=2, decrease_factor=0.5, latency_factor=3.0, window=1000):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+        self.baselines = defaultdict(lambda: deque(maxlen=200)) # request kind => latencies
+        self.last_decrease = 0
+        self.successes = self.failures = self.decreases = 0
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, kind, start, ok=True):
+        latency = time.monotonic() - start
+        with self.cond:
+            self.in_flight -= 1
+            self.latencies.append(latency)
+            samples = self.baselines[kind]
+            samples.append(latency)
+            if not ok:
+                self.failures += 1
+                self._decrease()
+            elif len(samples) >= 20 and latency > self.latency_factor * percentile(samples, 10):
+                self.successes += 1
+                self._decrease()
+            else:
+                self.successes += 1
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def report_overload(self):
+        with self.cond:
+            self.failures += 1
+            self._decrease()
+
+    def _decrease(self):
+        ## One cut per congestion event: requests already in flight report the same event
+        now = time.monotonic()
+        if now - self.last_decrease < (percentile(self.latencies, 50) or 1.0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.decreases += 1
+
+    def stats(self):
+        with self.cond:
+            latencies = list(self.latencies)
+            return {
+                'limit': int(self.limit), 'in_flight': self.in_flight,
+                'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99),
+                'successes': self.successes, 'failures': self.failures, 'decreases': self.decreases,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        print(f"Rate Controller: limit {stats['limit']} // p50 {stats['p50'] * 1000:.0f}ms p99 {stats['p99'] * 1000:.0f}ms"
+            f" // {stats['successes']} ok, {stats['failures']} failed, {stats['decreases']} decrease(s)")
+        return stats
+
+rate_controller = None
+
+def set_rate_controller(controller):
+    global rate_controller
+    rate_controller = controller
+
+def report_overload():
+    if rate_controller: rate_controller.report_overload()
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        controller = rate_controller
+        if controller is None:
+            return super().send(request, **kwargs)
+        kind = f"{request.method} {urllib.parse.urlsplit(request.url).path}"
+        start = controller.acquire()
+        ok = False
+        try:
+            response = super().send(request, **kwargs)
+            ok = response.status_code < 500
+            return response
+        finally:
+            controller.release(kind, start, ok)
+
+def new_adapter():
+    retries = transport_options['retries']
+    retry = Retry(
+        total=retries, connect=retries, read=retries, status=retries,
+        backoff_factor=transport_options['backoff'],
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, # No POST
+        raise_on_status=False
+    )
+    pool_size = transport_options['pool_size']
+    return TimeoutHTTPAdapter(timeout=transport_options['timeout'], max_retries=retry,
+        pool_connections=pool_size, pool_maxsize=pool_size)
+
+def new_session(prime_url=None):
+    s = requests.Session()
+    adapter = new_adapter()
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    s.verify = transport_options['verify']
+    s.headers.update({'referer': ESERVICES_HOST})
+    if transport_options['record_dir']:
+        from tn_standin import FixtureRecorder
+        s.hooks['response'].append(FixtureRecorder(transport_options['record_dir']))
+    if prime_url:
+        s.get(prime_url) ## Prime the session cookies before any captcha is fetched
+    return s
+
+def prime_session(session, prime_url):
+    ## Expired server session: start over with fresh cookies
+    session.cookies.clear()
+    session.get(prime_url)
@@ -0,0 +1,177 @@
+import json
+import time
+import bisect
+import itertools
+import threading
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+
+#---------------------------------------------------------------------------------
+# Per record counters, e.g. captcha OCR attempts / rejects for every survey fetched
+#---------------------------------------------------------------------------------
+class RecordCounters:
+    def __init__(self, names):
+        self.names = names
+        self.lock = threading.Lock()
+        self.records = defaultdict(Counter)
+
+    def incr(self, identifier, name, count=1):
+        with self.lock:
+            self.records[identifier][name] += count
+
+    def get(self, identifier):
+        with self.lock:
+            return dict(self.records.get(identifier, {}))
+
+    def pop(self, identifier):
+        ## Long-running callers (tn_service) fold a record's counts into their own totals
+        with self.lock:
+            return self.records.pop(identifier, Counter())
+
+    def totals(self):
+        with self.lock:
+            totals = Counter()
+            for counts in self.records.values(): totals.update(counts)
+            return totals
+
+    def summary(self, title):
+        totals = self.totals()
+        num_records = len(self.records)
+        print(f"{title}: {num_records} record(s)")
+        for name in self.names:
+            per_record = totals[name] / num_records if num_records else 0
+            print(f"  {name:<16} {totals[name]:8d} total // {per_record:6.2f} per record")
+        return totals
+
+def percentile(values, q):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+#---------------------------------------------------------------------------------
+# Per stage timings (captcha download, OCR, extract POST, parse, SQLite ...) of
+# every record, kept as fixed histogram buckets + count / sum / max per stage, so
+# a long crawl or the lookup service never grows them. The percentiles are
+# interpolated within the buckets.
+#
+# Stages timed inside another one on the same thread (record > captcha > ocr) are
+# kept under their path, e.g. 'record/captcha/ocr'. 'total' includes the nested
+# stages, 'self' does not: the self times add up without counting anything twice.
+#---------------------------------------------------------------------------------
+HISTOGRAM_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60] # seconds
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = self.self_total = self.max = 0.0
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1) # Per bucket, the last one is +Inf
+
+    def add(self, seconds, self_seconds):
+        self.count += 1
+        self.total += seconds
+        self.self_total += self_seconds
+        self.max = max(self.max, seconds)
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+
+    def percentile(self, q):
+        ## Linear within the bucket holding the q-th sample, the +Inf bucket ends at the max
+        rank = q / 100 * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = HISTOGRAM_BUCKETS[idx - 1] if idx else 0.0
+                upper = HISTOGRAM_BUCKETS[idx] if idx < len(HISTOGRAM_BUCKETS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return 0.0
+
+class StageTimings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {} # stage path => Histogram
+        self.local = threading.local()
+
+    def record(self, stage, seconds, self_seconds=None):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.add(seconds, seconds if self_seconds is None else self_seconds)
+
+    @contextmanager
+    def time(self, stage):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        frame = [ f"{stack[-1][0]}/{stage}" if stack else stage, 0.0 ] # path, time in nested stages
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            if stack: stack[-1][1] += seconds
+            self.record(frame[0], seconds, seconds - frame[1])
+
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for stage, h in self.stages.items():
+                cumulative = list(itertools.accumulate(h.counts))
+                stats[stage] = {
+                    'count': h.count, 'total': h.total, 'self': h.self_total,
+                    'p50': h.percentile(50), 'p95': h.percentile(95), 'p99': h.percentile(99), 'max': h.max,
+                    'buckets': cumulative[:len(HISTOGRAM_BUCKETS)],
+                }
+            return stats
+
+    def summary(self, title):
+        stats = self.stats()
+        print(f"{title}: {len(stats)} stage(s) // nested stages are indented, their time is included in the parent's total")
+        print(f"  {'stage':<24} {'count':>8} {'total':>10} {'self':>10} {'p50':>9} {'p95':>9} {'p99':>9}")
+        ## Depth first, the slowest first on every level
+        order = lambda stage: [ (-stats[path]['total'] if path in stats else 0, path) for path in
+            itertools.accumulate(stage.split('/'), lambda path, name: f"{path}/{name}") ]
+        for stage in sorted(stats, key=order):
+            s = stats[stage]
+            name = '  ' * stage.count('/') + stage.rsplit('/', 1)[-1]
+            print(f"  {name:<24} {s['count']:8d} {s['total']:9.2f}s {s['self']:9.2f}s {s['p50'] * 1000:7.1f}ms {s['p95'] * 1000:7.1f}ms {s['p99'] * 1000:7.1f}ms")
+        print(f"  {'(self time)':<24} {'':>8} {sum(s['self'] for s in stats.values()):9.2f}s")
+        return stats
+
+    def to_json(self):
+        return json.dumps({ 'buckets': HISTOGRAM_BUCKETS, 'stages': self.stats() }, indent=2)
+
+    def to_prometheus(self, name='tn_stage_duration_seconds'):
+        stats = self.stats()
+        lines = [ f"# HELP {name} Time spent per record in each crawl stage (nested stages by path, included in the parent)", f"# TYPE {name} histogram" ]
+        for stage, s in sorted(stats.items()):
+            for le, count in zip(HISTOGRAM_BUCKETS, s['buckets']):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {count}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {s["count"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {s["total"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {s["count"]}')
+        self_name = name.replace('_duration_seconds', '_self_seconds') + '_total'
+        lines += [ f"# HELP {self_name} Time spent in each crawl stage, without its nested stages", f"# TYPE {self_name} counter" ]
+        for stage, s in sorted(stats.items()):
+            lines.append(f'{self_name}{{stage="{stage}"}} {s["self"]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        ## JSON for *.json, Prometheus text format otherwise
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json() if path.endswith('.json') else self.to_prometheus())
+
+stage_timings = StageTimings()
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", action='store_true', dest='profile', default=False, help="Print the per stage timings at the end")
+    parser.add_argument("--profile-output", dest='profile_output', help="Write the per stage timings to this file (*.json or Prometheus text format)")
+
+def report_profile(args):
+    if args.profile:
+        stage_timings.summary("Stage Timings")
+    if args.profile_output:
+        stage_timings.write(args.profile_output)
+        print(f"Stage timings written to {args.profile_output}")
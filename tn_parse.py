@@ -0,0 +1,300 @@
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+from itertools import product
+from decimal import Decimal
+import lxml.html
+import lxml.etree
+
+#---------------------------------------------------------------------------------
+# lxml based parsers for the patta (chittaExtract) and TSLR (chittaExtractUrbanTaluk)
+# responses and the ajax.html XML lookups, shared by tn_patta and tn_tslr.
+#
+# The output is identical to the earlier BeautifulSoup parsers (kept in
+# tn_parse_legacy); `python tn_parse.py parity <dir>` checks that on a directory
+# of saved responses and reports the parse time of both. tests/test_parse.py
+# asserts it on the anonymised responses in tests/responses.
+#---------------------------------------------------------------------------------
+STRIP_HTML_REGEX = re.compile('<.*?>')
+STRIP_WSPACE_REGEX = re.compile(r'\s+', re.UNICODE)
+PATTA_NUMBER_MARKER = 'பட்டா எண் :'
+CELL_TAGS = { 'td', 'th' }
+
+def parse_html(html_text):
+    if not html_text or not html_text.strip():
+        return None
+    try:
+        return lxml.html.document_fromstring(html_text)
+    except ValueError:
+        ## Unicode string with an encoding declaration
+        return lxml.html.document_fromstring(html_text.encode('utf-8'))
+    except lxml.etree.ParserError:
+        return None
+
+def get_xml_values(xml_text, path):
+    ## Text of every `path` element (e.g. 'ward/wardCode') of an ajax.html XML response
+    root = lxml.etree.fromstring(xml_text.encode('utf-8') if isinstance(xml_text, str) else xml_text)
+    return [ (e.text or '').strip() for e in root.iterfind(path) ]
+
+def table_to_2d(table_tag):
+    rows = list(table_tag.iter('tr'))
+    ## Direct td/th children of every row, collected once for both passes
+    row_cells = [ [ c for c in row if c.tag in CELL_TAGS ] for row in rows ]
+
+    # first scan, see how many columns we need
+    rowspans = []  # track pending rowspans
+    colcount = 0
+    for r, cells in enumerate(row_cells):
+        # count columns (including spanned).
+        # add active rowspans from preceding rows
+        # we *ignore* the colspan value on the last cell, to prevent
+        # creating 'phantom' columns with no actual cells, only extended
+        # colspans. This is achieved by hardcoding the last cell width as 1.
+        # a colspan of 0 means “fill until the end” but can really only apply
+        # to the last cell; ignore it elsewhere.
+        colcount = max(
+            colcount,
+            sum(int(c.get('colspan', 1)) or 1 for c in cells[:-1]) + len(cells[-1:]) + len(rowspans))
+        # update rowspan bookkeeping; 0 is a span to the bottom.
+        rowspans += [int(c.get('rowspan', 1)) or len(rows) - r for c in cells]
+        rowspans = [s - 1 for s in rowspans if s > 1]
+
+    # build an empty matrix for all possible cells
+    table = [[None] * colcount for row in rows]
+
+    # fill matrix from row data
+    rowspans = {}  # track pending rowspans, column number mapping to count
+    for row, cells in enumerate(row_cells):
+        span_offset = 0  # how many columns are skipped due to row and colspans
+        for col, cell in enumerate(cells):
+            # adjust for preceding row and colspans
+            col += span_offset
+            while rowspans.get(col, 0):
+                span_offset += 1
+                col += 1
+
+            # fill table data
+            rowspan = rowspans[col] = int(cell.get('rowspan', 1)) or len(rows) - row
+            colspan = int(cell.get('colspan', 1)) or colcount - col
+            # next column is offset by the colspan
+            span_offset += colspan - 1
+            value = cell.text_content()
+            for drow, dcol in product(range(rowspan), range(colspan)):
+                try:
+                    table[row + drow][col + dcol] = value
+                    rowspans[col + dcol] = rowspan
+                except IndexError:
+                    # rowspan or colspan outside the confines of the table
+                    pass
+
+        # update rowspan bookkeeping
+        rowspans = {c: s - 1 for c, s in rowspans.items() if s > 1}
+
+    return table
+
+def get_person_details(table):
+    table_array = table_to_2d(table)
+    pdetails = {}
+    for row in table_array:
+        if row[0] and row[0].strip():
+            row = [ r.strip().strip('.') for r in row ]
+            pdetails[int(row[0])] = ' '.join(row[1:])
+    return pdetails
+
+### Note: Nanjai = Wetland, Panjai = Dryland
+SURVEY_HEADERS = [ "survey no", "subdivision", "dryland spread", "dryland amount", "wetland spread", "wetland amount", "other spread", "other amount", "details"]
+CENTS_PER_ARE = Decimal('2.47')
+
+def get_survey_details(table):
+    table_array = table_to_2d(table)
+    table_array = [ l for l in table_array if any(v is not None for v in l) ]
+    headers = SURVEY_HEADERS
+
+    sdetails = {}
+    for row in table_array[2:-1]: ## Remove last row (total)
+        row = [ r.strip() for r in row ]
+        if row[0]:
+            sidx = row[0] if row[1].startswith('-') else row[0] + '/' + row[1]
+            sdetails[sidx] = {}
+            for idx, col in enumerate(row[2:], 2):
+                header_prefix = headers[idx].split()[0]
+                if headers[idx].endswith("spread"):
+                    hectares = float((col.split('-')[0] or '0').strip())
+                    ares = float((col.split('-')[1] or '0').strip())
+                    if hectares or ares:
+                        sdetails[sidx]['land_type'] = header_prefix
+                        sdetails[sidx]['hectares'] = hectares # 2.47 acres
+                        sdetails[sidx]['ares'] = ares
+                        sdetails[sidx]['cents'] = Decimal(str(hectares * 100 + ares)) * CENTS_PER_ARE
+                elif headers[idx].endswith("amount"):
+                    if sdetails[sidx].get('land_type') == header_prefix:
+                        sdetails[sidx]['amount'] = col
+                else:
+                    sdetails[sidx][headers[idx]] = col
+    return sdetails
+
+def get_contents(td):
+    ## Same pieces as BeautifulSoup's td.contents: text nodes and child elements (tails are separate text nodes)
+    if td.text: yield td.text
+    for child in td:
+        if isinstance(child.tag, str):
+            yield lxml.html.tostring(child, encoding='unicode', with_tail=False)
+        elif child.text:
+            yield child.text ## Comment
+        if child.tail: yield child.tail
+
+def get_patta_number(td):
+    contents = [ re.sub(STRIP_WSPACE_REGEX, ' ', re.sub(STRIP_HTML_REGEX, '', sx.strip())) \
+        for sx in get_contents(td) if PATTA_NUMBER_MARKER in sx ]
+    return contents[0].split()[-1] if contents else None
+
+def extract_patta_details(identifier, html_text):
+    tree = parse_html(html_text)
+    tbl = tree.find('.//table') if tree is not None else None
+    if tbl is not None:
+        ## Single pass over the cells: 1st nested table = people, 2nd = surveys, patta number from the text
+        tables_found = 0
+        patta_details = {}
+        for td in tbl.iter('td'):
+            table = td.find('.//table')
+            if table is not None:
+                tables_found += 1
+                if (tables_found == 1):
+                    patta_details['people'] = get_person_details(table)
+                elif (tables_found == 2):
+                    patta_details['survey'] = get_survey_details(table)
+            elif len(td) or td.text:
+                patta_number = get_patta_number(td)
+                if patta_number:
+                    patta_details['patta_number'] = patta_number
+        return patta_details
+    elif tree is not None and tree.find('.//form[@name="landForm"]') is not None:
+        error = tree.find('.//font[@class="normal_text_red"]')
+        print(f"  Error: {''.join(t.strip() for t in error.itertext()) if error is not None else ''}")
+    else:
+        print(f"  Error: Survey Table Not Found")
+    # By Default.... return None
+    return None
+
+def extract_tslr_details(html_text):
+    tree = parse_html(html_text)
+    tbody = tree.find('.//tbody') if tree is not None else None
+    if tbody is None:
+        return None
+    tds = list(tbody.iter('td'))
+    return {
+        'block_code': tds[1].text_content().strip(),
+        'old_survey_no': tds[4].text_content().strip(),
+        'door_no': tds[5].text_content().strip(),
+        'land_type': tds[6].text_content().strip(),
+        'land_sub_type': tds[7].text_content().strip(),
+        'addl_details': tds[20].text_content().strip(),
+        'remarks': tds[22].text_content().strip()
+    }
+
+#---------------------------------------------------------------------------------
+# Extract response classes: every class has its own retry policy (see
+# tn_captcha.EXTRACT_RETRIES), instead of one blind retry of any failure.
+#---------------------------------------------------------------------------------
+SUCCESS = 'success'
+CAPTCHA_REJECTED = 'captcha_rejected' # Re-solve and POST again right away
+NOT_FOUND = 'not_found'               # Record genuinely absent: recorded, never retried
+SESSION_EXPIRED = 'session_expired'   # Prime the session cookies again, then POST again
+SERVER_ERROR = 'server_error'         # Not a 200, empty or unknown page: back off, then POST again
+
+CAPTCHA_ERROR_REGEX = re.compile(r'captcha', re.I)
+SESSION_ERROR_REGEX = re.compile(r'session\s+(has\s+)?(expired|timed?\s*out)|session\s+(is\s+)?invalid|please\s+login', re.I)
+## Only about the record searched for: 'Service not available' is a server error
+RECORD_WORDS = r'(data|records?|details?|survey(\s+number)?|sub\s*div(ision)?|patta|ward|block)'
+NOT_FOUND_REGEX = re.compile(rf'no\s+{RECORD_WORDS}\s+(is\s+|are\s+)?(found|available|exists?)|{RECORD_WORDS}\s+(is\s+|are\s+|does\s+)?not\s+(found|available|exists?)|invalid\s+{RECORD_WORDS}', re.I)
+
+def get_error_text(tree):
+    error = tree.find('.//font[@class="normal_text_red"]')
+    return ''.join(t.strip() + ' ' for t in error.itertext()).strip() if error is not None else ''
+
+def is_empty_result(tree):
+    ## The result table with its header row and no data cell (e.g. TSLR on a sparse block)
+    for table in tree.iter('table'):
+        if table.find('thead') is not None and next(table.iter('td'), None) is None:
+            return True
+    return False
+
+def classify_response(status_code, html_text, found):
+    ## found: the parser got the record out of html_text. Anything but a 200 (5xx, a proxy's 404 ...) is retried
+    if status_code != 200:
+        return SERVER_ERROR
+    if found:
+        return SUCCESS
+    tree = parse_html(html_text)
+    if tree is None:
+        return SERVER_ERROR
+    if tree.find('.//form[@name="landForm"]') is not None:
+        ## Search form again, with the reason in red. A blank reason proves nothing: retried as a server error
+        error = get_error_text(tree)
+        if CAPTCHA_ERROR_REGEX.search(error): return CAPTCHA_REJECTED
+        if SESSION_ERROR_REGEX.search(error): return SESSION_EXPIRED
+        if NOT_FOUND_REGEX.search(error): return NOT_FOUND
+        return SERVER_ERROR
+    if SESSION_ERROR_REGEX.search(tree.text_content()): return SESSION_EXPIRED
+    ## Not-found text anywhere else on the page proves nothing, only the result table without rows does
+    if is_empty_result(tree): return NOT_FOUND
+    ## Anything else (maintenance / unknown error pages, layout tables included) is retried, NOT_FOUND is final
+    return SERVER_ERROR
+
+#---------------------------------------------------------------------------------
+# Parity check against the BeautifulSoup parsers
+#---------------------------------------------------------------------------------
+def time_parser(parse, html_text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat): result = parse(html_text)
+    return result, (time.perf_counter() - start) / repeat
+
+def check_parity(response_dir, repeat=5):
+    import io, contextlib
+    import tn_parse_legacy
+    parsers = [
+        ('patta', lambda h: extract_patta_details('parity', h), lambda h: tn_parse_legacy.extract_patta_details('parity', h)),
+        ('tslr', extract_tslr_details, tn_parse_legacy.extract_tslr_details),
+    ]
+    mismatches = 0
+    totals = { 'lxml': 0.0, 'bs4': 0.0 }
+    paths = sorted(Path(response_dir).glob('*.htm*'))
+    for path in paths:
+        html_text = path.read_text(encoding='utf-8')
+        for name, parse, reference in parsers:
+            with contextlib.redirect_stdout(io.StringIO()): ## Parsers print errors for non-matching pages
+                try:
+                    expected, bs4_time = time_parser(reference, html_text, repeat)
+                except (IndexError, AttributeError, ValueError) as e:
+                    expected, bs4_time = type(e).__name__, 0.0
+                try:
+                    actual, lxml_time = time_parser(parse, html_text, repeat)
+                except (IndexError, AttributeError, ValueError) as e:
+                    actual, lxml_time = type(e).__name__, 0.0
+            totals['bs4'] += bs4_time
+            totals['lxml'] += lxml_time
+            if actual != expected:
+                mismatches += 1
+                print(f"MISMATCH {path.name} [{name}]\n  bs4:  {expected}\n  lxml: {actual}")
+    speedup = totals['bs4'] / totals['lxml'] if totals['lxml'] else 0
+    print(f"Parity: {len(paths)} response(s), {mismatches} mismatch(es) // bs4 {totals['bs4'] * 1000:.2f}ms lxml {totals['lxml'] * 1000:.2f}ms ({speedup:.1f}x)")
+    return mismatches
+
+def parse_commandline_params():
+    parser = argparse.ArgumentParser(
+        prog='Parse Responses',
+        description='Check the lxml parsers against the BeautifulSoup ones on saved responses'
+    )
+    parser.add_argument("command", choices=['parity'], help="Parity check")
+    parser.add_argument("response_dir", help="Directory of saved *.html responses")
+    parser.add_argument("--repeat", dest='repeat', type=int, default=5, help="Parse each response this many times for the timings")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    sys.exit(1 if check_parity(args.response_dir, args.repeat) else 0)
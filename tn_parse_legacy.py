@@ -0,0 +1,164 @@
+from bs4 import BeautifulSoup
+import re
+from itertools import product
+from decimal import Decimal
+
+#---------------------------------------------------------------------------------
+# BeautifulSoup parsers as they were before tn_parse moved to lxml.
+# Only used as the reference for `python tn_parse.py parity <dir>`.
+#---------------------------------------------------------------------------------
+STRIP_HTML_REGEX = re.compile('<.*?>')
+STRIP_WSPACE_REGEX = re.compile('\s+', re.UNICODE)
+
+def table_to_2d(table_tag):
+    rowspans = []  # track pending rowspans
+    rows = table_tag.find_all('tr')
+
+    # first scan, see how many columns we need
+    colcount = 0
+    for r, row in enumerate(rows):
+        cells = row.find_all(['td', 'th'], recursive=False)
+        # count columns (including spanned).
+        # add active rowspans from preceding rows
+        # we *ignore* the colspan value on the last cell, to prevent
+        # creating 'phantom' columns with no actual cells, only extended
+        # colspans. This is achieved by hardcoding the last cell width as 1.
+        # a colspan of 0 means “fill until the end” but can really only apply
+        # to the last cell; ignore it elsewhere.
+        colcount = max(
+            colcount,
+            sum(int(c.get('colspan', 1)) or 1 for c in cells[:-1]) + len(cells[-1:]) + len(rowspans))
+        # update rowspan bookkeeping; 0 is a span to the bottom.
+        rowspans += [int(c.get('rowspan', 1)) or len(rows) - r for c in cells]
+        rowspans = [s - 1 for s in rowspans if s > 1]
+
+    # it doesn't matter if there are still rowspan numbers 'active'; no extra
+    # rows to show in the table means the larger than 1 rowspan numbers in the
+    # last table row are ignored.
+
+    # build an empty matrix for all possible cells
+    table = [[None] * colcount for row in rows]
+
+    # fill matrix from row data
+    rowspans = {}  # track pending rowspans, column number mapping to count
+    for row, row_elem in enumerate(rows):
+        span_offset = 0  # how many columns are skipped due to row and colspans
+        for col, cell in enumerate(row_elem.find_all(['td', 'th'], recursive=False)):
+            # adjust for preceding row and colspans
+            col += span_offset
+            while rowspans.get(col, 0):
+                span_offset += 1
+                col += 1
+
+            # fill table data
+            rowspan = rowspans[col] = int(cell.get('rowspan', 1)) or len(rows) - row
+            colspan = int(cell.get('colspan', 1)) or colcount - col
+            # next column is offset by the colspan
+            span_offset += colspan - 1
+            value = cell.get_text()
+            for drow, dcol in product(range(rowspan), range(colspan)):
+                try:
+                    table[row + drow][col + dcol] = value
+                    rowspans[col + dcol] = rowspan
+                except IndexError:
+                    # rowspan or colspan outside the confines of the table
+                    pass
+
+        # update rowspan bookkeeping
+        rowspans = {c: s - 1 for c, s in rowspans.items() if s > 1}
+
+    return table
+
+def get_person_details(table):
+    table_array = table_to_2d(table)
+    pdetails = {}
+    for row in table_array:
+        if row[0] and row[0].strip():
+            row = [ r.strip().strip('.') for r in row ]
+            pdetails[int(row[0])] = ' '.join(row[1:])
+    return pdetails
+
+def get_survey_details(table):
+    table_array = table_to_2d(table)
+    # print(f"Survey Table")
+    # for t in table_array: print(f"  {t}")
+    table_array = [ l for l in table_array if any(v is not None for v in l) ]
+    # headers = [ r.strip() for r in table_array[0] ]
+    # headers = [ (h + ' ' + h1.strip()) if h1.strip() else h for h,h1 in zip(headers, table_array[1]) ]
+    # headers = [ (h + ' (' + h2.strip() + ')') if h2.strip() else h for h,h2 in zip(headers, table_array[2]) ]
+    # print(f"Tamil Headers: {headers}")
+
+    ### Note: Nanjai = Wetland, Panjai = Dryland
+    headers = [ "survey no", "subdivision", "dryland spread", "dryland amount", "wetland spread", "wetland amount", "other spread", "other amount", "details"]
+
+    sdetails = {}
+    for row in table_array[2:-1]: ## Remove last row (total)
+        row = [ r.strip() for r in row ]
+        if row[0]:
+            sidx = row[0].strip() if row[1].strip().startswith('-') else row[0].strip() + '/' + row[1].strip()
+            sdetails[sidx] = {}
+            for idx, col in enumerate(row[2:], 2):
+                header_prefix = headers[idx].split()[0]
+                if headers[idx].endswith("spread"):
+                    hectares = float((col.strip().split('-')[0] or '0').strip())
+                    ares = float((col.strip().split('-')[1] or '0').strip())
+                    if hectares or ares:
+                        sdetails[sidx]['land_type'] = header_prefix
+                        sdetails[sidx]['hectares'] = hectares # 2.47 acres
+                        sdetails[sidx]['ares'] = ares
+                        sdetails[sidx]['cents'] = Decimal(str(hectares * 100 + ares)) * Decimal('2.47')
+                elif headers[idx].endswith("amount"):
+                    if sdetails[sidx].get('land_type') == header_prefix:
+                        sdetails[sidx]['amount'] = col.strip()
+                else:
+                    sdetails[sidx][headers[idx]] = col.strip()
+    return sdetails
+
+def extract_patta_details(identifier, html_text):
+    soup = BeautifulSoup(html_text, 'lxml')
+    tbl = soup.find('table')
+    tables_found = 0
+    patta_details = {}
+    if tbl:
+        tds = tbl.find_all('td')
+        for idx, td in enumerate(tds):
+            if td.find('table'):
+                tables_found += 1
+                if (tables_found == 1):
+                    pdetails = get_person_details(td.find('table'))
+                    patta_details['people'] = pdetails
+                elif (tables_found == 2):
+                    sdetails = get_survey_details(td.find('table'))
+                    patta_details['survey'] = sdetails
+            elif td and td.contents:
+                contents = [ re.sub(STRIP_WSPACE_REGEX, ' ', re.sub(STRIP_HTML_REGEX, '', str(sx).strip())) \
+                    for sx in td.contents  if 'பட்டா எண் :' in str(sx) ]
+                if contents:
+                    patta_number = contents[0].split()[-1]
+                    patta_details['patta_number'] = patta_number
+
+        return patta_details
+    else:
+        form = soup.find("form", {"name": "landForm"})
+        if form:
+            error =  soup.find("font", {"class": "normal_text_red"})
+            print(f"  Error: {error.get_text(strip=True)}")
+        else:
+            print(f"  Error: Survey Table Not Found")
+    # By Default.... return None
+    return None
+
+def extract_tslr_details(html_text):
+    soup = BeautifulSoup(html_text, 'lxml')
+    if soup.find('tbody'):
+        tds = soup.find("tbody").find_all("td")
+        return {
+            'block_code': tds[1].get_text().strip(),
+            'old_survey_no': tds[4].get_text().strip(),
+            'door_no': tds[5].get_text().strip(),
+            'land_type': tds[6].get_text().strip(),
+            'land_sub_type': tds[7].get_text().strip(),
+            'addl_details': tds[20].get_text().strip(),
+            'remarks': tds[22].get_text().strip()
+        }
+    return None
@@ -1,141 +1,44 @@
-import requests
-import lxml.html
-from PIL import Image
-from io import BytesIO
-import pytesseract
-from bs4 import BeautifulSoup
-import xmltodict, json
+import json
+import os
 import re
-from itertools import product
-from decimal import Decimal
-import urllib
+import sys
+import csv
+import time
+import hashlib
+import logging
+import threading
 import argparse
-import sqlite3
-from xhtml2pdf import pisa             # import python module
-from contextlib import closing
-
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
-PATTA_CHECK_URL = 'https://eservices.tn.gov.in/eservicesnew/land/chittaCheckNewRural_en.html?lan=en'
-PATTA_EXTRACT_URL = 'https://eservices.tn.gov.in/eservicesnew/land/chittaExtract_en.html?lan=en'
-ESERVICES_URL = "https://eservices.tn.gov.in/eservicesnew/land/ajax.html"
-STRIP_HTML_REGEX = re.compile('<.*?>')
-STRIP_WSPACE_REGEX = re.compile('\s+', re.UNICODE)
-
-def table_to_2d(table_tag):
-    rowspans = []  # track pending rowspans
-    rows = table_tag.find_all('tr')
-
-    # first scan, see how many columns we need
-    colcount = 0
-    for r, row in enumerate(rows):
-        cells = row.find_all(['td', 'th'], recursive=False)
-        # count columns (including spanned).
-        # add active rowspans from preceding rows
-        # we *ignore* the colspan value on the last cell, to prevent
-        # creating 'phantom' columns with no actual cells, only extended
-        # colspans. This is achieved by hardcoding the last cell width as 1.
-        # a colspan of 0 means “fill until the end” but can really only apply
-        # to the last cell; ignore it elsewhere.
-        colcount = max(
-            colcount,
-            sum(int(c.get('colspan', 1)) or 1 for c in cells[:-1]) + len(cells[-1:]) + len(rowspans))
-        # update rowspan bookkeeping; 0 is a span to the bottom.
-        rowspans += [int(c.get('rowspan', 1)) or len(rows) - r for c in cells]
-        rowspans = [s - 1 for s in rowspans if s > 1]
-
-    # it doesn't matter if there are still rowspan numbers 'active'; no extra
-    # rows to show in the table means the larger than 1 rowspan numbers in the
-    # last table row are ignored.
-
-    # build an empty matrix for all possible cells
-    table = [[None] * colcount for row in rows]
-
-    # fill matrix from row data
-    rowspans = {}  # track pending rowspans, column number mapping to count
-    for row, row_elem in enumerate(rows):
-        span_offset = 0  # how many columns are skipped due to row and colspans
-        for col, cell in enumerate(row_elem.find_all(['td', 'th'], recursive=False)):
-            # adjust for preceding row and colspans
-            col += span_offset
-            while rowspans.get(col, 0):
-                span_offset += 1
-                col += 1
-
-            # fill table data
-            rowspan = rowspans[col] = int(cell.get('rowspan', 1)) or len(rows) - row
-            colspan = int(cell.get('colspan', 1)) or colcount - col
-            # next column is offset by the colspan
-            span_offset += colspan - 1
-            value = cell.get_text()
-            for drow, dcol in product(range(rowspan), range(colspan)):
-                try:
-                    table[row + drow][col + dcol] = value
-                    rowspans[col + dcol] = rowspan
-                except IndexError:
-                    # rowspan or colspan outside the confines of the table
-                    pass
-
-        # update rowspan bookkeeping
-        rowspans = {c: s - 1 for c, s in rowspans.items() if s > 1}
-
-    return table
+import contextlib
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import tn_captcha
+import tn_cache
+import tn_archive
+from tn_cache import cached_get, LookupCache, CacheMiss
+from tn_store import PattaStore, PATTA_DB
+from tn_parse import extract_patta_details, classify_response, get_xml_values, NOT_FOUND, SESSION_EXPIRED
+from tn_captcha import get_captcha_value, CaptchaStage
+import tn_http
+from tn_http import land_url
+import tn_metrics
+from tn_metrics import stage_timings
+
+## Relative to the land records base URL (tn_http.land_url, --base-url)
+PATTA_CHECK_PAGE = 'chittaCheckNewRural_en.html?lan=en'
+PATTA_EXTRACT_PAGE = 'chittaExtract_en.html?lan=en'
+AJAX_PAGE = "ajax.html"
 
 def get_code(session, key, **kwargs):
-    qstring=urllib.parse.urlencode(kwargs)
-    url = f"{ESERVICES_URL}?{qstring}&lang=en"
-    response = session.get(url, verify=False)
+    response_text = cached_get(session, land_url(AJAX_PAGE), dict(kwargs, lang='en'))
     # print(tsnum_response.text)
-    resp_json = json.loads(response.text)
+    resp_json = json.loads(response_text)
     resp_codes = { v['value']: v['name'] for v in resp_json['landrecords']['response'] if v['name'] != '00' }
     return resp_codes.get(key)
 
 def get_subdivision_numbers(session, **kwargs):
-    qstring=urllib.parse.urlencode(kwargs)
-    url = f"{ESERVICES_URL}?{qstring}"
-    response = requests.get(url, verify=False)
-    # print(tsnum_response.text)
-    xpars = xmltodict.parse(response.text)
-    xpars_json = json.loads(json.dumps(xpars))
-    if type(xpars_json['root']['subdiv']) is dict:
-        subdivNos = [ xpars_json['root']['subdiv']['subdivcode'] ]
-    else:
-        subdivNos = [ v['subdivcode'] for v in xpars_json['root']['subdiv'] ]
-    return subdivNos
-
-def get_captcha_value(session, identifier, debug=False):
-    captcha_value = get_captcha_value_internal(session)
-    while not validate_captcha(captcha_value, identifier, debug=debug):
-        captcha_value = get_captcha_value_internal(session)
-    return captcha_value
-
-def validate_captcha(captcha_value, identifier, debug=False):
-    if len(captcha_value) != 6:
-        if debug: print(f"Invalid Captcha {identifier} - {captcha_value} [Length != 6]")
-        return False
-    # Seems like Only Alphanumeric is allowed!
-    # if bool(re.match(r'^[A-Z]+$', captcha_value)):
-    #     print(f"Invalid Captcha {identifier} - {captcha_value} [Only Alphabetic]")
-    #     return True
-    # Should not be only numeric
-    if bool(re.match(r'^[0-9]+$', captcha_value)):
-        if debug: print(f"Invalid Captcha {identifier} - {captcha_value} [Only Numeric]")
-        return False
-    # Valid charset = [0-9A-Z] (no lower case).
-    if not bool(re.match(r'^[A-Z0-9]+$', captcha_value)):
-        if debug: print(f"Invalid Captcha {identifier} - {captcha_value} [Not Alphanumeric]")
-        return False
-    return True
-
-def get_captcha_value_internal(session):
-    captcha = session.get('https://eservices.tn.gov.in/eservicesnew/land/simpleCaptcha.html', verify=False)
-    img = Image.open(BytesIO(captcha.content))
-    # gray = img.convert('L')
-    # bw = gray.point(lambda x: 0 if x < 1 else 255, '1')
-    # img.show()
-    captcha_value = pytesseract.image_to_string(img).strip()
-    return captcha_value
+    response_text = cached_get(session, land_url(AJAX_PAGE), kwargs)
+    return get_xml_values(response_text, 'subdiv/subdivcode')
 
 def get_extract_payload(subdiv_code, captcha_value, **kwargs):
     return {
@@ -153,115 +56,388 @@ def get_extract_payload(subdiv_code, captcha_value, **kwargs):
     }
 
 
-def get_person_details(table):
-    table_array = table_to_2d(table)
-    pdetails = {}
-    for row in table_array:
-        if row[0] and row[0].strip():
-            row = [ r.strip().strip('.') for r in row ]
-            pdetails[int(row[0])] = ' '.join(row[1:])
-    return pdetails
-
-def get_survey_details(table):
-    table_array = table_to_2d(table)
-    # print(f"Survey Table")
-    # for t in table_array: print(f"  {t}")
-    table_array = [ l for l in table_array if any(v is not None for v in l) ]
-    # headers = [ r.strip() for r in table_array[0] ]
-    # headers = [ (h + ' ' + h1.strip()) if h1.strip() else h for h,h1 in zip(headers, table_array[1]) ]
-    # headers = [ (h + ' (' + h2.strip() + ')') if h2.strip() else h for h,h2 in zip(headers, table_array[2]) ]
-    # print(f"Tamil Headers: {headers}")
-
-    ### Note: Nanjai = Wetland, Panjai = Dryland
-    headers = [ "survey no", "subdivision", "dryland spread", "dryland amount", "wetland spread", "wetland amount", "other spread", "other amount", "details"]
-
-    sdetails = {}
-    for row in table_array[2:-1]: ## Remove last row (total)
-        row = [ r.strip() for r in row ]
-        if row[0]:
-            sidx = row[0].strip() if row[1].strip().startswith('-') else row[0].strip() + '/' + row[1].strip()
-            sdetails[sidx] = {}
-            for idx, col in enumerate(row[2:], 2):
-                header_prefix = headers[idx].split()[0]
-                if headers[idx].endswith("spread"):
-                    hectares = float((col.strip().split('-')[0] or '0').strip())
-                    ares = float((col.strip().split('-')[1] or '0').strip())
-                    if hectares or ares:
-                        sdetails[sidx]['land_type'] = header_prefix
-                        sdetails[sidx]['hectares'] = hectares # 2.47 acres
-                        sdetails[sidx]['ares'] = ares
-                        sdetails[sidx]['cents'] = Decimal(str(hectares * 100 + ares)) * Decimal('2.47')
-                elif headers[idx].endswith("amount"):
-                    if sdetails[sidx].get('land_type') == header_prefix:
-                        sdetails[sidx]['amount'] = col.strip()
-                else:
-                    sdetails[sidx][headers[idx]] = col.strip()
-    return sdetails
-
-def extract_patta_details(identifier, html_text):
-    soup = BeautifulSoup(html_text, 'lxml')
-    tbl = soup.find('table')
-    tables_found = 0
-    patta_details = {}
-    if tbl:
-        tds = tbl.find_all('td')
-        for idx, td in enumerate(tds):
-            if td.find('table'):
-                tables_found += 1
-                if (tables_found == 1):
-                    pdetails = get_person_details(td.find('table'))
-                    patta_details['people'] = pdetails
-                elif (tables_found == 2):
-                    sdetails = get_survey_details(td.find('table'))
-                    patta_details['survey'] = sdetails
-            elif td and td.contents:
-                contents = [ re.sub(STRIP_WSPACE_REGEX, ' ', re.sub(STRIP_HTML_REGEX, '', str(sx).strip())) \
-                    for sx in td.contents  if 'பட்டா எண் :' in str(sx) ]
-                if contents:
-                    patta_number = contents[0].split()[-1]
-                    patta_details['patta_number'] = patta_number
-
-        return patta_details
+## Helvetica has no Tamil glyphs, a TTF covering Tamil (e.g. Noto Sans Tamil) can be embedded with --pdf-font
+PDF_FONT_STYLE = '<style>@font-face {{ font-family: patta; src: url("{font_name}"); }} body, td, th, b, font {{ font-family: patta; }}</style>'
+
+def init_pdf_worker():
+    logging.getLogger('xhtml2pdf').setLevel(logging.ERROR) ## One warning per missing glyph otherwise
+
+def create_patta_pdf(html_text, pdf_path, html_hash, base_path=''):
+    ## Runs in the PDF process pool. Written to a temp file first so a partial PDF is never taken as rendered
+    from xhtml2pdf import pisa ## Pulls in reportlab: only imported in the PDF workers
+    tmp_path = f"{pdf_path}.tmp"
+    with open(tmp_path, "w+b") as result_file:
+        # convert HTML to PDF
+        pisa_status = pisa.CreatePDF(
+                html_text,                  # the HTML to convert
+                dest=result_file,           # file handle to recieve result
+                path=base_path,             # relative urls (the font) are resolved against this
+                encoding='utf-8')
+    if pisa_status.err:
+        os.remove(tmp_path)
     else:
-        form = soup.find("form", {"name": "landForm"})
-        if form:
-            error =  soup.find("font", {"class": "normal_text_red"})
-            print(f"  Error: {error.get_text(strip=True)}")
-        else:
-            print(f"  Error: Survey Table Not Found")
-    # By Default.... return None
-    return None
-
-def create_patta_pdf(identifier, html_text):
-    #### NOTE: This does not work!
-    result_file = open("patta.pdf", "w+b")
-
-    # convert HTML to PDF
-    pisa_status = pisa.CreatePDF(
-            html_text,                  # the HTML to convert
-            dest=result_file)           # file handle to recieve result
-
-    # close output file
-    result_file.close()                 # close output file
-    print(f"Survey {identifier}: Creating Patta PDF // {pisa_status}")
-
+        os.replace(tmp_path, pdf_path)
+        Path(f"{pdf_path}.sha256").write_text(html_hash)
     # return False on success and True on errors
     return pisa_status.err
 
-def get_patta_details(session, identifier, subdiv_code, **kwargs):
-    patta_details = select_patta_details(identifier)
+#---------------------------------------------------------------------------------
+# PDF output: one <pdf_dir>/<district>-<taluk>-<village>/patta_<number>.pdf per patta,
+# rendered in a process pool off the fetch path. The SHA-256 of the rendered HTML
+# is kept next to the PDF, so an unchanged patta is never rendered again. A patta
+# answered from SQLite (or covered by another survey line) is rendered from its
+# archived response, so a re-run over a crawled village still exports every PDF.
+#---------------------------------------------------------------------------------
+class PdfRenderer:
+    def __init__(self, pdf_dir='pdf', workers=2, font_path=None):
+        self.pdf_dir = Path(pdf_dir)
+        self.font_style = PDF_FONT_STYLE.format(font_name=Path(font_path).name) if font_path else ''
+        self.base_path = str(Path(font_path).resolve().parent / 'patta.html') if font_path else ''
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_pdf_worker)
+        self.lock = threading.Lock()
+        self.submitted = set() # html hashes rendered / in flight in this run
+        self.rendered = self.cached = self.failed = self.missing = 0
+
+    def get_pdf_path(self, village_key, patta_number):
+        village_dir = self.pdf_dir / village_key.replace('/', '-')
+        village_dir.mkdir(parents=True, exist_ok=True)
+        return village_dir / f"patta_{patta_number}.pdf"
+
+    def submit(self, identifier, village_key, patta_number, html_text):
+        if self.font_style:
+            html_text = self.font_style + html_text
+        html_hash = hashlib.sha256(html_text.encode('utf-8')).hexdigest()
+        pdf_path = self.get_pdf_path(village_key, patta_number)
+        hash_path = Path(f"{pdf_path}.sha256")
+        with self.lock:
+            if html_hash in self.submitted or (hash_path.exists() and hash_path.read_text() == html_hash):
+                self.cached += 1
+                return None
+            self.submitted.add(html_hash)
+        print(f"Survey {identifier}: Creating Patta PDF {pdf_path}")
+        future = self.executor.submit(create_patta_pdf, html_text, str(pdf_path), html_hash, self.base_path)
+        future.add_done_callback(lambda f: self._done(identifier, f))
+        return future
+
+    def submit_stored(self, identifier, village_key, patta_details):
+        ## The response was archived under the survey line it was fetched for, any line of the patta
+        patta_number = patta_details['patta_number']
+        for fetched_identifier in [ identifier, *patta_details['survey'] ]:
+            html_text = tn_archive.archived_response('patta', f"{village_key}|{fetched_identifier}")
+            if html_text:
+                return self.submit(identifier, village_key, patta_number, html_text)
+        with self.lock:
+            self.missing += 1
+        print(f"Survey {identifier}: No archived response for Patta {patta_number}, PDF skipped")
+        return None
+
+    def _done(self, identifier, future):
+        failed = future.exception() is not None or future.result()
+        with self.lock:
+            if failed: self.failed += 1
+            else: self.rendered += 1
+        if failed:
+            print(f"Survey {identifier}: Patta PDF failed // {future.exception() or 'pisa error'}")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        print(f"Patta PDFs: {self.rendered} rendered, {self.cached} unchanged, {self.failed} failed, {self.missing} without an archived response // {self.pdf_dir}")
+
+def post_extract(session, identifier, subdiv_code, captcha_stage=None, **kwargs):
+    ## One captcha + extract POST: (session, captcha value, response, patta details, response class)
+    if captcha_stage:
+        ## Captcha was solved ahead of time on one of the stage's sessions
+        with captcha_stage.checkout(identifier) as (stage_session, captcha_value):
+            return post_extract_internal(stage_session, identifier, subdiv_code, captcha_value, **kwargs)
+    captcha_value = get_captcha_value(session, identifier)
+    return post_extract_internal(session, identifier, subdiv_code, captcha_value, **kwargs)
+
+def post_extract_internal(session, identifier, subdiv_code, captcha_value, **kwargs):
+    payload = get_extract_payload(subdiv_code, captcha_value, **kwargs)
+    # print(f'Captcha Text = [{captcha_value}] // Payload = {payload}')
+    with stage_timings.time('extract_post'):
+        final_response = session.post(land_url(PATTA_EXTRACT_PAGE), data=payload)
+    print(f'Survey {identifier}: Response Status = {final_response.status_code}')
+    with stage_timings.time('parse'):
+        patta_details = extract_patta_details(identifier, final_response.text)
+        response_class = classify_response(final_response.status_code, final_response.text, patta_details)
+    if response_class == SESSION_EXPIRED:
+        ## Before the session goes back to the captcha stage
+        tn_http.prime_session(session, land_url(PATTA_CHECK_PAGE))
+    return session, captcha_value, final_response, patta_details, response_class
+
+def get_village_key(**kwargs):
+    return f"{kwargs['districtCode']}/{kwargs['talukCode']}/{kwargs['villageCode']}"
+
+def get_patta_details(session, identifier, subdiv_code, captcha_stage=None, pdf=None, **kwargs):
+    with stage_timings.time('record'):
+        return get_patta_details_internal(session, identifier, subdiv_code, captcha_stage=captcha_stage, pdf=pdf, **kwargs)
+
+def get_patta_details_internal(session, identifier, subdiv_code, captcha_stage=None, pdf=None, **kwargs):
+    ## pdf: PdfRenderer for the fetched pattas (None = no PDF)
+    village_key = get_village_key(**kwargs)
+    with stage_timings.time('store_lookup'):
+        patta_details = select_patta_details(identifier, village_key)
+        not_found = not patta_details and patta_store.is_not_found(identifier, village_key)
     if patta_details:
         print(f'Survey {identifier}: Found in Sqlite')
+        if pdf:
+            pdf.submit_stored(identifier, village_key, patta_details)
+    elif not_found:
+        print(f'Survey {identifier}: Not Found (recorded earlier)')
     else:
-        captcha_value = get_captcha_value(session, identifier)
-        payload = get_extract_payload(subdiv_code, captcha_value, **kwargs)
-        # print(f'Captcha Text = [{captcha_value}] // Payload = {payload}')
-        final_response = session.post(PATTA_EXTRACT_URL, data=payload, verify=False)
-        print(f'Survey {identifier}: Response Status = {final_response.status_code}')
-        patta_details = extract_patta_details(identifier, final_response.text)
-        if patta_details: insert_patta_details(patta_details)
+        patta_details, response_text, response_class = fetch_patta_details(session, identifier, subdiv_code, captcha_stage=captcha_stage, **kwargs)
+        if response_class == NOT_FOUND:
+            with stage_timings.time('store'):
+                patta_store.mark_not_found(identifier, village_key)
+        if patta_details:
+            with stage_timings.time('store'):
+                insert_patta_details(patta_details, village_key)
+                tn_archive.archive_response('patta', f"{village_key}|{identifier}", { 'village_code': village_key, 'identifier': identifier }, response_text)
+            if pdf:
+                pdf.submit(identifier, village_key, patta_details['patta_number'], response_text)
     return patta_details
 
+def fetch_patta_details(session, identifier, subdiv_code, captcha_stage=None, **kwargs):
+    ## Captcha + extract + parse (retried per response class), without the SQLite lookup:
+    ## (patta details or None, response text, response class)
+    attempt = lambda: post_extract(session, identifier, subdiv_code, captcha_stage=captcha_stage, **kwargs)
+    patta_details, final_response, response_class = tn_captcha.extract_with_retries(attempt, identifier)
+    return patta_details, final_response.text, response_class
+
+def get_village_codes(session, district_name, taluk_name, village_name):
+    kwargs = { 'page': 'ruralservice', 'ser': 'dist'}
+    district_code = get_code(session, district_name, **kwargs)
+    kwargs['ser'] = 'tlk'; kwargs['distcode'] = district_code
+    taluk_code = get_code(session, taluk_name, **kwargs)
+    kwargs['ser'] = 'vill'; kwargs['talukcode'] = taluk_code
+    village_code = get_code(session, village_name, **kwargs)
+    return district_code, taluk_code, village_code
+
+def get_survey_kwargs(village_codes, survey_no):
+    district_code, taluk_code, village_code = village_codes
+    return { 'page': 'getSubdivNo', 'districtCode': district_code, 'talukCode': taluk_code, 'villageCode': village_code, 'surveyno': survey_no}
+
+#---------------------------------------------------------------------------------
+# Coverage planner: one chitta extract returns every survey line of the patta, so
+# the subdivisions (of this or any other survey number of the village) that are
+# already on a fetched patta are served from memory instead of another captcha +
+# extract round trip.
+#---------------------------------------------------------------------------------
+SUBDIV_FAMILY_REGEX = re.compile(r'^(\d*[A-Z]*)')
+
+def natural_key(value):
+    return [ (0, int(p), '') if p.isdigit() else (1, 0, p) for p in re.findall(r'\d+|\D+', value) ]
+
+class CoveragePlanner:
+    def __init__(self, store=None):
+        self.store = store
+        self.covered = {} # (village_key, survey identifier) => patta number
+        self.pattas = {}  # (village_key, patta number) => patta details fetched in this run
+        self.seeded = set()
+        self.fetched = self.skipped = 0
+
+    def seed(self, village_key):
+        ## Survey lines already in SQLite from earlier runs
+        if self.store and village_key not in self.seeded:
+            self.seeded.add(village_key)
+            for identifier, patta_number in self.store.select_survey_pattas(village_key).items():
+                self.covered.setdefault((village_key, identifier), patta_number)
+
+    def add(self, village_key, patta_details):
+        self.fetched += 1
+        self.pattas[(village_key, patta_details['patta_number'])] = patta_details
+        for identifier in patta_details['survey']:
+            self.covered[(village_key, identifier)] = patta_details['patta_number']
+
+    def lookup(self, village_key, identifier):
+        patta_number = self.covered.get((village_key, identifier))
+        if patta_number is None:
+            return None
+        patta_details = self.pattas.get((village_key, patta_number))
+        if patta_details is None and self.store:
+            patta_details = self.store.select_patta_details(identifier, village_key)
+        if patta_details:
+            self.skipped += 1
+        return patta_details
+
+    @staticmethod
+    def order(sdiv_nos):
+        ## Splits of one subdivision (1A1, 1A2 ...) often stay on one patta: take one of each
+        ## family first, the siblings are then mostly covered by the time their turn comes
+        families = {}
+        for sdiv in sorted(sdiv_nos, key=natural_key):
+            families.setdefault(SUBDIV_FAMILY_REGEX.match(sdiv).group(1), []).append(sdiv)
+        ordered = []
+        for rank in range(max((len(f) for f in families.values()), default=0)):
+            ordered += [ f[rank] for f in families.values() if rank < len(f) ]
+        return ordered
+
+    def summary(self):
+        print(f"Coverage Planner: {self.fetched} patta(s) fetched // {self.skipped} subdivision(s) covered by an earlier patta")
+
+def get_survey_pattas(session, kwargs, sub_division=None, captcha_stage=None, pdf=None, planner=None):
+    sdiv_nos = get_subdivision_numbers(session, **kwargs)
+    print(f"Subdivision Codes for {kwargs['surveyno']} is {len(sdiv_nos)} // {sdiv_nos}")
+    if sub_division:
+        sdiv_nos = list(set(sub_division).intersection(set(sdiv_nos)))
+    village_key = get_village_key(**kwargs)
+    if planner:
+        planner.seed(village_key)
+        sdiv_nos = planner.order(sdiv_nos)
+    for sdiv in sdiv_nos:
+        identifier = get_survey_identifier(kwargs['surveyno'], sdiv)
+        patta_details = planner.lookup(village_key, identifier) if planner else None
+        if patta_details:
+            print(f"Survey {identifier}: Covered by Patta {patta_details['patta_number']}")
+            if pdf:
+                pdf.submit_stored(identifier, village_key, patta_details)
+        else:
+            patta_details = get_patta_details(session, identifier, sdiv, captcha_stage=captcha_stage, pdf=pdf, **kwargs)
+            if planner and patta_details: planner.add(village_key, patta_details)
+        yield identifier, patta_details
+
+def get_survey_identifier(survey_no, sdiv):
+    return f"{survey_no}/{sdiv}" if sdiv != '0' else f"{survey_no}"
+
+#---------------------------------------------------------------------------------
+# Cache-first: a survey whose codes + subdivisions are in the lookup cache and
+# whose pattas are all in SQLite is answered without a session, i.e. without any
+# request to the eservices site. The OCR / PDF dependencies are never imported.
+#---------------------------------------------------------------------------------
+def get_cached_survey_pattas(district_name, taluk_name, village_name, survey_no, sub_division=None):
+    ## [(identifier, patta details or None when recorded as not found)], None when anything is missing
+    try:
+        village_codes = get_village_codes(None, district_name, taluk_name, village_name)
+        if not all(village_codes):
+            return None
+        kwargs = get_survey_kwargs(village_codes, survey_no)
+        sdiv_nos = get_subdivision_numbers(None, **kwargs)
+    except CacheMiss:
+        return None
+    if sub_division:
+        sdiv_nos = [ sdiv for sdiv in sdiv_nos if sdiv in sub_division ]
+    village_key = get_village_key(**kwargs)
+    pattas = []
+    for sdiv in sorted(sdiv_nos, key=natural_key):
+        identifier = get_survey_identifier(survey_no, sdiv)
+        patta_details = select_patta_details(identifier, village_key)
+        if not patta_details and not patta_store.is_not_found(identifier, village_key):
+            return None
+        pattas.append((identifier, patta_details))
+    return pattas
+
+#---------------------------------------------------------------------------------
+# Batch mode: CSV / JSONL manifest of district, taluk, village, survey[, sdiv]
+# rows, one JSON line per patta on the output as soon as it is fetched.
+#---------------------------------------------------------------------------------
+def read_manifest(manifest_path):
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        if manifest_path.endswith('.jsonl') or manifest_path.endswith('.json'):
+            rows = ( json.loads(line) for line in f if line.strip() )
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            sdiv = row.get('sdiv') or None
+            if isinstance(sdiv, str): ## Several subdivisions separated by ';' or spaces
+                sdiv = sdiv.replace(';', ' ').split()
+            yield {
+                'district': row['district'], 'taluk': row['taluk'], 'village': row['village'],
+                'survey': str(row['survey']).strip(), 'sdiv': [ str(x) for x in sdiv ] if sdiv else None
+            }
+
+def get_patta_json(row, village_codes, identifier, patta_details):
+    return json.dumps({
+        'district': row['district'], 'taluk': row['taluk'], 'village': row['village'],
+        'village_code': '/'.join(village_codes), 'survey_no': row['survey'], 'identifier': identifier,
+        'patta_number': patta_details['patta_number'], 'people': patta_details['people'], 'survey': patta_details['survey'],
+    }, ensure_ascii=False, default=str)
+
+def run_batch(session, manifest_path, output, captcha_stage=None, pdf=None, planner=None):
+    all_village_codes = {}
+    emitted = set() ## A patta covers several surveys / subdivisions, write it only once
+    for row in read_manifest(manifest_path):
+        village = (row['district'], row['taluk'], row['village'])
+        if village not in all_village_codes:
+            all_village_codes[village] = get_village_codes(session, *village)
+        village_codes = all_village_codes[village]
+        if not all(village_codes):
+            print(f"Unknown Village {village} // {village_codes}")
+            continue
+        kwargs = get_survey_kwargs(village_codes, row['survey'])
+        for identifier, patta_details in get_survey_pattas(session, kwargs, row['sdiv'], captcha_stage=captcha_stage, pdf=pdf, planner=planner):
+            if not patta_details:
+                print(f"Survey {identifier}: Patta Not Found")
+                continue
+            patta_key = (village_codes, patta_details['patta_number'])
+            if patta_key not in emitted:
+                emitted.add(patta_key)
+                output.write(get_patta_json(row, village_codes, identifier, patta_details) + '\n')
+                output.flush()
+    return len(emitted)
+
+#---------------------------------------------------------------------------------
+# Refresh mode: re-fetch the stored pattas, stalest first, within a time and / or
+# request budget. A patta is fetched through one of its survey lines, only the
+# pattas whose content hash changed are rewritten and every change is written as
+# a JSON line on the output.
+#---------------------------------------------------------------------------------
+def is_village_key(village_key):
+    ## '<district>/<taluk>/<village>' codes: rows migrated from before village_code have ''
+    parts = village_key.split('/')
+    return len(parts) == 3 and all(parts)
+
+def get_refresh_kwargs(village_key, survey_identifier):
+    survey_no, _, sdiv = survey_identifier.partition('/')
+    return get_survey_kwargs(tuple(village_key.split('/')), survey_no), sdiv or '0'
+
+def refresh_pattas(session, output, max_age=0, time_budget=None, max_requests=None, captcha_stage=None, pdf=None):
+    start = time.monotonic()
+    counts = Counter()
+    fetched_before = time.time() - max_age
+    after = None
+    while True:
+        rows = patta_store.select_stale_pattas(fetched_before, after)
+        if not rows:
+            break
+        for row in rows:
+            if max_requests and counts['requests'] >= max_requests: return counts
+            if time_budget and time.monotonic() - start >= time_budget: return counts
+            after = (row['fetched_at'], row['village_code'], row['patta_number'])
+            if not row['survey_identifier']:
+                continue ## Every survey line moved to other pattas
+            village_key, identifier = row['village_code'], row['survey_identifier']
+            if not is_village_key(village_key):
+                counts['no_village'] += 1 ## No codes to fetch it with, only a crawl of its village replaces it
+                continue
+            kwargs, sdiv = get_refresh_kwargs(village_key, identifier)
+            counts['requests'] += 1
+            with stage_timings.time('record'):
+                patta_details, response_text, response_class = fetch_patta_details(session, identifier, sdiv, captcha_stage=captcha_stage, **kwargs)
+                if not patta_details:
+                    counts['failed'] += 1
+                    continue
+                with stage_timings.time('store'):
+                    status, changes = patta_store.refresh_patta_details(patta_details, village_key)
+                    tn_archive.archive_response('patta', f"{village_key}|{identifier}", { 'village_code': village_key, 'identifier': identifier }, response_text)
+            counts[status] += 1
+            if str(patta_details['patta_number']) != str(row['patta_number']):
+                counts['moved'] += 1 ## Survey line now on another patta, the old one is picked again by its other lines
+            print(f"Survey {identifier}: Patta {row['patta_number']} => {patta_details['patta_number']} {status}")
+            if status == 'unchanged':
+                continue
+            if pdf:
+                pdf.submit(identifier, village_key, patta_details['patta_number'], response_text)
+            output.write(json.dumps({
+                'village_code': village_key, 'identifier': identifier, 'status': status,
+                'old_patta_number': row['patta_number'], 'patta_number': patta_details['patta_number'],
+                'last_fetched_at': row['fetched_at'], 'changes': changes,
+            }, ensure_ascii=False) + '\n')
+            output.flush()
+    return counts
+
+def new_session():
+    return tn_http.new_session(land_url(PATTA_CHECK_PAGE))
 
 def print_patta_details(patta_details):
     print(f"  Patta Number: {patta_details['patta_number']}")
@@ -270,68 +446,18 @@ def print_patta_details(patta_details):
     print(f"  Survey Details:")
     for k, s in patta_details['survey'].items(): print(f"    {k}: {s}")
 
-def initialize_sqlite_db():
-    with closing(sqlite3.connect('patta.db', detect_types=sqlite3.PARSE_DECLTYPES)) as conn:
-        with closing(conn.cursor()) as cursor:
-            result = cursor.execute('''
-              CREATE TABLE IF NOT EXISTS patta_survey_details
-              (
-                survey_identifier  TEXT PRIMARY KEY  NOT NULL,
-                patta_number       INT NOT NULL,
-                land_type          VARCHAR(10)       NOT NULL,
-                hectares           DECIMAL(10,2)     NOT NULL,
-                ares               DECIMAL(10,2)     NOT NULL,
-                cents              DECIMAL(10,2)     NOT NULL,
-                amount             DECIMAL(10,2)     NOT NULL,
-                details            VARCHAR(256),
-                people             TEXT
-              );
-            ''')
-            conn.commit()
-            # print(f"Created Table: patta_survey_details {result}")
-
-def select_patta_details(survey_identifier):
-    def dict_factory(cursor, row):
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            d[col[0]] = row[idx]
-        return d
-    with closing(sqlite3.connect('patta.db')) as conn:
-        conn.row_factory = dict_factory
-        with closing(conn.cursor()) as cursor:
-            cursor.execute("""
-                SELECT * from patta_survey_details
-                WHERE patta_number in (SELECT patta_number from patta_survey_details WHERE survey_identifier = ?)
-            """, (survey_identifier,))
-            rows = cursor.fetchall()
-            patta_details = { 'survey': {} }
-            for row in rows:
-                row_sidx = row['survey_identifier']
-                patta_details['patta_number'] = row['patta_number'] # Should be same for all rows!
-                patta_details['survey'][row_sidx] = { k: v for k,v in row.items() if k not in {'survey_identifier', 'patta_number' } }
-                patta_details['people'] = json.loads(row['people']) # Should be same for all rows!
-            return patta_details if len(patta_details['survey']) else None
-    return None
-
-def insert_patta_details(patta_details):
-    data = []
-    for sidx, s in patta_details['survey'].items():
-        sdetails = {
-            'patta_number': patta_details['patta_number'],
-            'survey_identifier': sidx,
-        }
-        sdetails.update(s)
-        sdetails['cents'] = str(sdetails['cents'])
-        sdetails['people'] = json.dumps(patta_details['people'])
-        data.append(sdetails)
-    # print(f"Patta Data = {data}")
-    with closing(sqlite3.connect('patta.db')) as conn:
-        with closing(conn.cursor()) as cursor:
-            cursor.executemany("""
-                INSERT INTO patta_survey_details VALUES(:survey_identifier, :patta_number, :land_type,
-                    :hectares, :ares, :cents, :amount, :details, :people
-                )""", data)
-            conn.commit()
+patta_store = None
+
+def initialize_sqlite_db(db_path=PATTA_DB):
+    global patta_store
+    patta_store = PattaStore(db_path)
+    return patta_store
+
+def select_patta_details(survey_identifier, village_key=''):
+    return patta_store.select_patta_details(survey_identifier, village_key)
+
+def insert_patta_details(patta_details, village_key=''):
+    patta_store.upsert_patta_details([patta_details], village_key)
 
 def parse_commandline_params():
     def list_str(values):  ### Type in argparse to convert string to list!
@@ -344,9 +470,27 @@ def parse_commandline_params():
     parser.add_argument("-d", "--district", action='store', dest='district_name', default='Tirunelveli', help="Name of the District")
     parser.add_argument("-t", "--taluk", action='store', dest='taluk_name', default='Palayamkottai', help="Name of the Taluk")
     parser.add_argument("-v", "--village", action='store', dest='village_name', default='Tharuvai', help="Name of the Village")
-    parser.add_argument("-s", "--survey", required=True, action='store', dest='survey_no', help="Survey Number")
+    parser.add_argument("-s", "--survey", action='store', dest='survey_no', help="Survey Number")
     parser.add_argument("--sdiv", dest='sub_division', type=list_str, help="Comma Separated Subdivision Numbers")
+    parser.add_argument("-m", "--manifest", dest='manifest', help="Batch mode: CSV / JSONL file with district, taluk, village, survey[, sdiv] rows")
+    parser.add_argument("-o", "--output", dest='output_path', default='-', help="Batch / refresh mode: JSONL output file (default stdout)")
+    parser.add_argument("--refresh", action='store_true', dest='refresh', default=False, help="Refresh mode: re-fetch the stored pattas, stalest first, and report the changed")
+    parser.add_argument("--refresh-age", dest='refresh_age', type=float, default=7, help="Refresh mode: days since the last fetch before a patta is due")
+    parser.add_argument("--refresh-budget", dest='refresh_budget', type=float, help="Refresh mode: stop after this many minutes")
+    parser.add_argument("--refresh-requests", dest='refresh_requests', type=int, help="Refresh mode: stop after this many extract requests")
     parser.add_argument("--pdf", action='store_true', dest='create_pdf', default=False, help="Create a PDF of the Patta")
+    parser.add_argument("--pdf-dir", dest='pdf_dir', default='pdf', help="Directory for the Patta PDFs")
+    parser.add_argument("--pdf-workers", dest='pdf_workers', type=int, default=2, help="Processes rendering the PDFs")
+    parser.add_argument("--pdf-font", dest='pdf_font', help="TTF font with Tamil glyphs to embed in the PDFs")
+    parser.add_argument("--ocr-workers", dest='ocr_workers', type=int, default=0, help="Prefetch captchas with this many OCR processes (0 = inline)")
+    parser.add_argument("--captcha-model", dest='captcha_model', help="Classifier model (see tn_classifier.py) tried before tesseract")
+    parser.add_argument("--no-fetch", action='store_false', dest='fetch', default=True, help="Only answer from the lookup cache + patta.db, never fetch from eservices")
+    parser.add_argument("--warm", action='store_true', dest='warm_cache', default=False, help="Only resolve and cache the codes / subdivisions, do not fetch pattas")
+    parser.add_argument("--cache-ttl", dest='cache_ttl', type=float, default=30, help="Days before a cached lookup is fetched again (0 = no cache)")
+    parser.add_argument("--captcha-corpus", dest='captcha_corpus', help="Save accepted captchas to this directory for training")
+    tn_http.add_transport_arguments(parser)
+    tn_archive.add_archive_arguments(parser)
+    tn_metrics.add_profile_arguments(parser)
     return parser.parse_args()
 
 #---------------------------------------------------------------------------------
@@ -354,27 +498,75 @@ def parse_commandline_params():
 #---------------------------------------------------------------------------------
 if __name__ == "__main__":
     args = parse_commandline_params()
-    print(f"Args = {args}")
-    if not args.district_name:
-        print('District Name is Mandatory')
+    if not args.survey_no and not args.manifest and not args.refresh:
+        print('Survey Number (or a --manifest / --refresh) is Mandatory')
         exit(-1)
-    initialize_sqlite_db()
-    with requests.session() as s:
-        s.headers.update({'referer': 'https://eservices.tn.gov.in/'})
-        kwargs = { 'page': 'ruralservice', 'ser': 'dist'}
-        district_code = get_code(s, args.district_name, **kwargs)
-        kwargs['ser'] = 'tlk'; kwargs['distcode'] = district_code
-        taluk_code = get_code(s, args.taluk_name, **kwargs)
-        kwargs['ser'] = 'vill'; kwargs['talukcode'] = taluk_code
-        village_code = get_code(s, args.village_name, **kwargs)
-        print(f"Village Code = {args} // {district_code} // {taluk_code} // {village_code}")
-        kwargs = { 'page': 'getSubdivNo', 'districtCode': district_code, 'talukCode': taluk_code, 'villageCode': village_code, 'surveyno': args.survey_no}
-        sdiv_nos = get_subdivision_numbers(s, **kwargs)
-        print(f"Subdivision Codes for {args.survey_no} is {len(sdiv_nos)} // {sdiv_nos}")
-        if args.sub_division:
-            sdiv_nos = list(set(args.sub_division).intersection(set(sdiv_nos)))
-        for sdiv in sdiv_nos:
-            identifier = f"{kwargs['surveyno']}/{sdiv}" if sdiv != '0' else f"{kwargs['surveyno']}"
-            patta_details = get_patta_details(s, identifier, sdiv, pdf=args.create_pdf, **kwargs)
-            print_patta_details(patta_details)
-        print("All Completed!")
+    json_lines = args.manifest or args.refresh
+    output = sys.stdout
+    if json_lines and args.output_path != '-':
+        output = open(args.output_path, 'w', encoding='utf-8')
+    ## In batch / refresh mode stdout is reserved for the JSON lines, progress goes to stderr
+    with contextlib.redirect_stdout(sys.stderr) if json_lines else contextlib.nullcontext():
+        print(f"Args = {args}")
+        if not args.district_name:
+            print('District Name is Mandatory')
+            exit(-1)
+        initialize_sqlite_db()
+        tn_http.configure_from_args(args)
+        tn_captcha.set_captcha_model(args.captcha_model)
+        tn_captcha.set_captcha_corpus(args.captcha_corpus)
+        tn_archive.configure_from_args(args)
+        if args.cache_ttl > 0:
+            tn_cache.set_lookup_cache(LookupCache(ttl=args.cache_ttl * 24 * 3600))
+        if args.survey_no and not (args.manifest or args.refresh or args.warm_cache or args.create_pdf):
+            cached_pattas = get_cached_survey_pattas(args.district_name, args.taluk_name, args.village_name, args.survey_no, args.sub_division)
+            if cached_pattas is not None or not args.fetch:
+                for identifier, patta_details in cached_pattas or []:
+                    print(f"Survey {identifier}: {'Found in Sqlite' if patta_details else 'Not Found (recorded earlier)'}")
+                    if patta_details: print_patta_details(patta_details)
+                if tn_cache.lookup_cache: tn_cache.lookup_cache.close()
+                patta_store.close()
+                if cached_pattas is None:
+                    print(f"Survey {args.survey_no}: Not in the lookup cache / patta.db (--no-fetch)")
+                    exit(1)
+                print("All Completed! (from the cache)")
+                exit(0)
+        with tn_http.new_session() as s:
+            captcha_stage = None
+            planner = CoveragePlanner(patta_store)
+            pdf_renderer = PdfRenderer(args.pdf_dir, args.pdf_workers, args.pdf_font) if args.create_pdf and not args.warm_cache else None
+            if args.ocr_workers > 0 and not args.warm_cache:
+                captcha_stage = CaptchaStage([ new_session() for _ in range(2) ], ocr_workers=args.ocr_workers)
+            try:
+                if args.refresh:
+                    counts = refresh_pattas(s, output, max_age=args.refresh_age * 24 * 3600,
+                        time_budget=args.refresh_budget * 60 if args.refresh_budget else None,
+                        max_requests=args.refresh_requests, captcha_stage=captcha_stage, pdf=pdf_renderer)
+                    print(f"Refresh: {counts['requests']} request(s) // {counts['changed']} changed, {counts['new']} new, "
+                        f"{counts['unchanged']} unchanged, {counts['failed']} failed, {counts['moved']} moved survey line(s), "
+                        f"{counts['no_village']} skipped without a village code")
+                elif args.manifest:
+                    num_pattas = run_batch(s, args.manifest, output, captcha_stage=captcha_stage, pdf=pdf_renderer, planner=planner)
+                    print(f"Batch {args.manifest}: {num_pattas} patta(s) written to {args.output_path}")
+                else:
+                    village_codes = get_village_codes(s, args.district_name, args.taluk_name, args.village_name)
+                    print(f"Village Code = {args} // {' // '.join(str(c) for c in village_codes)}")
+                    kwargs = get_survey_kwargs(village_codes, args.survey_no)
+                    if args.warm_cache:
+                        sdiv_nos = get_subdivision_numbers(s, **kwargs)
+                        print(f"Subdivision Codes for {args.survey_no} is {len(sdiv_nos)} // {sdiv_nos}")
+                    else:
+                        for identifier, patta_details in get_survey_pattas(s, kwargs, args.sub_division, captcha_stage=captcha_stage, pdf=pdf_renderer, planner=planner):
+                            if patta_details: print_patta_details(patta_details)
+            finally:
+                if captcha_stage: captcha_stage.close()
+                if pdf_renderer: pdf_renderer.close()
+            tn_captcha.captcha_metrics.summary("Captcha Metrics")
+            planner.summary()
+            if tn_http.rate_controller: tn_http.rate_controller.summary()
+            tn_metrics.report_profile(args)
+            if tn_cache.lookup_cache: tn_cache.lookup_cache.close()
+            patta_store.close()
+            if tn_archive.response_archive: tn_archive.response_archive.close()
+            if output is not sys.stdout: output.close()
+            print("All Completed!")
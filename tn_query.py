@@ -0,0 +1,52 @@
+import sys
+import json
+import time
+import argparse
+from tn_store import PattaStore, PATTA_DB
+
+#---------------------------------------------------------------------------------
+# Query the patta database: owner name (prefix of every word), patta number,
+# village or '<district>/<taluk>' prefix, land type and area range in cents.
+#
+#   python tn_query.py -n "ராமன் கிருஷ்" -v 29/02
+#   python tn_query.py --land-type wetland --min-cents 100 --json
+#---------------------------------------------------------------------------------
+def print_patta(patta):
+    print(f"{patta['village_code']} // Patta {patta['patta_number']}")
+    for idx, name in patta['people'].items(): print(f"    {idx}: {name}")
+    for sidx, s in patta['survey'].items():
+        print(f"    {sidx}: {s['land_type']} {s['cents']} cents // {s['details'] or ''}")
+
+def parse_commandline_params():
+    parser = argparse.ArgumentParser(
+        prog='Query Patta',
+        description='Search the pattas by owner name, patta number, village, land type and area'
+    )
+    parser.add_argument("--db", dest='db_path', default=PATTA_DB, help="SQLite database with the patta details")
+    parser.add_argument("-n", "--name", dest='name', help="Owner name (every word is matched as a prefix)")
+    parser.add_argument("-p", "--patta", dest='patta_number', type=int, help="Patta Number")
+    parser.add_argument("-v", "--village", dest='village_code', help="Village code <district>/<taluk>/<village> (or a district / taluk prefix)")
+    parser.add_argument("--land-type", dest='land_type', help="Land type of a survey line (wetland / dryland / other)")
+    parser.add_argument("--min-cents", dest='min_cents', type=float, help="Smallest area of a survey line in cents")
+    parser.add_argument("--max-cents", dest='max_cents', type=float, help="Largest area of a survey line in cents")
+    parser.add_argument("--limit", dest='limit', type=int, default=100, help="Maximum number of pattas")
+    parser.add_argument("--json", action='store_true', dest='json', default=False, help="One JSON line per patta")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    store = PattaStore(args.db_path)
+    start = time.perf_counter()
+    pattas = store.query_pattas(name=args.name, patta_number=args.patta_number, village_code=args.village_code,
+        land_type=args.land_type, min_cents=args.min_cents, max_cents=args.max_cents, limit=args.limit)
+    elapsed = time.perf_counter() - start
+    for patta in pattas:
+        if args.json:
+            print(json.dumps(patta, ensure_ascii=False, default=str))
+        else:
+            print_patta(patta)
+    print(f"{len(pattas)} patta(s) in {elapsed * 1000:.1f}ms", file=sys.stderr)
+    store.close()
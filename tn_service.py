@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+import urllib.parse
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import tn_http
+import tn_cache
+import tn_captcha
+import tn_archive
+import tn_patta
+from tn_cache import LookupCache
+from tn_store import PATTA_DB
+
+#---------------------------------------------------------------------------------
+# Local patta lookup service: a long-running HTTP/JSON front for patta.db, so a
+# lookup costs a round trip instead of an interpreter start + imports + the
+# ajax.html code lookups.
+#
+#   GET /patta?village_code=29/02/003&survey=12&sdiv=3A
+#   GET /patta?district=Tirunelveli&taluk=Palayamkottai&village=Tharuvai&survey=12&sdiv=3A
+#   GET /stats
+#
+# Answers (the encoded JSON) are kept in an in-process LRU for --answer-ttl
+# seconds, so a patta updated by a refresh run (or fetched since a 404) is served
+# fresh again after that. A miss is read from
+# SQLite on the request thread or, if the patta was never fetched, loaded from the
+# eservices site by the --fetchers loader threads. Concurrent fetches for the same
+# key share one load (single flight), so they cost one captcha + extract round
+# trip. The eservices sessions are only used by the loader threads.
+#
+#   python tn_service.py --port 8081 --fetchers 2
+#---------------------------------------------------------------------------------
+JSON_CONTENT_TYPE = 'application/json;charset=UTF-8'
+
+class LruCache:
+    def __init__(self, maxsize=10_000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key => (value, expires at)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+class SingleFlight:
+    ## Concurrent calls for one key wait on the same future instead of loading again
+    def __init__(self, executor):
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def do(self, key, func, *args):
+        with self.lock:
+            future = self.in_flight.get(key)
+            shared = future is not None
+            if not shared:
+                future = self.in_flight[key] = self.executor.submit(self._run, key, func, *args)
+        return future.result(), shared
+
+    def _run(self, key, func, *args):
+        ## Popped by the loader itself: a done callback added under the lock runs at once in
+        ## the caller when the load already finished, and would take the lock again
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+class PattaLookup:
+    def __init__(self, cache_size=10_000, fetchers=2, fetch=True, ttl=300):
+        self.fetch = fetch
+        self.cache = LruCache(cache_size, ttl)
+        self.village_codes = {} # (district, taluk, village) names => codes
+        self.executor = ThreadPoolExecutor(max_workers=fetchers, thread_name_prefix='loader')
+        self.single_flight = SingleFlight(self.executor)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.stats = Counter()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_session(self):
+        ## One eservices session (cookies + captcha) per loader thread
+        s = getattr(self.local, 'session', None)
+        if s is None:
+            s = self.local.session = tn_patta.new_session()
+            with self.lock:
+                self.sessions.append(s)
+        return s
+
+    def resolve_village(self, district, taluk, village):
+        names = (district, taluk, village)
+        codes = self.village_codes.get(names)
+        if codes is None:
+            codes, _ = self.single_flight.do(('village',) + names, lambda: tn_patta.get_village_codes(self.get_session(), *names))
+            if all(codes):
+                self.village_codes[names] = codes
+        return codes
+
+    def load_stored(self, key):
+        ## (status, body) from patta.db, on the request thread: None when the patta has to be fetched
+        village_key, identifier = key
+        patta_details = tn_patta.select_patta_details(identifier, village_key)
+        if patta_details:
+            result = (200, encode({ 'village_code': village_key, 'identifier': identifier, **patta_details }))
+        elif not self.fetch or tn_patta.patta_store.is_not_found(identifier, village_key):
+            result = (404, encode({ 'village_code': village_key, 'identifier': identifier, 'error': 'not_found' }))
+        else:
+            return None
+        self.cache.put(key, result)
+        return result
+
+    def load(self, key, village_codes, survey_no, sdiv):
+        ## (status, body) of an eservices fetch, cached unless the fetch failed
+        village_key, identifier = key
+        kwargs = tn_patta.get_survey_kwargs(village_codes, survey_no)
+        patta_details = tn_patta.get_patta_details(self.get_session(), identifier, sdiv, **kwargs)
+        self.count('loads')
+        ## Per identifier captcha counters would grow with every patta ever looked up
+        captcha_counts = tn_captcha.captcha_metrics.pop(identifier)
+        with self.lock:
+            self.stats.update({ f"captcha_{name}": count for name, count in captcha_counts.items() })
+        if patta_details:
+            result = (200, encode({ 'village_code': village_key, 'identifier': identifier, **patta_details }))
+        elif tn_patta.patta_store.is_not_found(identifier, village_key):
+            result = (404, encode({ 'village_code': village_key, 'identifier': identifier, 'error': 'not_found' }))
+        else:
+            ## Captcha / server failures: not cached, the next lookup tries again
+            self.count('failed')
+            return (503, encode({ 'village_code': village_key, 'identifier': identifier, 'error': 'fetch_failed' }))
+        self.cache.put(key, result)
+        return result
+
+    def lookup(self, village_codes, survey_no, sdiv='0'):
+        identifier = f"{survey_no}/{sdiv}" if sdiv and sdiv != '0' else f"{survey_no}"
+        key = ('/'.join(village_codes), identifier)
+        result = self.cache.get(key)
+        if result is not None:
+            self.count('hits')
+            return result
+        self.count('misses')
+        ## SQLite reads never wait behind the loaders' captcha round trips
+        result = self.load_stored(key)
+        if result is not None:
+            self.count('stored')
+            return result
+        result, shared = self.single_flight.do(key, self.load, key, village_codes, survey_no, sdiv)
+        if shared: self.count('shared')
+        return result
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats, cached=len(self.cache), villages=len(self.village_codes))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for s in self.sessions: s.close()
+
+def encode(value):
+    return json.dumps(value, ensure_ascii=False, default=str).encode('utf-8')
+
+class LookupServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, lookup):
+        super().__init__(address, LookupHandler)
+        self.lookup = lookup
+
+class LookupHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' ## Keep-alive: clients reuse the connection
+    ## Headers + body in one buffered write (flushed per request) and no Nagle delay on it
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def finish(self):
+        super().finish()
+        ## The thread of this client connection ends with it, so does its patta.db connection
+        if tn_patta.patta_store: tn_patta.patta_store.release()
+
+    def send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', JSON_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        lookup = self.server.lookup
+        if url.path == '/stats':
+            return self.send(200, encode(lookup.summary()))
+        if url.path == '/health':
+            return self.send(200, b'{"status": "ok"}')
+        if url.path != '/patta':
+            return self.send(404, encode({ 'error': f"Unknown path {url.path}" }))
+        if not params.get('survey'):
+            return self.send(400, encode({ 'error': 'survey is mandatory' }))
+        try:
+            if params.get('village_code'):
+                village_codes = tuple(params['village_code'].split('/'))
+            elif not all(params.get(k) for k in ('district', 'taluk', 'village')):
+                village_codes = ()
+            else:
+                village_codes = lookup.resolve_village(params.get('district'), params.get('taluk'), params.get('village'))
+            if len(village_codes) != 3 or not all(village_codes):
+                return self.send(400, encode({ 'error': 'Unknown village (village_code=<district>/<taluk>/<village> or district, taluk, village names)' }))
+            status, body = lookup.lookup(village_codes, params['survey'], params.get('sdiv', '0'))
+        except Exception as e:
+            return self.send(502, encode({ 'error': f"{type(e).__name__}: {e}" }))
+        self.send(status, body)
+
+def parse_commandline_params():
+    parser = argparse.ArgumentParser(
+        prog='Patta Lookup Service',
+        description='Serve patta lookups by survey number over HTTP/JSON from an in-memory LRU in front of patta.db'
+    )
+    parser.add_argument("--host", dest='host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument("--port", dest='port', type=int, default=8081, help="Port to listen on")
+    parser.add_argument("--db", dest='db_path', default=PATTA_DB, help="SQLite database with the patta details")
+    parser.add_argument("--cache-size", dest='cache_size', type=int, default=10_000, help="Lookups kept in memory")
+    parser.add_argument("--answer-ttl", dest='answer_ttl', type=float, default=300, help="Seconds a lookup is answered from memory before patta.db is read again")
+    parser.add_argument("--fetchers", dest='fetchers', type=int, default=2, help="Loader threads (eservices fetches)")
+    parser.add_argument("--verbose", action='store_true', dest='verbose', default=False, help="Print the per lookup progress (captchas, SQLite hits ...)")
+    parser.add_argument("--no-fetch", action='store_false', dest='fetch', default=True, help="Only answer from patta.db, never fetch from eservices")
+    parser.add_argument("--captcha-model", dest='captcha_model', help="Classifier model (see tn_classifier.py) tried before tesseract")
+    parser.add_argument("--cache-ttl", dest='cache_ttl', type=float, default=30, help="Days before a cached code lookup is fetched again (0 = no cache)")
+    tn_http.add_transport_arguments(parser)
+    tn_archive.add_archive_arguments(parser)
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    tn_patta.initialize_sqlite_db(args.db_path)
+    tn_http.configure_from_args(args)
+    tn_captcha.set_captcha_model(args.captcha_model)
+    tn_archive.configure_from_args(args)
+    if args.cache_ttl > 0:
+        tn_cache.set_lookup_cache(LookupCache(ttl=args.cache_ttl * 24 * 3600))
+    lookup = PattaLookup(args.cache_size, args.fetchers, args.fetch, args.answer_ttl)
+    server = LookupServer((args.host, args.port), lookup)
+    print(f"Serving patta lookups from {args.db_path} on http://{args.host}:{args.port}/patta", flush=True)
+    try:
+        ## The loaders share tn_patta's progress prints, one line per lookup stage is only log spam here
+        with open(os.devnull, 'w') if not args.verbose else contextlib.nullcontext(sys.stdout) as out, contextlib.redirect_stdout(out):
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        lookup.close()
+        print(f"Lookups: {lookup.summary()}")
+        tn_patta.patta_store.close()
+        if tn_cache.lookup_cache: tn_cache.lookup_cache.close()
+        if tn_archive.response_archive: tn_archive.response_archive.close()
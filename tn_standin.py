@@ -0,0 +1,243 @@
+import json
+import time
+import random
+import string
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from io import BytesIO
+from pathlib import Path
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http.cookies import SimpleCookie
+
+#---------------------------------------------------------------------------------
+# Local stand-in for the eservices land records pages, for offline end-to-end runs
+# and benchmarks of tn_patta / tn_tslr (point them at it with --base-url).
+#
+# ajax.html and the extract pages are served from fixtures recorded off the real
+# site (tn_patta.py / tn_tslr.py --record DIR). simpleCaptcha.html serves a
+# synthetic captcha (or one from a corpus of accepted captchas) and remembers the
+# answer per session, like the real server. Latency, captcha rejections and 5xx
+# errors can be injected.
+#
+#   python tn_standin.py fixtures/ --port 8080 --latency 200 --reject-rate 0.1
+#   python tn_patta.py ... --base-url http://localhost:8080/eservicesnew/land/
+#---------------------------------------------------------------------------------
+CAPTCHA_PAGE = 'simpleCaptcha.html'
+CHECK_PAGES = { 'chittaCheckNewRural_en.html', 'chittaCheckNewUrban_en.html' }
+EXTRACT_PAGES = { 'chittaExtract_en.html', 'chittaExtractUrbanTaluk_en.html' }
+IGNORED_PARAMS = { 'captcha', 'lan' } ## Not part of the fixture key
+SESSION_COOKIE = 'JSESSIONID'
+HTML_CONTENT_TYPE = 'text/html;charset=UTF-8'
+CAPTCHA_CHARSET = string.ascii_uppercase + string.digits
+LAND_FORM_PAGE = '''<html><body><form name="landForm" method="post">
+<font class="normal_text_red">{error}</font>
+</form></body></html>'''
+
+def fixture_key(method, page, params):
+    params = sorted((k, v) for k, v in params if k not in IGNORED_PARAMS)
+    return f"{method} {page}?{urllib.parse.urlencode(params)}"
+
+def fixture_path(fixture_dir, key):
+    return Path(fixture_dir) / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+def save_fixture(fixture_dir, key, status, content_type, body):
+    path = fixture_path(fixture_dir, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({ 'key': key, 'status': status, 'content_type': content_type, 'body': body }), encoding='utf-8')
+    return path
+
+def load_fixtures(fixture_dir):
+    fixtures = {}
+    for path in Path(fixture_dir).glob('*.json'):
+        fixture = json.loads(path.read_text(encoding='utf-8'))
+        fixtures[fixture['key']] = fixture
+    return fixtures
+
+def parse_params(query):
+    ## Blank values (e.g. pattaNo=) are part of the key
+    return urllib.parse.parse_qsl(query, keep_blank_values=True)
+
+def get_page(url):
+    return urllib.parse.urlsplit(url).path.rsplit('/', 1)[-1]
+
+#---------------------------------------------------------------------------------
+# Recorder: a requests response hook (installed by tn_http.new_session for --record)
+#---------------------------------------------------------------------------------
+class FixtureRecorder:
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+
+    def __call__(self, response, *args, **kwargs):
+        request = response.request
+        page = get_page(request.url)
+        if page == CAPTCHA_PAGE or response.status_code >= 500:
+            return response
+        if page in EXTRACT_PAGES and 'name="landForm"' in response.text:
+            return response ## Rejected captcha, not a response for this survey
+        params = parse_params(urllib.parse.urlsplit(request.url).query)
+        if request.method == 'POST' and request.body:
+            body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+            params += parse_params(body)
+        save_fixture(self.fixture_dir, fixture_key(request.method, page, params), response.status_code,
+            response.headers.get('Content-Type', 'text/html'), response.text)
+        return response
+
+#---------------------------------------------------------------------------------
+# Stand-in server
+#---------------------------------------------------------------------------------
+def synthetic_captcha(value):
+    from PIL import Image, ImageDraw
+    img = Image.new('L', (120, 40), 255)
+    draw = ImageDraw.Draw(img)
+    for idx, char in enumerate(value):
+        draw.text((8 + idx * 18, 12 + random.randint(-3, 3)), char, fill=random.randint(0, 60))
+    for _ in range(40): ## Speckle noise
+        draw.point((random.randrange(120), random.randrange(40)), fill=random.randint(0, 255))
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+class CaptchaSource:
+    def __init__(self, corpus_dir=None):
+        ## Corpus files are named <VALUE>_<ns>.png (tn_classifier.save_sample)
+        self.corpus = [ (p.name.split('_')[0], p) for p in Path(corpus_dir).glob('*.png') ] if corpus_dir else []
+
+    def next(self):
+        if self.corpus:
+            value, path = random.choice(self.corpus)
+            return value, path.read_bytes()
+        value = ''.join(random.choices(CAPTCHA_CHARSET, k=6))
+        return value, synthetic_captcha(value)
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, captcha_source, latency=0.0, jitter=0.0, reject_rate=0.0, error_rate=0.0, accept_any=False):
+        super().__init__(address, StandinHandler)
+        self.fixtures = fixtures
+        self.captcha_source = captcha_source
+        self.latency = latency
+        self.jitter = jitter
+        self.reject_rate = reject_rate
+        self.error_rate = error_rate
+        self.accept_any = accept_any
+        self.lock = threading.Lock()
+        self.captchas = {} # session id => captcha value
+        self.stats = Counter()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def summary(self):
+        print(f"Stand-in: {dict(self.stats)}")
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' ## Keep-alive, like the real server
+
+    def log_message(self, format, *args):
+        pass
+
+    def get_session(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        if SESSION_COOKIE in cookie:
+            return cookie[SESSION_COOKIE].value, False
+        return hashlib.sha1(f"{time.time_ns()}{random.random()}".encode()).hexdigest()[:32].upper(), True
+
+    def send(self, status, content_type, body, session_id=None):
+        if isinstance(body, str):
+            ## Recorded bodies are the text as decoded by requests: encode them back the same way
+            charset = content_type.split('charset=')[-1].strip() if 'charset=' in content_type else 'ISO-8859-1'
+            body = body.encode(charset)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if session_id:
+            self.send_header('Set-Cookie', f"{SESSION_COOKIE}={session_id}; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_request(parse_params(urllib.parse.urlsplit(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = parse_params(urllib.parse.urlsplit(self.path).query)
+        params += parse_params(self.rfile.read(length).decode('utf-8'))
+        self.handle_request(params)
+
+    def handle_request(self, params):
+        server = self.server
+        page = get_page(self.path)
+        session_id, new_session = self.get_session()
+        cookie = session_id if new_session else None
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        if delay > 0: time.sleep(delay)
+        if random.random() < server.error_rate:
+            server.count('errors')
+            return self.send(503, HTML_CONTENT_TYPE, 'Service Unavailable', cookie)
+
+        if page == CAPTCHA_PAGE:
+            value, content = server.captcha_source.next()
+            with server.lock:
+                server.captchas[session_id] = value
+            server.count('captchas')
+            return self.send(200, 'image/png', content, cookie)
+
+        if page in EXTRACT_PAGES:
+            with server.lock:
+                expected = server.captchas.pop(session_id, None) ## A captcha is good for one extract
+            captcha = dict(params).get('captcha', '')
+            if not server.accept_any and (expected is None or captcha != expected):
+                server.count('captcha_mismatch')
+                return self.send(200, HTML_CONTENT_TYPE, LAND_FORM_PAGE.format(error='Please enter valid captcha'), cookie)
+            if random.random() < server.reject_rate:
+                server.count('captcha_rejected')
+                return self.send(200, HTML_CONTENT_TYPE, LAND_FORM_PAGE.format(error='Please enter valid captcha'), cookie)
+
+        fixture = server.fixtures.get(fixture_key(self.command, page, params))
+        if fixture:
+            server.count('fixtures')
+            return self.send(fixture['status'], fixture['content_type'], fixture['body'], cookie)
+        if page in CHECK_PAGES:
+            server.count('check_pages')
+            return self.send(200, HTML_CONTENT_TYPE, '<html><body></body></html>', cookie)
+        server.count('missing')
+        return self.send(404, HTML_CONTENT_TYPE, f"No fixture for {fixture_key(self.command, page, params)}", cookie)
+
+def parse_commandline_params():
+    parser = argparse.ArgumentParser(
+        prog='eservices Stand-in',
+        description='Serve recorded eservices land records responses locally'
+    )
+    parser.add_argument("fixture_dir", help="Directory of fixtures recorded with --record")
+    parser.add_argument("--host", dest='host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument("--port", dest='port', type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--latency", dest='latency', type=float, default=0, help="Added latency per request in ms")
+    parser.add_argument("--jitter", dest='jitter', type=float, default=0, help="Latency jitter (+/-) in ms")
+    parser.add_argument("--reject-rate", dest='reject_rate', type=float, default=0, help="Fraction of correct captchas to reject")
+    parser.add_argument("--error-rate", dest='error_rate', type=float, default=0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--captcha-corpus", dest='captcha_corpus', help="Serve captchas from this corpus (<VALUE>_*.png) instead of synthetic ones")
+    parser.add_argument("--accept-any", action='store_true', dest='accept_any', default=False, help="Accept any captcha value (leaves out the OCR accuracy)")
+    return parser.parse_args()
+
+#---------------------------------------------------------------------------------
+# Main Logic Begins here...
+#---------------------------------------------------------------------------------
+if __name__ == "__main__":
+    args = parse_commandline_params()
+    fixtures = load_fixtures(args.fixture_dir)
+    server = StandinServer((args.host, args.port), fixtures, CaptchaSource(args.captcha_corpus),
+        latency=args.latency / 1000, jitter=args.jitter / 1000, reject_rate=args.reject_rate,
+        error_rate=args.error_rate, accept_any=args.accept_any)
+    print(f"Serving {len(fixtures)} fixture(s) on http://{args.host}:{args.port}/eservicesnew/land/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.summary()
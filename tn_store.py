@@ -0,0 +1,461 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+PATTA_DB = 'patta.db'
+TSLR_DB = 'tslr.db'
+
+#---------------------------------------------------------------------------------
+# SQLite store for the patta details, normalized into pattas, their owners
+# (with an FTS5 index over the names) and survey lines.
+#
+# One long-lived connection per thread (WAL, so readers never block the writer),
+# statements are cached by sqlite3 per connection, upserts are batched in a single
+# transaction and the survey lines are indexed by patta and by land type / area.
+#
+# Every patta carries when it was last fetched and a hash of its parsed content,
+# so a refresh re-fetches the stalest pattas first and only rewrites the changed.
+#---------------------------------------------------------------------------------
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',  # 64 MB
+    'PRAGMA mmap_size=268435456', # 256 MB
+]
+
+## Survey numbers (and patta numbers) are only unique within a village,
+## village_code is '<district>/<taluk>/<village>' codes
+SELECT_PATTA_SQL = """
+    SELECT * from patta_survey_details
+    WHERE village_code = ? AND patta_number in
+        (SELECT patta_number from patta_survey_details WHERE village_code = ? AND survey_identifier = ?)
+"""
+
+UPSERT_PATTA_SQL = """
+    INSERT INTO patta_survey_details VALUES(:village_code, :survey_identifier, :patta_number, :land_type,
+        :hectares, :ares, :cents, :amount, :details
+    )
+    ON CONFLICT(village_code, survey_identifier) DO UPDATE SET
+        patta_number = excluded.patta_number, land_type = excluded.land_type, hectares = excluded.hectares,
+        ares = excluded.ares, cents = excluded.cents, amount = excluded.amount, details = excluded.details
+"""
+
+SURVEY_COLUMNS = ['land_type', 'hectares', 'ares', 'cents', 'amount', 'details']
+
+## unicode61 splits words at the Tamil vowel signs and the virama (ராமன் => ர, மன), so
+## they are token characters: U+0BBE-U+0BCD and the au length mark U+0BD7
+TAMIL_TOKENCHARS = ''.join(chr(c) for c in range(0x0BBE, 0x0BCE)) + '\u0BD7'
+OWNERS_FTS_TOKENIZE = f"unicode61 remove_diacritics 0 tokenchars '{TAMIL_TOKENCHARS}'"
+
+class SqliteStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.initialize()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=256, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS: conn.execute(pragma)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def release(self):
+        ## Closes the calling thread's connection, for threads that end before the store is closed
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            return
+        self.local.conn = None
+        with self.lock:
+            if conn in self.connections: self.connections.remove(conn)
+        conn.close()
+
+    def initialize(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections: conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+class PattaStore(SqliteStore):
+    def __init__(self, db_path=PATTA_DB):
+        super().__init__(db_path)
+
+    def initialize(self):
+        conn = self.connection()
+        with conn:
+            columns = [ row['name'] for row in conn.execute('PRAGMA table_info(patta_survey_details)') ]
+            if columns and ('village_code' not in columns or 'people' in columns):
+                ## Database from before the normalized schema: the people JSON of every survey row
+                ## moves to pattas / patta_owners, rows from before village_code get village ''
+                print(f"Migrating {self.db_path}: Normalizing patta_survey_details into pattas / patta_owners")
+                village_code = 'village_code' if 'village_code' in columns else "''"
+                conn.execute('DROP INDEX IF EXISTS idx_patta_survey_details_patta_number')
+                conn.execute('DROP INDEX IF EXISTS idx_patta_survey_details_village_patta')
+                conn.execute('ALTER TABLE patta_survey_details RENAME TO patta_survey_details_old')
+                self.create_tables(conn)
+                conn.execute(f'''INSERT INTO patta_survey_details SELECT {village_code}, survey_identifier, patta_number,
+                    {', '.join(SURVEY_COLUMNS)} FROM patta_survey_details_old''')
+                people_rows = conn.execute(f'SELECT DISTINCT {village_code} AS village_code, patta_number, people FROM patta_survey_details_old').fetchall()
+                for row in people_rows:
+                    self.save_owners(conn, row['village_code'], row['patta_number'], json.loads(row['people'] or '{}'))
+                if village_code == "''":
+                    ## Neither a village keyed lookup nor a refresh can reach them
+                    print(f"Migrating {self.db_path}: {len(people_rows)} patta(s) without a village code, crawl their villages again to replace them")
+                conn.execute('DROP TABLE patta_survey_details_old')
+            else:
+                pattas_columns = [ row['name'] for row in conn.execute('PRAGMA table_info(pattas)') ]
+                if pattas_columns and 'fetched_at' not in pattas_columns:
+                    ## Pattas from before the refresh mode: fetched when they were last written, hash unknown
+                    print(f"Migrating {self.db_path}: Adding fetched_at / content_hash to pattas")
+                    conn.execute('ALTER TABLE pattas ADD COLUMN fetched_at REAL NOT NULL DEFAULT 0')
+                    conn.execute('ALTER TABLE pattas ADD COLUMN content_hash CHAR(64)')
+                    conn.execute('UPDATE pattas SET fetched_at = updated_at')
+                self.create_tables(conn)
+
+    def create_tables(self, conn):
+        conn.execute('''
+          CREATE TABLE IF NOT EXISTS pattas
+          (
+            village_code       TEXT              NOT NULL,
+            patta_number       INT               NOT NULL,
+            updated_at         REAL              NOT NULL,
+            fetched_at         REAL              NOT NULL DEFAULT 0,
+            content_hash       CHAR(64),
+            PRIMARY KEY (village_code, patta_number)
+          );
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_pattas_fetched_at ON pattas (fetched_at, village_code, patta_number)')
+        conn.execute('''
+          CREATE TABLE IF NOT EXISTS patta_owners
+          (
+            village_code       TEXT              NOT NULL,
+            patta_number       INT               NOT NULL,
+            owner_idx          INT               NOT NULL,
+            name               TEXT              NOT NULL,
+            PRIMARY KEY (village_code, patta_number, owner_idx)
+          );
+        ''')
+        ## External content FTS5 index over the owner names, kept in sync by triggers.
+        ## An index from before the Tamil token characters is rebuilt with them
+        fts_sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'patta_owners_fts'").fetchone()
+        rebuild = fts_sql is not None and 'tokenchars' not in fts_sql['sql']
+        if rebuild:
+            print(f"Migrating {self.db_path}: Rebuilding patta_owners_fts with the Tamil token characters")
+            conn.execute('DROP TABLE patta_owners_fts')
+        conn.execute(f'''
+          CREATE VIRTUAL TABLE IF NOT EXISTS patta_owners_fts USING fts5
+            (name, content='patta_owners', content_rowid='rowid', tokenize="{OWNERS_FTS_TOKENIZE}")
+        ''')
+        if rebuild:
+            conn.execute("INSERT INTO patta_owners_fts(patta_owners_fts) VALUES ('rebuild')")
+        conn.execute('''
+          CREATE TRIGGER IF NOT EXISTS patta_owners_ai AFTER INSERT ON patta_owners BEGIN
+            INSERT INTO patta_owners_fts(rowid, name) VALUES (new.rowid, new.name);
+          END
+        ''')
+        conn.execute('''
+          CREATE TRIGGER IF NOT EXISTS patta_owners_ad AFTER DELETE ON patta_owners BEGIN
+            INSERT INTO patta_owners_fts(patta_owners_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+          END
+        ''')
+        conn.execute('''
+          CREATE TRIGGER IF NOT EXISTS patta_owners_au AFTER UPDATE ON patta_owners BEGIN
+            INSERT INTO patta_owners_fts(patta_owners_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+            INSERT INTO patta_owners_fts(rowid, name) VALUES (new.rowid, new.name);
+          END
+        ''')
+        conn.execute('''
+          CREATE TABLE IF NOT EXISTS patta_survey_details
+          (
+            village_code       TEXT              NOT NULL,
+            survey_identifier  TEXT              NOT NULL,
+            patta_number       INT NOT NULL,
+            land_type          VARCHAR(10)       NOT NULL,
+            hectares           DECIMAL(10,2)     NOT NULL,
+            ares               DECIMAL(10,2)     NOT NULL,
+            cents              DECIMAL(10,2)     NOT NULL,
+            amount             DECIMAL(10,2)     NOT NULL,
+            details            VARCHAR(256),
+            PRIMARY KEY (village_code, survey_identifier)
+          );
+        ''')
+        ## Survey identifiers the server has no patta for, never fetched again
+        conn.execute('''
+          CREATE TABLE IF NOT EXISTS patta_not_found
+          (
+            village_code       TEXT              NOT NULL,
+            survey_identifier  TEXT              NOT NULL,
+            fetched_at         REAL              NOT NULL,
+            PRIMARY KEY (village_code, survey_identifier)
+          );
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_patta_survey_details_village_patta ON patta_survey_details (village_code, patta_number)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_patta_survey_details_land_type_cents ON patta_survey_details (land_type, cents)')
+
+    @staticmethod
+    def get_content_hash(patta_details):
+        ## Of the parsed details, keys / values as strings so that it does not depend on the parser's types
+        content = {
+            'patta_number': str(patta_details['patta_number']),
+            'people': { str(k): v for k, v in patta_details['people'].items() },
+            'survey': { sidx: { k: str(v) for k, v in s.items() } for sidx, s in patta_details['survey'].items() },
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def save_owners(self, conn, village_code, patta_number, people, content_hash=None):
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO pattas VALUES(?, ?, ?, ?, ?)', (village_code, patta_number, now, now, content_hash))
+        conn.execute('DELETE FROM patta_owners WHERE village_code = ? AND patta_number = ?', (village_code, patta_number))
+        conn.executemany('INSERT INTO patta_owners VALUES(?, ?, ?, ?)',
+            ((village_code, patta_number, int(idx), name) for idx, name in people.items()))
+
+    def select_owners(self, village_code, patta_number):
+        rows = self.connection().execute('SELECT owner_idx, name FROM patta_owners WHERE village_code = ? AND patta_number = ? ORDER BY owner_idx',
+            (village_code, patta_number))
+        return { row['owner_idx']: row['name'] for row in rows }
+
+    def select_patta_details(self, survey_identifier, village_code=''):
+        rows = self.connection().execute(SELECT_PATTA_SQL, (village_code, village_code, survey_identifier)).fetchall()
+        if not rows:
+            return None
+        patta_details = { 'survey': {} }
+        for row in rows:
+            patta_details['survey'][row['survey_identifier']] = { k: row[k] for k in SURVEY_COLUMNS }
+        patta_details['patta_number'] = rows[0]['patta_number'] # Same for all rows!
+        patta_details['people'] = self.select_owners(village_code, rows[0]['patta_number'])
+        return patta_details
+
+    def mark_not_found(self, survey_identifier, village_code=''):
+        conn = self.connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO patta_not_found VALUES(?, ?, ?)', (village_code, survey_identifier, time.time()))
+
+    def is_not_found(self, survey_identifier, village_code=''):
+        row = self.connection().execute('SELECT 1 FROM patta_not_found WHERE village_code = ? AND survey_identifier = ?',
+            (village_code, survey_identifier)).fetchone()
+        return row is not None
+
+    def select_survey_pattas(self, village_code=''):
+        ## survey identifier => patta number of every survey line stored for the village
+        rows = self.connection().execute('SELECT survey_identifier, patta_number FROM patta_survey_details WHERE village_code = ?', (village_code,))
+        return { row['survey_identifier']: row['patta_number'] for row in rows }
+
+    @staticmethod
+    def get_rows(patta_details, village_code=''):
+        for sidx, s in patta_details['survey'].items():
+            sdetails = {
+                'village_code': village_code,
+                'patta_number': patta_details['patta_number'],
+                'survey_identifier': sidx,
+            }
+            sdetails.update(s)
+            sdetails['cents'] = str(sdetails['cents'])
+            yield sdetails
+
+    def upsert_patta_details(self, patta_details_list, village_code=''):
+        ## All pattas in one transaction; re-fetched pattas / surveys replace the earlier rows
+        conn = self.connection()
+        with conn:
+            for p in patta_details_list:
+                self.save_owners(conn, village_code, p['patta_number'], p['people'], self.get_content_hash(p))
+            conn.executemany(UPSERT_PATTA_SQL, (row for p in patta_details_list for row in self.get_rows(p, village_code)))
+
+    #-----------------------------------------------------------------------------
+    # Refresh: stalest pattas first, only the changed ones are rewritten
+    #-----------------------------------------------------------------------------
+    def select_stale_pattas(self, fetched_before, after=None, limit=100):
+        ## Keyset pagination on (fetched_at, village_code, patta_number): refreshed pattas
+        ## drop out (fetched_at >= fetched_before), failed ones are not picked again
+        after = after or (-1.0, '', -1)
+        rows = self.connection().execute('''
+            SELECT p.fetched_at, p.village_code, p.patta_number, p.content_hash,
+                (SELECT MIN(s.survey_identifier) FROM patta_survey_details s
+                    WHERE s.village_code = p.village_code AND s.patta_number = p.patta_number) AS survey_identifier
+            FROM pattas p
+            WHERE p.fetched_at < ? AND (p.fetched_at, p.village_code, p.patta_number) > (?, ?, ?)
+            ORDER BY p.fetched_at, p.village_code, p.patta_number
+            LIMIT ?
+        ''', (fetched_before, *after, limit))
+        return rows.fetchall()
+
+    def select_survey_lines(self, village_code, patta_number):
+        rows = self.connection().execute('SELECT * FROM patta_survey_details WHERE village_code = ? AND patta_number = ?',
+            (village_code, patta_number))
+        return { row['survey_identifier']: { k: row[k] for k in SURVEY_COLUMNS } for row in rows }
+
+    @staticmethod
+    def get_changes(old_people, old_survey, patta_details):
+        def line(s):
+            return (s['land_type'], float(s['cents'] or 0), float(s['amount'] or 0), s['details'] or '')
+        people, survey = set(patta_details['people'].values()), patta_details['survey']
+        return {
+            'owners_added': sorted(people - set(old_people.values())),
+            'owners_removed': sorted(set(old_people.values()) - people),
+            'surveys_added': sorted(set(survey) - set(old_survey)),
+            'surveys_removed': sorted(set(old_survey) - set(survey)),
+            'surveys_modified': sorted(sidx for sidx in set(survey) & set(old_survey) if line(survey[sidx]) != line(old_survey[sidx])),
+        }
+
+    def refresh_patta_details(self, patta_details, village_code=''):
+        ## (status, changes): new / changed (rewritten, with what changed) or unchanged (only fetched_at)
+        patta_number = patta_details['patta_number']
+        content_hash = self.get_content_hash(patta_details)
+        conn = self.connection()
+        row = conn.execute('SELECT content_hash FROM pattas WHERE village_code = ? AND patta_number = ?', (village_code, patta_number)).fetchone()
+        if row and row['content_hash'] == content_hash:
+            with conn:
+                conn.execute('UPDATE pattas SET fetched_at = ? WHERE village_code = ? AND patta_number = ?', (time.time(), village_code, patta_number))
+            return 'unchanged', None
+        changes = None
+        if row:
+            changes = self.get_changes(self.select_owners(village_code, patta_number), self.select_survey_lines(village_code, patta_number), patta_details)
+        with conn:
+            self.save_owners(conn, village_code, patta_number, patta_details['people'], content_hash)
+            conn.executemany(UPSERT_PATTA_SQL, self.get_rows(patta_details, village_code))
+            ## Survey lines no longer on the patta (moved to another one: that patta gets them when fetched)
+            placeholders = ', '.join('?' * len(patta_details['survey']))
+            conn.execute(f'DELETE FROM patta_survey_details WHERE village_code = ? AND patta_number = ? AND survey_identifier NOT IN ({placeholders})',
+                (village_code, patta_number, *patta_details['survey']))
+        if not row:
+            return 'new', None
+        ## Hash unknown (stored before the refresh mode) and nothing differs: only the hash was missing
+        return ('changed' if any(changes.values()) or row['content_hash'] else 'unchanged'), changes
+
+    #-----------------------------------------------------------------------------
+    # Query API: pattas by owner name (FTS5 prefix match), patta number, village
+    # (or a '<district>/<taluk>' prefix), land type and area range in cents
+    #-----------------------------------------------------------------------------
+    @staticmethod
+    def get_name_query(name):
+        ## Every word must match, as a prefix of an owner name token
+        return ' '.join('"' + token.replace('"', '""') + '"*' for token in name.split())
+
+    def query_pattas(self, name=None, patta_number=None, village_code=None, land_type=None, min_cents=None, max_cents=None, limit=100):
+        joins, where, params = [], [], []
+        if name:
+            joins.append('JOIN patta_owners o ON o.village_code = p.village_code AND o.patta_number = p.patta_number')
+            joins.append('JOIN patta_owners_fts f ON f.rowid = o.rowid')
+            where.append('patta_owners_fts MATCH ?')
+            params.append(self.get_name_query(name))
+        if land_type or min_cents is not None or max_cents is not None:
+            joins.append('JOIN patta_survey_details s ON s.village_code = p.village_code AND s.patta_number = p.patta_number')
+            if land_type:
+                where.append('s.land_type = ?')
+                params.append(land_type)
+            if min_cents is not None:
+                where.append('s.cents >= ?')
+                params.append(min_cents)
+            if max_cents is not None:
+                where.append('s.cents <= ?')
+                params.append(max_cents)
+        if village_code:
+            ## Exact village, or every village under a district / taluk prefix
+            where.append('(p.village_code = ? OR p.village_code GLOB ?)')
+            params += [ village_code, village_code.rstrip('/') + '/*' ]
+        if patta_number is not None:
+            where.append('p.patta_number = ?')
+            params.append(patta_number)
+        sql = f'''
+            SELECT DISTINCT p.village_code, p.patta_number FROM pattas p {' '.join(joins)}
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            LIMIT ?
+        '''
+        ## No ORDER BY: sorting would need every match, without it the scan stops at the limit
+        conn = self.connection()
+        results = []
+        for row in sorted(conn.execute(sql, (*params, limit)).fetchall(), key=tuple):
+            surveys = conn.execute('SELECT * FROM patta_survey_details WHERE village_code = ? AND patta_number = ?',
+                (row['village_code'], row['patta_number'])).fetchall()
+            results.append({
+                'village_code': row['village_code'], 'patta_number': row['patta_number'],
+                'people': self.select_owners(row['village_code'], row['patta_number']),
+                'survey': { s['survey_identifier']: { k: s[k] for k in SURVEY_COLUMNS } for s in surveys },
+            })
+        return results
+
+#---------------------------------------------------------------------------------
+# TSLR results + crawl state, keyed by the village and (ward, block, survey, subdiv)
+#---------------------------------------------------------------------------------
+TSLR_KEY_COLUMNS = ['district_code', 'taluk_code', 'village_code', 'ward_no', 'block_code', 'survey_no', 'subdiv_no']
+TSLR_PAYLOAD_KEYS = ['districtCode', 'talukCode', 'villageCode', 'wardNo', 'blockCode', 'surveyNo', 'subdivNo']
+
+class TslrStore(SqliteStore):
+    def __init__(self, db_path=TSLR_DB):
+        super().__init__(db_path)
+
+    def initialize(self):
+        key_columns = ', '.join(f'{c} TEXT NOT NULL' for c in TSLR_KEY_COLUMNS)
+        primary_key = ', '.join(TSLR_KEY_COLUMNS)
+        conn = self.connection()
+        with conn:
+            conn.execute(f'''
+              CREATE TABLE IF NOT EXISTS tslr_details
+              (
+                {key_columns},
+                details            TEXT              NOT NULL,
+                fetched_at         REAL              NOT NULL,
+                PRIMARY KEY ({primary_key})
+              );
+            ''')
+            ## status = done / not_found (no record on the server, not retried) / failed
+            conn.execute(f'''
+              CREATE TABLE IF NOT EXISTS tslr_crawl_state
+              (
+                {key_columns},
+                status             VARCHAR(10)       NOT NULL,
+                attempts           INT               NOT NULL DEFAULT 0,
+                last_error         TEXT,
+                updated_at         REAL              NOT NULL,
+                PRIMARY KEY ({primary_key})
+              );
+            ''')
+
+    @staticmethod
+    def get_key(payload):
+        return tuple(payload[k] for k in TSLR_PAYLOAD_KEYS)
+
+    def _update_state(self, conn, key, status, error=None):
+        conn.execute(f'''
+            INSERT INTO tslr_crawl_state VALUES({', '.join('?' * len(TSLR_KEY_COLUMNS))}, ?, 1, ?, ?)
+            ON CONFLICT({', '.join(TSLR_KEY_COLUMNS)}) DO UPDATE SET
+                status = excluded.status, attempts = attempts + 1, last_error = excluded.last_error, updated_at = excluded.updated_at
+        ''', (*key, status, error, time.time()))
+
+    def save_details(self, payload, details):
+        key = self.get_key(payload)
+        conn = self.connection()
+        with conn:
+            conn.execute(f'INSERT OR REPLACE INTO tslr_details VALUES({", ".join("?" * len(TSLR_KEY_COLUMNS))}, ?, ?)',
+                (*key, json.dumps(details), time.time()))
+            self._update_state(conn, key, 'done')
+
+    def mark_failed(self, payload, error):
+        conn = self.connection()
+        with conn:
+            self._update_state(conn, self.get_key(payload), 'failed', error)
+
+    def mark_not_found(self, payload):
+        conn = self.connection()
+        with conn:
+            self._update_state(conn, self.get_key(payload), 'not_found')
+
+    def get_keys(self, status):
+        rows = self.connection().execute(f'SELECT {", ".join(TSLR_KEY_COLUMNS)} FROM tslr_crawl_state WHERE status = ?', (status,))
+        return { tuple(row) for row in rows }
+
+    def select_details(self, payload):
+        where = ' AND '.join(f'{c} = ?' for c in TSLR_KEY_COLUMNS)
+        row = self.connection().execute(f'SELECT details FROM tslr_details WHERE {where}', self.get_key(payload)).fetchone()
+        return json.loads(row['details']) if row else None
@@ -1,20 +1,30 @@
-import requests
-from bs4 import BeautifulSoup
 import lxml.html
-from PIL import Image
-from io import BytesIO
-import pytesseract
-import xmltodict, json
-import re
-from itertools import product
-
-ESERVICES_URL = "https://eservices.tn.gov.in/eservicesnew/land/ajax.html"
-
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import time
+import queue
+import argparse
+import itertools
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import tn_captcha
+import tn_http
+from tn_http import land_url
+import tn_metrics
+from tn_metrics import stage_timings
+import tn_cache
+import tn_archive
+from tn_store import TslrStore, TSLR_DB, TSLR_PAYLOAD_KEYS
+from tn_parse import extract_tslr_details, classify_response, get_xml_values, SUCCESS, NOT_FOUND, SESSION_EXPIRED
+from tn_cache import cached_get, LookupCache
+
+## Relative to the land records base URL (tn_http.land_url, --base-url)
+AJAX_PAGE = "ajax.html"
+TSLR_CHECK_PAGE = 'chittaCheckNewUrban_en.html?lan=en'
+TSLR_EXTRACT_PAGE = 'chittaExtractUrbanTaluk_en.html?lan=en'
 
 def get_url(s, url):
-    return s.get(url, verify=False)
+    return s.get(url)
 
 def get_form_controls(html):
     tree = lxml.html.fromstring(html)
@@ -24,65 +34,6 @@ def get_form_controls(html):
          data[e.get('name')] = e.get('value')
     return data
 
-def table_to_2d(table_tag):
-    rowspans = []  # track pending rowspans
-    rows = table_tag.find_all('tr')
-
-    # first scan, see how many columns we need
-    colcount = 0
-    for r, row in enumerate(rows):
-        cells = row.find_all(['td', 'th'], recursive=False)
-        # count columns (including spanned).
-        # add active rowspans from preceding rows
-        # we *ignore* the colspan value on the last cell, to prevent
-        # creating 'phantom' columns with no actual cells, only extended
-        # colspans. This is achieved by hardcoding the last cell width as 1.
-        # a colspan of 0 means “fill until the end” but can really only apply
-        # to the last cell; ignore it elsewhere.
-        colcount = max(
-            colcount,
-            sum(int(c.get('colspan', 1)) or 1 for c in cells[:-1]) + len(cells[-1:]) + len(rowspans))
-        # update rowspan bookkeeping; 0 is a span to the bottom.
-        rowspans += [int(c.get('rowspan', 1)) or len(rows) - r for c in cells]
-        rowspans = [s - 1 for s in rowspans if s > 1]
-
-    # it doesn't matter if there are still rowspan numbers 'active'; no extra
-    # rows to show in the table means the larger than 1 rowspan numbers in the
-    # last table row are ignored.
-
-    # build an empty matrix for all possible cells
-    table = [[None] * colcount for row in rows]
-
-    # fill matrix from row data
-    rowspans = {}  # track pending rowspans, column number mapping to count
-    for row, row_elem in enumerate(rows):
-        span_offset = 0  # how many columns are skipped due to row and colspans
-        for col, cell in enumerate(row_elem.find_all(['td', 'th'], recursive=False)):
-            # adjust for preceding row and colspans
-            col += span_offset
-            while rowspans.get(col, 0):
-                span_offset += 1
-                col += 1
-
-            # fill table data
-            rowspan = rowspans[col] = int(cell.get('rowspan', 1)) or len(rows) - row
-            colspan = int(cell.get('colspan', 1)) or colcount - col
-            # next column is offset by the colspan
-            span_offset += colspan - 1
-            value = cell.get_text()
-            for drow, dcol in product(range(rowspan), range(colspan)):
-                try:
-                    table[row + drow][col + dcol] = value
-                    rowspans[col + dcol] = rowspan
-                except IndexError:
-                    # rowspan or colspan outside the confines of the table
-                    pass
-
-        # update rowspan bookkeeping
-        rowspans = {c: s - 1 for c, s in rowspans.items() if s > 1}
-
-    return table
-
 def get_district_codes(html):
     tree = lxml.html.fromstring(html)
     district_dict = {}
@@ -103,157 +54,322 @@ def get_payload(payload):
     # payload['wardNo'] = '013'      ## BM
     return payload
 
-def get_ward_numbers(payload):
-    url = f"{ESERVICES_URL}?page=getWard&districtCode={payload['districtCode']}&talukCode={payload['talukCode']}&villageCode={payload['villageCode']}"
-    response = requests.get(url, verify=False)
-    # print(tsnum_response.text)
-    xpars = xmltodict.parse(response.text)
-    xpars_json = json.loads(json.dumps(xpars))
-    blockCodes = [ v['wardCode'] for v in xpars_json['root']['ward'] ]
-    return blockCodes
-
-def get_block_codes(payload):
-    url = f"{ESERVICES_URL}?page=getBlocks&districtCode={payload['districtCode']}&talukCode={payload['talukCode']}&villageCode={payload['villageCode']}&wardNo={payload['wardNo']}"
-    response = requests.get(url, verify=False)
-    # print(tsnum_response.text)
-    xpars = xmltodict.parse(response.text)
-    xpars_json = json.loads(json.dumps(xpars))
-    blockCodes = [ v['blockCode'] for v in xpars_json['root']['block'] ]
-    return blockCodes
-
-def get_survey_nos(payload):
-    url = f"{ESERVICES_URL}?page=getUrTalSurveyNo&districtCode={payload['districtCode']}&talukCode={payload['talukCode']}&villageCode={payload['villageCode']}&wardCode={payload['wardNo']}&blockCode={payload['blockCode']}"
-    response = requests.get(url, verify=False)
-    # print(tsnum_response.text)
-    xpars = xmltodict.parse(response.text)
-    xpars_json = json.loads(json.dumps(xpars))
-    surveyNos = [ v['surveyNo'] for v in xpars_json['root']['survey'] ]
-    return surveyNos
-
-def get_subdivision_numbers(payload):
-    url = f"{ESERVICES_URL}?page=getUrbanTalukSubdivNo&districtCode={payload['districtCode']}&talukCode={payload['talukCode']}&villageCode={payload['villageCode']}&wardCode={payload['wardNo']}&blockCode={payload['blockCode']}&surveyno={payload['surveyNo']}"
-    response = requests.get(url, verify=False)
-    # print(tsnum_response.text)
-    xpars = xmltodict.parse(response.text)
-    xpars_json = json.loads(json.dumps(xpars))
-    if type(xpars_json['root']['subdiv']) is dict:
-        subdivNos = [ xpars_json['root']['subdiv']['subdivcode'] ]
-    else:
-        subdivNos = [ v['subdivcode'] for v in xpars_json['root']['subdiv'] ]
-    return subdivNos
+def get_ward_numbers(s, payload):
+    params = { 'page': 'getWard', 'districtCode': payload['districtCode'], 'talukCode': payload['talukCode'], 'villageCode': payload['villageCode'] }
+    response_text = cached_get(s, land_url(AJAX_PAGE), params)
+    return get_xml_values(response_text, 'ward/wardCode')
+
+def get_block_codes(s, payload):
+    params = { 'page': 'getBlocks', 'districtCode': payload['districtCode'], 'talukCode': payload['talukCode'], 'villageCode': payload['villageCode'],
+        'wardNo': payload['wardNo'] }
+    response_text = cached_get(s, land_url(AJAX_PAGE), params)
+    return get_xml_values(response_text, 'block/blockCode')
+
+def get_survey_nos(s, payload):
+    params = { 'page': 'getUrTalSurveyNo', 'districtCode': payload['districtCode'], 'talukCode': payload['talukCode'], 'villageCode': payload['villageCode'],
+        'wardCode': payload['wardNo'], 'blockCode': payload['blockCode'] }
+    response_text = cached_get(s, land_url(AJAX_PAGE), params)
+    return get_xml_values(response_text, 'survey/surveyNo')
+
+def get_subdivision_numbers(s, payload):
+    params = { 'page': 'getUrbanTalukSubdivNo', 'districtCode': payload['districtCode'], 'talukCode': payload['talukCode'], 'villageCode': payload['villageCode'],
+        'wardCode': payload['wardNo'], 'blockCode': payload['blockCode'], 'surveyno': payload['surveyNo'] }
+    response_text = cached_get(s, land_url(AJAX_PAGE), params)
+    return get_xml_values(response_text, 'subdiv/subdivcode')
 
 def get_captcha_value(s, payload):
     identifier = get_identifier(payload)
-    captcha_value = get_captcha_value_internal(s)
-    while not validate_captcha(captcha_value, identifier):
-        captcha_value = get_captcha_value_internal(s)
-    return captcha_value
-
-def validate_captcha(captcha_value, identifier):
-    if len(captcha_value) != 6:
-        print(f"Invalid Captcha {identifier} - {captcha_value} [Length != 6]")
-        return False
-    # Seems like Only Alphanumeric is allowed!
-    # if bool(re.match(r'^[A-Z]+$', captcha_value)):
-    #     print(f"Invalid Captcha {identifier} - {captcha_value} [Only Alphabetic]")
-    #     return True
-    # Should not be only numeric
-    if bool(re.match(r'^[0-9]+$', captcha_value)):
-        print(f"Invalid Captcha {identifier} - {captcha_value} [Only Numeric]")
-        return False
-    # Valid charset = [0-9A-Z] (no lower case).
-    if not bool(re.match(r'^[A-Z0-9]+$', captcha_value)):
-        print(f"Invalid Captcha {identifier} - {captcha_value} [Not Alphanumeric]")
-        return False
-    return True
-
-def get_captcha_value_internal(s):
-    captcha = get_url(s, 'https://eservices.tn.gov.in/eservicesnew/land/simpleCaptcha.html')
-    img = Image.open(BytesIO(captcha.content))
-    # gray = img.convert('L')
-    # bw = gray.point(lambda x: 0 if x < 1 else 255, '1')
-    # img.show()
-    captcha_value = pytesseract.image_to_string(img).strip()
-    return captcha_value
+    return tn_captcha.get_captcha_value(s, identifier, debug=True)
 
 def get_identifier(payload):
     return f"[W{payload['wardNo']}/B{payload['blockCode']}/S{payload['surveyNo']}/{payload['subdivNo']}]"
 
 
-def get_details(s, payload, retry=False):
+def get_details(s, payload, captcha_value=None):
+    ## One captcha + extract POST: (session, captcha value, response, details, response class)
     identifier = get_identifier(payload)
-    captcha_value = get_captcha_value(s, payload)
+    captcha_value = captcha_value or get_captcha_value(s, payload)
     payload['captcha'] = captcha_value
     # print(f'Captcha Text = [{captcha_value}] // Payload = {payload}')
-    tslr_extract_url = 'https://eservices.tn.gov.in/eservicesnew/land/chittaExtractUrbanTaluk_en.html?lan=en'
-    final_response = s.post(tslr_extract_url, data=payload, verify=False)
+    with stage_timings.time('extract_post'):
+        final_response = s.post(land_url(TSLR_EXTRACT_PAGE), data=payload)
     # print(f'Final Response Status = {final_response.status_code}')
 
-    soup = BeautifulSoup(final_response.text, 'lxml')
-    if soup.find('tbody'):
-        tds = soup.find("tbody").find_all("td")
-        # Load table from td and th!
-        # tables = soup.find_all('table')
-        # table_tag = [ table for table in tables if table.find('thead')]
-        # print(f'{len(table_tag)} table(s) found with thead')
-        # if table_tag:
-        #     table = table_to_2d(table_tag[0])
-        details = {
-            'block_code': tds[1].get_text().strip(),
-            'old_survey_no': tds[4].get_text().strip(),
-            'door_no': tds[5].get_text().strip(),
-            'land_type': tds[6].get_text().strip(),
-            'land_sub_type': tds[7].get_text().strip(),
-            'addl_details': tds[20].get_text().strip(),
-            'remarks': tds[22].get_text().strip()
-        }
-        print(f"Survey Number {identifier} = {details}")
-        return True
-    elif retry == True:
-        # print log only if retry is True
-        details = { 'error': 'not_found', 'captcha': captcha_value, 'status': final_response.status_code }
+    with stage_timings.time('parse'):
+        details = extract_tslr_details(final_response.text)
+        response_class = classify_response(final_response.status_code, final_response.text, details)
+    if details:
         print(f"Survey Number {identifier} = {details}")
-    # By Default.... return False
-    return False
+        with stage_timings.time('store'):
+            key_payload = { k: payload[k] for k in TSLR_PAYLOAD_KEYS }
+            tn_archive.archive_response('tslr', '/'.join(key_payload.values()), key_payload, final_response.text)
+    elif response_class == SESSION_EXPIRED:
+        tn_http.prime_session(s, land_url(TSLR_CHECK_PAGE))
+    return s, captcha_value, final_response, details, response_class
+
+def new_session():
+    return tn_http.new_session(land_url(TSLR_CHECK_PAGE))
+
+### One session (cookies + captcha) per worker thread, as the server keeps the captcha per session
+class SessionPool:
+    def __init__(self, factory=None):
+        self.factory = factory or new_session
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []
+
+    def get(self):
+        s = getattr(self.local, 'session', None)
+        if s is None:
+            s = self.local.session = self.factory()
+            with self.lock:
+                self.sessions.append(s)
+        return s
+
+    @contextmanager
+    def checkout(self, identifier=None):
+        ## Captcha is solved inline by get_details
+        yield self.get(), None
+
+    def close(self):
+        with self.lock:
+            for s in self.sessions: s.close()
+            self.sessions = []
+
+def walk_frontier(s, payload, ward_numbers):
+    ## Yields one independent payload per (ward, block, survey, subdiv), one lookup at a time
+    for wardNumber in ward_numbers:
+        payload = dict(payload, wardNo=wardNumber)
+        blockCodes = get_block_codes(s, payload) # blockCode = '0014' ('A2') or '0011' (B233)
+        print(f"Number of Block Codes in Ward [W{wardNumber}]: {len(blockCodes)}")
+        for blockCode in blockCodes:
+            payload = dict(payload, blockCode=blockCode)
+            surveyNos = get_survey_nos(s, payload)
+            print(f"Number of Survey Numbers in Block [W{wardNumber}/B{blockCode}]: {len(surveyNos)}")
+            for surveyNo in surveyNos:
+                payload = dict(payload, surveyNo=surveyNo)
+                for subdivNo in get_subdivision_numbers(s, payload):
+                    yield dict(payload, subdivNo=subdivNo)
+
+#---------------------------------------------------------------------------------
+# Streaming frontier: the block / survey / subdiv lookups of every ward fan out
+# over `lookups` threads (one metadata session each), and every subdivision is
+# handed to the crawl as soon as its survey is known instead of after the walk
+# reaches it. Deeper lookups are taken first, so the first items arrive after one
+# lookup per level, while the remaining lookups overlap with the extracts.
+#---------------------------------------------------------------------------------
+FRONTIER_LEVELS = [ # lookup, payload key of its values
+    (get_block_codes, 'blockCode'),
+    (get_survey_nos, 'surveyNo'),
+    (get_subdivision_numbers, 'subdivNo'),
+]
+FRONTIER_DONE = None
+
+class FrontierStream:
+    def __init__(self, payload, ward_numbers, lookups=4):
+        self.tasks = queue.PriorityQueue() # (-level, sequence, level, payload)
+        self.items = queue.Queue()         # payloads, an exception or FRONTIER_DONE
+        self.sequence = itertools.count()
+        self.sessions = SessionPool(tn_http.new_session) ## ajax.html needs no primed session
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = 0
+        for wardNumber in ward_numbers:
+            self.submit(0, dict(payload, wardNo=wardNumber))
+        if not self.pending:
+            self.items.put(FRONTIER_DONE)
+        self.threads = [ threading.Thread(target=self.run, name=f"lookup-{i}", daemon=True) for i in range(lookups) ]
+        for t in self.threads: t.start()
+
+    def submit(self, level, payload):
+        with self.lock:
+            self.pending += 1
+        self.tasks.put((-level, next(self.sequence), level, payload))
+
+    def run(self):
+        while True:
+            _, _, level, payload = self.tasks.get()
+            if payload is None:
+                return
+            try:
+                if not self.stopped.is_set():
+                    self.expand(level, payload)
+            except Exception as e:
+                self.stopped.set()
+                self.items.put(e) ## Raised in the consumer, as the walk would have
+            finally:
+                ## Children are submitted before their parent is counted off
+                with self.lock:
+                    self.pending -= 1
+                    done = self.pending == 0
+                if done:
+                    self.items.put(FRONTIER_DONE)
+
+    def expand(self, level, payload):
+        lookup, key = FRONTIER_LEVELS[level]
+        values = lookup(self.sessions.get(), payload)
+        if level == 0:
+            print(f"Number of Block Codes in Ward [W{payload['wardNo']}]: {len(values)}")
+        elif level == 1:
+            print(f"Number of Survey Numbers in Block [W{payload['wardNo']}/B{payload['blockCode']}]: {len(values)}")
+        for value in values:
+            if level + 1 < len(FRONTIER_LEVELS):
+                self.submit(level + 1, dict(payload, **{ key: value }))
+            else:
+                self.items.put(dict(payload, **{ key: value }))
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self.items.get()
+                if item is FRONTIER_DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        ## Lookups still queued are dropped, the ones in flight finish
+        self.stopped.set()
+        for t in self.threads:
+            self.tasks.put((1, next(self.sequence), None, None))
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        self.sessions.close()
+
+def get_frontier(s, payload, ward_numbers, lookups=1):
+    ## Yields one independent payload per (ward, block, survey, subdiv)
+    if lookups <= 1:
+        return walk_frontier(s, payload, ward_numbers)
+    return iter(FrontierStream(payload, ward_numbers, lookups))
+
+def fetch_details(pool, payload, store=None):
+    ## Retried per response class (tn_captcha.EXTRACT_RETRIES): (details or None, response class)
+    identifier = get_identifier(payload)
+    def attempt():
+        with pool.checkout(identifier) as (s, captcha_value):
+            return get_details(s, payload, captcha_value=captcha_value)
+    with stage_timings.time('record'):
+        details, final_response, response_class = tn_captcha.extract_with_retries(attempt, identifier)
+        with stage_timings.time('store'):
+            if details:
+                if store: store.save_details(payload, details)
+            elif response_class == NOT_FOUND:
+                print(f"Survey Number {identifier} = {{'error': 'not_found', 'status': {final_response.status_code}}}")
+                if store: store.mark_not_found(payload)
+            else:
+                print(f"Unable to get details for {identifier} // {response_class}")
+                if store: store.mark_failed(payload, response_class)
+    return details, response_class
+
+def skip_completed(frontier, store):
+    ## Resume: only the identifiers that failed or were never attempted are fetched
+    completed = store.get_keys('done') | store.get_keys('not_found')
+    print(f"Resuming: {len(completed)} identifier(s) already completed")
+    for payload in frontier:
+        if store.get_key(payload) not in completed:
+            yield payload
+
+def crawl_item(pool, payload, store=None):
+    ## fetch_details, with any exception failing this item only: True when the item is completed
+    try:
+        details, response_class = fetch_details(pool, payload, store)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"Unable to get details for {get_identifier(payload)} // {error}")
+        if store: store.mark_failed(payload, error)
+        return False
+    return response_class in (SUCCESS, NOT_FOUND)
+
+def crawl(frontier, workers=1, ocr_workers=0, store=None, resume=False):
+    start = time.monotonic()
+    outcomes = Counter() # True: completed (done / not found), False: failed
+    if store and resume:
+        frontier = skip_completed(frontier, store)
+    if ocr_workers > 0:
+        ## Twice as many sessions as submitters, so captchas are solved while the POSTs are in flight
+        pool = tn_captcha.CaptchaStage([ new_session() for _ in range(2 * workers) ], ocr_workers=ocr_workers, debug=True)
+    else:
+        pool = SessionPool()
+    try:
+        if workers <= 1:
+            for payload in frontier:
+                outcomes[crawl_item(pool, payload, store)] += 1
+        else:
+            ## Keep a bounded number of items in flight so the frontier is enumerated lazily
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tslr') as executor:
+                in_flight = set()
+                for payload in frontier:
+                    in_flight.add(executor.submit(crawl_item, pool, payload, store))
+                    if len(in_flight) >= 2 * workers:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        outcomes.update(f.result() for f in done)
+                outcomes.update(f.result() for f in wait(in_flight).done)
+    finally:
+        pool.close()
+    elapsed = time.monotonic() - start
+    completed = outcomes[True]
+    print(f"Crawled {completed} records ({outcomes[False]} failed) in {elapsed:.1f}s with {workers} worker(s) // {completed / elapsed if elapsed else 0:.2f} records/sec")
+    return completed
+
+def parse_commandline_params():
+    def list_str(values):  ### Type in argparse to convert string to list!
+        return values.split(',')
+
+    parser = argparse.ArgumentParser(
+        prog='Extract TSLR',
+        description='Extract TSLR details for all subdivisions in the given wards'
+    )
+    parser.add_argument("-w", "--wards", dest='ward_numbers', type=list_str, default=['013'], help="Comma Separated Ward Numbers (all wards if empty)")
+    parser.add_argument("--workers", dest='workers', type=int, default=1, help="Number of concurrent sessions")
+    parser.add_argument("--lookups", dest='lookups', type=int, default=4, help="Concurrent ward/block/survey/subdiv lookups while the frontier is enumerated (1 = one at a time)")
+    parser.add_argument("--ocr-workers", dest='ocr_workers', type=int, default=0, help="Prefetch captchas with this many OCR processes (0 = inline)")
+    parser.add_argument("--captcha-model", dest='captcha_model', help="Classifier model (see tn_classifier.py) tried before tesseract")
+    parser.add_argument("--db", dest='db_path', default=TSLR_DB, help="SQLite database for the TSLR details and crawl state")
+    parser.add_argument("--resume", action='store_true', dest='resume', default=False, help="Skip identifiers already completed in the database")
+    parser.add_argument("--warm", action='store_true', dest='warm_cache', default=False, help="Only enumerate (and cache) the ward/block/survey/subdiv hierarchy")
+    parser.add_argument("--cache-ttl", dest='cache_ttl', type=float, default=30, help="Days before a cached lookup is fetched again (0 = no cache)")
+    parser.add_argument("--captcha-corpus", dest='captcha_corpus', help="Save accepted captchas to this directory for training")
+    tn_http.add_transport_arguments(parser)
+    tn_archive.add_archive_arguments(parser)
+    tn_metrics.add_profile_arguments(parser)
+    return parser.parse_args()
 
 #---------------------------------------------------------------------------------
 # Main Logic Begins here...
 #---------------------------------------------------------------------------------
 if __name__ == "__main__":
-
-    with requests.session() as s:
-        tslr_url = 'https://eservices.tn.gov.in/eservicesnew/land/chittaCheckNewUrban_en.html?lan=en'
-        response = get_url(s, tslr_url)
-        # print(response.status_code)
-        # print(s.cookies.get_dict())
-
-        s.headers.update({'referer': 'https://eservices.tn.gov.in/'})
-        # surveyNos = [9]
-        payload = get_payload({})
-
-        wardNumbers = get_ward_numbers(payload)
+    args = parse_commandline_params()
+    print(f"Args = {args}")
+    tn_http.configure_from_args(args)
+    tn_captcha.set_captcha_model(args.captcha_model)
+    tn_captcha.set_captcha_corpus(args.captcha_corpus)
+    tn_archive.configure_from_args(args)
+    if args.cache_ttl > 0:
+        tn_cache.set_lookup_cache(LookupCache(ttl=args.cache_ttl * 24 * 3600))
+    payload = get_payload({})
+
+    with tn_http.new_session() as s: ## Metadata (ajax.html) lookups, extracts use the worker sessions
+        wardNumbers = get_ward_numbers(s, payload)
         print(f"Number of Ward Numbers: {len(wardNumbers)}")
 
         # wardNumbers = ['010', '012', '013', '015'] # All wards for KULAVANIGARPURAM
-        wardNumbers = [ '013' ]
-        for wardNumber in wardNumbers:
-            payload['wardNo'] = wardNumber
-            blockCodes = get_block_codes(payload) # blockCode = '0014' ('A2') or '0011' (B233)
-            print(f"Number of Block Codes in Ward [W{wardNumber}]: {len(blockCodes)}")
-            # blockCodes = ['0011', '0014']
-            for blockCode in blockCodes:
-                payload['blockCode'] = blockCode
-                surveyNos = get_survey_nos(payload)
-                print(f"Number of Survey Numbers in Block [W{wardNumber}/B{blockCode}]: {len(surveyNos)}")
-                for surveyNo in surveyNos:
-                    payload['surveyNo'] = surveyNo
-                    subdiv_nos = get_subdivision_numbers(payload)
-                    for subdivNo in subdiv_nos:
-                        payload['subdivNo'] = subdivNo
-                        retval = get_details(s, payload)
-                        if not retval: retval = get_details(s, payload, retry=True) ## Try again
-                        if not retval:
-                            identifier = get_identifier(payload)
-                            print(f"Unable to get details for {identifier}")
-
-        print("All Completed!")
+        if args.ward_numbers and args.ward_numbers != ['']:
+            wardNumbers = [ w for w in args.ward_numbers if w in wardNumbers ]
+        if args.warm_cache:
+            num_items = sum(1 for _ in get_frontier(s, payload, wardNumbers, lookups=args.lookups))
+            print(f"Cached the hierarchy for {num_items} subdivision(s)")
+        else:
+            store = TslrStore(args.db_path)
+            crawl(get_frontier(s, payload, wardNumbers, lookups=args.lookups), workers=args.workers, ocr_workers=args.ocr_workers, store=store, resume=args.resume)
+            store.close()
+            tn_captcha.captcha_metrics.summary("Captcha Metrics")
+            if tn_http.rate_controller: tn_http.rate_controller.summary()
+            tn_metrics.report_profile(args)
+    if tn_cache.lookup_cache: tn_cache.lookup_cache.close()
+    if tn_archive.response_archive: tn_archive.response_archive.close()
+
+    print("All Completed!")